@@ -0,0 +1,210 @@
+"""Memory-bounded symmetrisation of MGIZA t3 tables for snake_glove.py.
+
+Both translation tables are parsed into integer-ID NumPy records and, when
+they do not fit in the memory budget together, partitioned on disk by their
+first word ID.  Each partition of the reverse table is sorted by (src, tgt)
+and the matching partition of the forward table is joined against it with a
+binary search, so only one partition is held in memory at a time.  The
+harmonic-mean and word filters are vectorized and the surviving pairs are
+written in the order of the forward table, as the former dict-of-dicts scan
+did.
+"""
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# one t3 line: key = first word ID << 32 | second word ID, probability, line number
+ROW = np.dtype([('key', '<i8'), ('val', '<f8'), ('line', '<i8')])
+# in-memory bytes per row while a partition is sorted and joined
+ROW_WORKING_BYTES = 64
+# estimated text bytes per t3 line, used to size the partitions
+LINE_BYTES = 20
+
+
+def ReadVcb(path):
+    """Words of a .vcb file in a list indexed by word ID; None for unused IDs."""
+    words = {}
+    with open(path, "r") as f:
+        for line in f:
+            item = line.strip().split(" ")
+            words[int(item[0])] = item[1]
+    vocab = [None] * (max(words) + 1 if words else 0)
+    for wid, word in words.items():
+        vocab[wid] = word
+    return vocab
+
+
+def _ParseT3(path, swap, chunk_bytes):
+    """Yield ROW arrays of the 'id1 id2 prob' lines of path, chunk by chunk.
+
+    The key is (id2, id1) when swap is set, so that both tables are keyed
+    on the same (word of language 2, word of language 1) pair.
+    """
+    line = 0
+    with open(path, "rb") as f:
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if not lines:
+                break
+            # a separator token after every line shows a line with a wrong field count, which would
+            # otherwise shift every later line of the chunk into the wrong columns
+            fields = np.array((b" | ".join(lines) + b" |").split())
+            if len(fields) != 4 * len(lines) or (fields[3::4] != b"|").any():
+                _RaiseBadLine(path, line, lines)
+            fields = fields.reshape(-1, 4)[:, :3]
+            first = fields[:, 1 if swap else 0].astype(np.int64)
+            second = fields[:, 0 if swap else 1].astype(np.int64)
+            rows = np.empty(len(fields), dtype=ROW)
+            rows['key'] = (first << 32) | second
+            rows['val'] = fields[:, 2].astype(np.float64)
+            rows['line'] = np.arange(line, line + len(fields))
+            line += len(fields)
+            yield rows
+
+
+def _RaiseBadLine(path, first_line, lines):
+    for i, text in enumerate(lines):
+        num_fields = len(text.split())
+        if num_fields != 3:
+            raise ValueError("{0}:{1}: expected 3 fields 'id1 id2 prob', found {2}".format(
+                path, first_line + i + 1, num_fields))
+
+
+class _Partitions:
+    """Rows split by the first word ID, in memory or in temporary files."""
+
+    def __init__(self, count, tmpdir, name):
+        self.count = count
+        if count == 1:
+            self.chunks = []
+        else:
+            self.paths = [os.path.join(tmpdir, "{0}.{1}".format(name, p)) for p in range(count)]
+            self.files = [open(path, "wb") for path in self.paths]
+
+    def add(self, rows):
+        if self.count == 1:
+            self.chunks.append(rows)
+            return
+        part = (rows['key'] >> 32) % self.count
+        order = np.argsort(part, kind='stable')
+        bounds = np.searchsorted(part[order], np.arange(self.count + 1))
+        rows = rows[order]
+        for p in range(self.count):
+            if bounds[p] < bounds[p + 1]:
+                rows[bounds[p]:bounds[p + 1]].tofile(self.files[p])
+
+    def close(self):
+        if self.count > 1:
+            for f in self.files:
+                f.close()
+
+    def read(self, p):
+        if self.count == 1:
+            return np.concatenate(self.chunks) if self.chunks else np.empty(0, dtype=ROW)
+        return np.fromfile(self.paths[p], dtype=ROW)
+
+
+def _VocabArrays(vocab):
+    """(present, isalpha) flags by word ID; never empty, so IDs can be clipped to 0."""
+    present = np.zeros(max(len(vocab), 1), dtype=bool)
+    alpha = np.zeros(max(len(vocab), 1), dtype=bool)
+    for wid, word in enumerate(vocab):
+        if word is not None:
+            present[wid] = True
+            alpha[wid] = word.isalpha()
+    return present, alpha
+
+
+def _JoinPartition(forward, reverse, threshold, svocab, tvocab):
+    """(line, source ID, target ID) of the forward rows that pass both filters."""
+    # the last occurrence of a key in the reverse table wins, as in a dict
+    reverse = reverse[np.lexsort((reverse['line'], reverse['key']))]
+    last = np.ones(len(reverse), dtype=bool)
+    last[:-1] = reverse['key'][1:] != reverse['key'][:-1]
+    keys = reverse['key'][last]
+    vals = reverse['val'][last]
+    if len(keys) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    pos = np.minimum(np.searchsorted(keys, forward['key']), len(keys) - 1)
+    found = keys[pos] == forward['key']
+    forward = forward[found]
+    value1 = vals[pos[found]]
+    value2 = forward['val']
+    with np.errstate(divide='ignore'):
+        hmean = 2 / ((1 / value1) + (1 / value2))
+    forward = forward[hmean > threshold]
+
+    sid = forward['key'] & 0xffffffff
+    tid = forward['key'] >> 32
+    spresent, salpha = svocab
+    tpresent, talpha = tvocab
+    sin = sid < len(spresent)
+    tin = tid < len(tpresent)
+    sidx = np.where(sin, sid, 0)
+    tidx = np.where(tin, tid, 0)
+    known = sin & tin & spresent[sidx] & tpresent[tidx] & (salpha[sidx] | talpha[tidx])
+    forward = forward[known]
+    return forward['line'], sid[known], tid[known]
+
+
+def SymmetriseDic(vcb1, vcb2, t3_1, t3_2, output, lang1, lang2, memory_mb=4096,
+        tmpdir=None, threshold=0.1):
+    """Write the lang1/lang2 dictionary of the word pairs whose harmonic mean
+    translation probability in both directions is above threshold.
+
+    t3_1 is the lang1-lang2 table, with (lang2 ID, lang1 ID) pairs, and t3_2
+    the lang2-lang1 table.  memory_mb bounds the rows held in memory; the
+    tables are partitioned in tmpdir when they need more.
+    """
+    start = time.time()
+    budget = memory_mb << 20
+    svocab_words = ReadVcb(vcb1)
+    tvocab_words = ReadVcb(vcb2)
+    svocab = _VocabArrays(svocab_words)
+    tvocab = _VocabArrays(tvocab_words)
+
+    total_bytes = os.path.getsize(t3_1) + os.path.getsize(t3_2)
+    count = max(1, math.ceil(total_bytes / LINE_BYTES * ROW_WORKING_BYTES / budget))
+    chunk_bytes = max(1 << 20, min(64 << 20, budget // 16))
+    workdir = tempfile.mkdtemp(prefix="symmetrise.", dir=tmpdir) if count > 1 else None
+    try:
+        forward = _Partitions(count, workdir, "forward")
+        reverse = _Partitions(count, workdir, "reverse")
+        num_lines = 0
+        for rows in _ParseT3(t3_1, False, chunk_bytes):
+            forward.add(rows)
+            num_lines += len(rows)
+        for rows in _ParseT3(t3_2, True, chunk_bytes):
+            reverse.add(rows)
+            num_lines += len(rows)
+        forward.close()
+        reverse.close()
+        parsed = time.time()
+
+        results = [_JoinPartition(forward.read(p), reverse.read(p), threshold, svocab, tvocab)
+            for p in range(count)]
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    lines = np.concatenate([r[0] for r in results])
+    order = np.argsort(lines, kind='stable')
+    sids = np.concatenate([r[1] for r in results])[order]
+    tids = np.concatenate([r[2] for r in results])[order]
+    with open(output, "wt") as dic:
+        dic.write(lang1 + "\t" + lang2 + "\n")
+        dic.writelines("{0}\t{1}\n".format(svocab_words[s], tvocab_words[t])
+            for s, t in zip(sids.tolist(), tids.tolist()))
+
+    elapsed = max(time.time() - start, 1e-9)
+    sys.stderr.write("symmetrise_dic: {0} t3 lines in {1:.1f}s ({2:.0f} lines/sec, parsing {3:.1f}s), "
+        "{4} partitions, {5} entries\n".format(num_lines, elapsed, num_lines / elapsed,
+        parsed - start, count, len(order)))
+    return len(order)
@@ -0,0 +1,33 @@
+"""Batched analogy and nearest-neighbour search over a normalized matrix."""
+import numpy as np
+
+
+def predict(W, ind1, ind2, ind3, split_size=100):
+    """Answer each analogy ind1:ind2 :: ind3:? with the closest row of W.
+
+    The three question words are excluded from their own candidates.  Rows
+    are processed split_size questions at a time to bound the size of the
+    (vocab x split_size) score matrix.
+    """
+    predictions = np.zeros(len(ind1), dtype=np.int64)
+    for start in range(0, len(ind1), split_size):
+        subset = slice(start, start + split_size)
+
+        pred_vec = W[ind2[subset], :] - W[ind1[subset], :] + W[ind3[subset], :]
+        #cosine similarity if input W has been normalized
+        dist = np.dot(W, pred_vec.T)
+
+        cols = np.arange(dist.shape[1])
+        dist[ind1[subset], cols] = -np.inf
+        dist[ind2[subset], cols] = -np.inf
+        dist[ind3[subset], cols] = -np.inf
+
+        predictions[subset] = np.argmax(dist, 0)
+    return predictions
+
+
+def topk(dist, k):
+    """Indices of the k largest entries of the 1-d dist, best first."""
+    k = min(k, len(dist))
+    a = np.argpartition(-dist, k - 1)[:k]
+    return a[np.argsort(-dist[a], kind='mergesort')]
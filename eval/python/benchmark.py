@@ -0,0 +1,268 @@
+"""Benchmark the eval/python hot paths on synthetic models.
+
+For every (vocab size, vector size) pair a synthetic vocab file, text vectors
+file, glove '.bin' file and CREC file are generated (and kept in --work_dir
+for reuse), then each phase is timed in a fresh process so that the peak RSS
+belongs to that configuration alone.  One JSON record per configuration is
+appended to --history; --compare reports the change against the previous
+record for the same configuration.
+
+    python eval/python/benchmark.py --vocab_size 100000 2000000 --vector_size 50 300
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import socket
+import subprocess
+import time
+import numpy as np
+
+from glove_vectors import BLOCK_ROWS, read_words, build_vocab, read_vectors, read_bin, normalize
+from questions import QUESTION_SETS, QUESTION_DIR, compile_questions
+from analogy import topk
+
+CREC = np.dtype([('word1', '<i4'), ('word2', '<i4'), ('val', '<f8')])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_size', default=[100000], type=int, nargs='+')
+    parser.add_argument('--vector_size', default=[50], type=int, nargs='+')
+    parser.add_argument('--crec_records', default=10000000, type=int,
+        help='number of records in the synthetic cooccurrence file')
+    parser.add_argument('--split_size', default=100, type=int)
+    parser.add_argument('--num_queries', default=100, type=int,
+        help='number of distance() style top-k queries')
+    parser.add_argument('--work_dir', default='bench_data', type=str)
+    parser.add_argument('--history', default='bench_history.jsonl', type=str)
+    parser.add_argument('--compare', action='store_true',
+        help='compare each result with the previous record of the same configuration')
+    parser.add_argument('--threshold', default=1.10, type=float,
+        help='slowdown ratio reported as a regression by --compare')
+    args = parser.parse_args()
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    ctx = multiprocessing.get_context('fork')
+    for vocab_size in args.vocab_size:
+        for vector_size in args.vector_size:
+            files = generate_files(args.work_dir, vocab_size, vector_size, args.crec_records)
+            with ctx.Pool(1) as pool:
+                phases, peak_rss = pool.apply(run_phases,
+                    (files, args.split_size, args.num_queries))
+            record = {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'commit': git_commit(),
+                'host': socket.gethostname(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'vocab_size': vocab_size,
+                'vector_size': vector_size,
+                'crec_records': args.crec_records,
+                'split_size': args.split_size,
+                'phases': phases,
+                'peak_rss_mb': peak_rss,
+            }
+            print_record(record)
+            if args.compare:
+                compare(record, read_history(args.history), args.threshold)
+            with open(args.history, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def generate_files(work_dir, vocab_size, vector_size, crec_records, seed=1):
+    """Write (or reuse) a synthetic vocab, text/bin vectors and CREC file.
+
+    The vocabulary contains every word of the English question set so that
+    the analogy phases see the real question mix.
+    """
+    prefix = os.path.join(work_dir, 'synth.v%d.d%d' % (vocab_size, vector_size))
+    files = {
+        'vocab': os.path.join(work_dir, 'synth.v%d.vocab.txt' % vocab_size),
+        'text': prefix + '.txt',
+        'bin': prefix + '.bin',
+        'crec': os.path.join(work_dir, 'synth.c%d.bin' % crec_records),
+    }
+    rng = np.random.default_rng(seed)
+
+    if not os.path.isfile(files['vocab']):
+        question_words = set()
+        for filename in QUESTION_SETS['en'][0]:
+            with open(os.path.join(QUESTION_DIR, filename), 'r') as f:
+                question_words.update(f.read().split())
+        words = sorted(question_words)[:vocab_size]
+        words += ['w%d' % i for i in range(vocab_size - len(words))]
+        rng.shuffle(words)
+        with open(files['vocab'], 'w') as f:
+            for i, word in enumerate(words):
+                f.write('%s %d\n' % (word, vocab_size - i))
+
+    if not os.path.isfile(files['text']) or not os.path.isfile(files['bin']):
+        words = read_words(files['vocab'])
+        # params are generated and written a block of rows at a time, and the text is exported from the file
+        with open(files['bin'], 'wb') as f:
+            for start in range(0, 2 * vocab_size, BLOCK_ROWS):
+                n = min(BLOCK_ROWS, 2 * vocab_size - start)
+                (rng.standard_normal((n, vector_size + 1)) / vector_size).tofile(f)
+        export_text(files['text'], words, bin_rows(files['bin'], vocab_size))
+
+    if not os.path.isfile(files['crec']):
+        with open(files['crec'], 'wb') as f:
+            chunk = 1000000
+            for start in range(0, crec_records, chunk):
+                n = min(chunk, crec_records - start)
+                cr = np.empty(n, dtype=CREC)
+                cr['word1'] = rng.integers(1, vocab_size + 1, n)
+                cr['word2'] = rng.integers(1, vocab_size + 1, n)
+                cr['val'] = rng.random(n)
+                cr.tofile(f)
+    return files
+
+
+def bin_rows(bin_file, vocab_size, block_rows=BLOCK_ROWS):
+    """Word + context vectors of a glove '.bin' file, one row at a time, mapped a block at a time."""
+    params = np.memmap(bin_file, dtype=np.float64, mode='r')
+    vector_size = params.size // (2 * vocab_size) - 1
+    params = params.reshape(2 * vocab_size, vector_size + 1)
+    for start in range(0, vocab_size, block_rows):
+        end = min(start + block_rows, vocab_size)
+        yield from params[start:end, :vector_size] + params[vocab_size + start:vocab_size + end, :vector_size]
+
+
+def export_text(filename, words, W):
+    """Write vectors the way glove's save_params does ('%lf' per value).
+
+    W may be any iterable of rows, such as bin_rows().
+    """
+    with open(filename, 'w') as f:
+        for word, vec in zip(words, W):
+            f.write(word + ' ' + ' '.join('%f' % x for x in vec) + '\n')
+
+
+def rss_mb():
+    with open('/proc/self/status', 'r') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024.0
+    return None
+
+
+def run_phases(files, split_size, num_queries):
+    """Time each phase; returns ({phase: {seconds, rss_mb}}, peak RSS in MB)."""
+    phases = {}
+
+    def record(name, start):
+        phases[name] = {'seconds': time.perf_counter() - start, 'rss_mb': rss_mb()}
+
+    t = time.perf_counter()
+    words = read_words(files['vocab'])
+    vocab, ivocab = build_vocab(words)
+    record('load_vocab', t)
+
+    t = time.perf_counter()
+    W = read_vectors(files['text'], vocab)
+    record('load_text', t)
+    del W
+
+    t = time.perf_counter()
+    W = read_bin(files['bin'], len(words))
+    record('load_bin', t)
+
+    t = time.perf_counter()
+    W = normalize(W)
+    record('normalize', t)
+
+    t = time.perf_counter()
+    questions = compile_questions(vocab, 'en')
+    record('compile_questions', t)
+
+    # the analogy loop of analogy.predict, with its stages timed separately
+    ind1, ind2, ind3, ind4 = questions['indices'].T
+    predictions = np.zeros(len(ind1), dtype=np.int64)
+    gemm = masking = argmax = 0.0
+    for start in range(0, len(ind1), split_size):
+        subset = slice(start, start + split_size)
+        t = time.perf_counter()
+        pred_vec = W[ind2[subset], :] - W[ind1[subset], :] + W[ind3[subset], :]
+        dist = np.dot(W, pred_vec.T)
+        gemm += time.perf_counter() - t
+        t = time.perf_counter()
+        cols = np.arange(dist.shape[1])
+        dist[ind1[subset], cols] = -np.inf
+        dist[ind2[subset], cols] = -np.inf
+        dist[ind3[subset], cols] = -np.inf
+        masking += time.perf_counter() - t
+        t = time.perf_counter()
+        predictions[subset] = np.argmax(dist, 0)
+        argmax += time.perf_counter() - t
+    for name, seconds in (('batch_gemm', gemm), ('masking', masking), ('argmax', argmax)):
+        phases[name] = {'seconds': seconds, 'rss_mb': rss_mb()}
+    phases['analogy_questions'] = len(ind1)
+    del dist
+
+    t = time.perf_counter()
+    for query in range(min(num_queries, len(words))):
+        dist = np.dot(W, W[query, :])
+        dist[query] = -np.inf
+        topk(dist, 100)
+    record('topk', t)
+
+    t = time.perf_counter()
+    export_text(files['text'] + '.export', words, W)
+    record('text_export', t)
+    os.remove(files['text'] + '.export')
+
+    t = time.perf_counter()
+    cr = np.fromfile(files['crec'], dtype=CREC)
+    cr['val'].sum()
+    record('crec_read', t)
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return phases, peak_rss
+
+
+def print_record(record):
+    print('vocab size: %d  vector size: %d' % (record['vocab_size'], record['vector_size']))
+    for name, phase in record['phases'].items():
+        if isinstance(phase, dict):
+            print('%20s  %10.3f s  %10.1f MB' % (name, phase['seconds'], phase['rss_mb']))
+    print('%20s  %25.1f MB' % ('peak rss', record['peak_rss_mb']))
+
+
+def read_history(filename):
+    if not os.path.isfile(filename):
+        return []
+    with open(filename, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(record, history, threshold):
+    """Print the per-phase time ratio against the last matching record."""
+    keys = ('vocab_size', 'vector_size', 'crec_records', 'split_size', 'host')
+    previous = [r for r in history if all(r.get(k) == record[k] for k in keys)]
+    if not previous:
+        print('No previous record for this configuration.')
+        return
+    previous = previous[-1]
+    print('Compared with %s (commit %s):' % (previous['time'], previous['commit']))
+    for name, phase in record['phases'].items():
+        old = previous['phases'].get(name)
+        if not isinstance(phase, dict) or not isinstance(old, dict) or old['seconds'] <= 0:
+            continue
+        ratio = phase['seconds'] / old['seconds']
+        print('%20s  %6.2fx%s' % (name, ratio, '  REGRESSION' if ratio > threshold else ''))
+
+
+if __name__ == "__main__":
+    main()
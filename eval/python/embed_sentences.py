@@ -0,0 +1,245 @@
+"""Embed every line of a (compressed) text file as a combination of its word vectors.
+
+distance() sums the normalized vectors of the words of one input line; this
+does the same for every line of a corpus, such as the lemma corpus or a
+Bitextor plain_text.xz.  The input (plain, or .gz / .bz2 / .xz by
+extension, '-' for stdin) is read in chunks of whole lines and handed to a
+process pool.  Each worker tokenizes its chunk as vocab_count does, resolves
+all its words at once through the vocabulary index, gathers their rows of the
+memory-mapped normalized matrix and reduces them per line with
+np.add.reduceat:
+
+    mean  average of the word vectors
+    sum   sum of the word vectors, as distance()
+    sif   average weighted by a / (a + p(word)), p from the vocab counts
+          (Arora et al.); --remove_pc also removes the projection on the
+          first principal component of the embeddings
+
+Row i of the output is line i of the input (zero when no word of the line
+is in the vocabulary).  The rows are little-endian float32, written by the
+workers straight into the memory-mapped output, with a JSON description in
+<output>.json; load_embeddings() maps them.
+
+    python eval/python/embed_sentences.py --vocab_file vocab.txt --vectors_file vectors.bin \
+        --input plain_text.xz --output plain_text.emb --mode sif --remove_pc 100000
+"""
+import argparse
+import bz2
+import gzip
+import json
+import lzma
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from glove_vectors import load_normalized, norm_cache_path
+from vocab_index import load_vocab_index
+
+FORMAT_VERSION = 1
+DTYPE = np.dtype('<f4')
+MODES = ('mean', 'sum', 'sif')
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open, '.lzma': lzma.open}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='vocab.txt', type=str)
+    parser.add_argument('--vectors_file', default='vectors.txt', type=str)
+    parser.add_argument('--input', required=True, type=str, help="text file, compressed by extension, or '-'")
+    parser.add_argument('--output', required=True, type=str)
+    parser.add_argument('--mode', default='mean', choices=MODES)
+    parser.add_argument('--sif_a', default=1e-3, type=float)
+    parser.add_argument('--remove_pc', default=0, type=int,
+        help='remove the first principal component, estimated on this many rows (0: off)')
+    parser.add_argument('--processes', default=None, type=int,
+        help='worker processes (default: all cores)')
+    parser.add_argument('--chunk_mb', default=4, type=int,
+        help='MB of text handed to a worker at a time')
+    args = parser.parse_args()
+
+    embed_file(args.input, args.vocab_file, args.vectors_file, args.output, args.mode, args.sif_a,
+        args.remove_pc, args.processes, args.chunk_mb << 20)
+    return 0
+
+
+def open_text(path):
+    """Binary stream of a plain or compressed text file; '-' is stdin."""
+    if path == '-':
+        return sys.stdin.buffer
+    opener = OPENERS.get(os.path.splitext(path)[1], open)
+    return opener(path, 'rb')
+
+
+def read_counts(vocab_file):
+    """Counts of the vocab_count output file, in rank order."""
+    with open(vocab_file, 'r') as f:
+        return np.array([int(x.rstrip().split(' ')[1]) for x in f], dtype=np.float64)
+
+
+def sif_weights(counts, a=1e-3):
+    """a / (a + p(word)) of every word."""
+    return (a / (a + counts / counts.sum())).astype(np.float32)
+
+
+def tokenize(data):
+    """(words, words per line) of a block of whole lines, split as get_word does."""
+    text = data.decode('utf-8', 'replace')
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    words = []
+    lengths = np.empty(len(lines), dtype=np.int64)
+    for i, line in enumerate(lines):
+        tokens = [w for w in line.replace('\r', '').replace('\t', ' ').split(' ') if w]
+        words.extend(tokens)
+        lengths[i] = len(tokens)
+    return words, lengths
+
+
+def embed_lines(W, ids, lengths, mode='mean', weights=None):
+    """(lines x dim) float32 embeddings of the word IDs of consecutive lines.
+
+    ids holds the IDs of all lines, -1 for unknown words, lengths the words
+    of each line; lines without a known word get a zero row.
+    """
+    known = ids >= 0
+    line_of = np.repeat(np.arange(len(lengths)), lengths)[known]
+    ids = ids[known]
+    counts = np.bincount(line_of, minlength=len(lengths))
+    out = np.zeros((len(lengths), W.shape[1]), dtype=np.float32)
+    if not len(ids):
+        return out
+    rows = np.take(W, ids, axis=0).astype(np.float32)
+    if mode == 'sif':
+        rows *= weights[ids, np.newaxis]
+    nonempty = counts > 0
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+    out[nonempty] = np.add.reduceat(rows, starts, axis=0)
+    if mode != 'sum':
+        out[nonempty] /= counts[nonempty, np.newaxis]
+    return out
+
+
+# per-worker state, set once by _init_worker
+_worker = {}
+
+def _init_worker(vocab_file, vectors_file, output, mode, sif_a):
+    vocab = load_vocab_index(vocab_file)
+    _worker.update(vocab=vocab, W=np.load(norm_cache_path(vectors_file), mmap_mode='r'), output=output,
+        mode=mode, weights=sif_weights(read_counts(vocab_file), sif_a) if mode == 'sif' else None)
+
+
+def _embed_chunk(data, first_row):
+    """Embed a chunk of lines into rows first_row.. of the output; returns (lines, words, known words)."""
+    words, lengths = tokenize(data)
+    ids = _worker['vocab'].lookup(words)
+    W = _worker['W']
+    emb = embed_lines(W, ids, lengths, _worker['mode'], _worker['weights'])
+    if len(emb):
+        out = np.memmap(_worker['output'], dtype=DTYPE, mode='r+', offset=first_row * W.shape[1] * DTYPE.itemsize,
+            shape=emb.shape)
+        out[:] = emb
+        out.flush()
+        del out
+    return len(lengths), len(words), int(np.count_nonzero(ids >= 0))
+
+
+def _read_chunks(f, chunk_bytes):
+    while True:
+        lines = f.readlines(chunk_bytes)
+        if not lines:
+            break
+        yield b''.join(lines), len(lines)
+
+
+def embed_file(input_file, vocab_file, vectors_file, output, mode='mean', sif_a=1e-3, remove_pc=0,
+        processes=None, chunk_bytes=4 << 20):
+    """Write the embeddings of every line of input_file and their description; returns the description."""
+    processes = processes or os.cpu_count()
+    start = time.time()
+    # the vocabulary index and normalized matrix caches are built once here and mapped by the workers
+    vocab = load_vocab_index(vocab_file)
+    dim = load_normalized(vectors_file, vocab).shape[1]
+    row_bytes = dim * DTYPE.itemsize
+    num_lines = num_words = num_known = 0
+    tmp_output = output + '.tmp'
+    last_report = start
+    with open(tmp_output, 'wb') as fout, open_text(input_file) as fin, ProcessPoolExecutor(processes,
+            initializer=_init_worker, initargs=(vocab_file, vectors_file, tmp_output, mode, sif_a)) as pool:
+        pending = deque()
+        rows = 0
+
+        def wait_next():
+            nonlocal num_lines, num_words, num_known, last_report
+            lines, words, known = pending.popleft().result()
+            num_lines += lines
+            num_words += words
+            num_known += known
+            if time.time() - last_report >= 10:
+                last_report = time.time()
+                sys.stderr.write("%d lines, %.0f lines/sec\n" % (num_lines, num_lines / (last_report - start)))
+
+        for data, lines in _read_chunks(fin, chunk_bytes):
+            # rows are assigned here, so the workers can write their chunks in any order
+            fout.truncate((rows + lines) * row_bytes)
+            pending.append(pool.submit(_embed_chunk, data, rows))
+            rows += lines
+            if len(pending) >= 2 * processes:
+                wait_next()
+        while pending:
+            wait_next()
+
+    meta = {
+        'format': FORMAT_VERSION,
+        'input': os.path.abspath(input_file) if input_file != '-' else '-',
+        'vocab_file': os.path.abspath(vocab_file),
+        'vectors_file': os.path.abspath(vectors_file),
+        'mode': mode,
+        'rows': num_lines,
+        'dim': dim,
+        'dtype': DTYPE.str,
+        'words': num_words,
+        'oov_words': num_words - num_known,
+    }
+    if mode == 'sif':
+        meta['sif_a'] = sif_a
+    if remove_pc and num_lines:
+        meta['principal_component'] = remove_principal_component(tmp_output, num_lines, dim, remove_pc).tolist()
+    with open(output + '.json', 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp_output, output)
+
+    elapsed = max(time.time() - start, 1e-9)
+    sys.stderr.write("Embedded %d lines (%d words, %d OOV) in %.1f s (%.0f lines/sec)\n" %
+        (num_lines, num_words, meta['oov_words'], elapsed, num_lines / elapsed))
+    return meta
+
+
+def remove_principal_component(path, rows, dim, sample_rows, block_rows=65536):
+    """Subtract from every row its projection on the first principal component of sample_rows rows."""
+    X = np.memmap(path, dtype=DTYPE, mode='r+', shape=(rows, dim))
+    sample = np.asarray(X[np.linspace(0, rows - 1, min(sample_rows, rows)).astype(np.int64)], dtype=np.float64)
+    u = np.linalg.svd(sample, full_matrices=False)[2][0].astype(np.float32)
+    for start in range(0, rows, block_rows):
+        block = X[start:start + block_rows]
+        block -= np.outer(block @ u, u)
+    X.flush()
+    return u
+
+
+def load_embeddings(path):
+    """Memory-map the embeddings written by embed_file; returns (matrix, description)."""
+    with open(path + '.json', 'r') as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT_VERSION:
+        raise ValueError("%s: unsupported embeddings format %r" % (path, meta.get('format')))
+    if not meta['rows']:
+        return np.empty((0, meta['dim']), dtype=meta['dtype']), meta
+    return np.memmap(path, dtype=meta['dtype'], mode='r', shape=(meta['rows'], meta['dim'])), meta
+
+
+if __name__ == "__main__":
+    sys.exit(main())
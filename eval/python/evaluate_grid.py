@@ -0,0 +1,157 @@
+"""Evaluate a grid of models on an analogy set in one process.
+
+The question set is compiled once per distinct vocabulary and the models are
+scored one after the other through analogy.predict, the next model being
+loaded in a background thread while the current one is scored.  Each model
+gets an .eval file with the report of evaluate.py / evaluate_wa.py, and a
+combined table of all models is printed and optionally written as TSV.
+
+    python eval/python/evaluate_grid.py --vocab_file vocab.txt --set fr \
+        --vectors_file glove.w5.d64.model.bin glove.w8.d64.model.bin \
+        --eval_file w5.d64.eval w8.d64.eval --table grid.tsv
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from glove_vectors import load_normalized
+from questions import QUESTION_SETS, fingerprint, load_questions, score_questions, print_report
+from tiled import plan_blocks, predict_tiled
+from vocab_index import load_vocab_index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default=['vocab.txt'], type=str, nargs='+',
+        help='one vocab file for all models, or one per model')
+    parser.add_argument('--vectors_file', required=True, type=str, nargs='+',
+        help="text vectors or glove '-binary' .bin files")
+    parser.add_argument('--eval_file', default=None, type=str, nargs='+',
+        help='report of each model (default: <vectors_file>.eval)')
+    parser.add_argument('--set', default='en', choices=sorted(QUESTION_SETS))
+    parser.add_argument('--table', default=None, type=str, help='also write the combined table as TSV')
+    parser.add_argument('--split_size', default=100, type=int)
+    parser.add_argument('--no_cache', action='store_true',
+        help='do not read or write the normalized matrix cache')
+    parser.add_argument('--memory', default=None, type=int,
+        help='score the memory-mapped matrix out of core in this many MB (see tiled.py)')
+    args = parser.parse_args()
+
+    vocab_files = args.vocab_file
+    if len(vocab_files) == 1:
+        vocab_files = vocab_files * len(args.vectors_file)
+    eval_files = args.eval_file or [f + '.eval' for f in args.vectors_file]
+    if len(vocab_files) != len(args.vectors_file) or len(eval_files) != len(args.vectors_file):
+        parser.error('give one --vocab_file and --eval_file per --vectors_file')
+
+    if args.memory is not None and args.no_cache:
+        parser.error('--memory needs the normalized matrix cache')
+    rows = evaluate_grid(args.vectors_file, vocab_files, eval_files, args.set,
+        args.split_size, not args.no_cache, args.memory)
+    print_table(rows, sys.stdout)
+    if args.table:
+        with open(args.table, 'w') as f:
+            write_tsv(rows, f)
+    return 0
+
+
+def load_vocabularies(vocab_files, set_name):
+    """{vocab file: (words, questions)}, compiling questions once per word list.
+
+    The word list of a vocab file is its VocabIndex.  Vocab files with the
+    same words in the same order share one index and one compiled question
+    set.
+    """
+    by_fingerprint = {}
+    loaded = {}
+    for vocab_file in dict.fromkeys(vocab_files):
+        words = load_vocab_index(vocab_file)
+        key = fingerprint(words)
+        if key not in by_fingerprint:
+            by_fingerprint[key] = (words, load_questions(words, set_name, vocab=words))
+        loaded[vocab_file] = by_fingerprint[key]
+    return loaded
+
+
+def summarize(questions, val):
+    """Accuracies of a scored question set, as in print_report."""
+    semantic = questions['semantic'][questions['category']]
+    seen = len(val)
+
+    def pct(mask):
+        n = np.count_nonzero(mask)
+        return 100.0 * np.count_nonzero(val[mask]) / n if n else float('nan')
+
+    return {
+        'seen': seen,
+        'total': int(questions['full_counts'].sum()),
+        'semantic': pct(semantic),
+        'syntactic': pct(~semantic),
+        'accuracy': pct(np.ones(seen, dtype=bool)),
+    }
+
+
+def evaluate_grid(vectors_files, vocab_files, eval_files, set_name='en', split_size=100, cache=True,
+        memory_mb=None):
+    """Score every model, write its .eval file and return one summary row per model.
+
+    With memory_mb, models are scored by tiled.predict_tiled within that
+    budget instead of analogy.predict.
+    """
+    vocabularies = load_vocabularies(vocab_files, set_name)
+
+    def load(i):
+        start = time.time()
+        W = load_normalized(vectors_files[i], vocabularies[vocab_files[i]][0], cache=cache)
+        return W, time.time() - start
+
+    rows = []
+    with ThreadPoolExecutor(1) as loader:
+        pending = loader.submit(load, 0) if vectors_files else None
+        for i, vectors_file in enumerate(vectors_files):
+            W, load_time = pending.result()
+            if i + 1 < len(vectors_files):
+                pending = loader.submit(load, i + 1)
+            questions = vocabularies[vocab_files[i]][1]
+            start = time.time()
+            if memory_mb is None:
+                val = score_questions(W, questions, split_size)
+            else:
+                ind1, ind2, ind3, ind4 = questions['indices'].T
+                val = ind4 == predict_tiled(W, ind1, ind2, ind3, *plan_blocks(memory_mb << 20, W.shape[1]))
+            score_time = time.time() - start
+            del W
+            with open(eval_files[i], 'w') as f:
+                print_report(questions, val, file=f)
+            row = summarize(questions, val)
+            row.update(model=vectors_file, load_seconds=load_time, score_seconds=score_time)
+            rows.append(row)
+            sys.stderr.write("%s: %.2f%% (load %.1f s, score %.1f s)\n" %
+                (vectors_file, row['accuracy'], load_time, score_time))
+    return rows
+
+
+COLUMNS = ('model', 'seen', 'total', 'semantic', 'syntactic', 'accuracy', 'load_seconds', 'score_seconds')
+
+
+def print_table(rows, f):
+    width = max([len('model')] + [len(os.path.basename(r['model'])) for r in rows])
+    f.write('%-*s %8s %8s %10s %10s %10s %8s %8s\n' % (width, 'model', 'seen', 'total',
+        'semantic', 'syntactic', 'accuracy', 'load s', 'score s'))
+    for r in rows:
+        f.write('%-*s %8d %8d %10.2f %10.2f %10.2f %8.1f %8.1f\n' % (width, os.path.basename(r['model']),
+            r['seen'], r['total'], r['semantic'], r['syntactic'], r['accuracy'],
+            r['load_seconds'], r['score_seconds']))
+
+
+def write_tsv(rows, f):
+    f.write('\t'.join(COLUMNS) + '\n')
+    for r in rows:
+        f.write('\t'.join(('%.4f' % r[c]) if isinstance(r[c], float) else str(r[c]) for c in COLUMNS) + '\n')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Shared loaders for GloVe vocab and vector files.
+
+The normalized matrix is cached next to the vectors file as
+``<vectors_file>.norm.npy`` so that later runs can memory-map it instead of
+re-parsing the text export.  ``<vectors_file>.norm.key`` holds the
+fingerprint of the word list the cache was written for.
+"""
+import hashlib
+import os
+import threading
+import numpy as np
+
+# rows normalized at once when the cache is written
+BLOCK_ROWS = 65536
+
+
+def read_words(vocab_file):
+    """Return the words of a vocab_count output file, in frequency-rank order."""
+    with open(vocab_file, 'r') as f:
+        return [x.rstrip().split(' ')[0] for x in f]
+
+
+def fingerprint(words):
+    """Digest of the word list; equal for vocab files with equal word order."""
+    h = hashlib.sha1()
+    for word in words:
+        h.update(word.encode('utf-8'))
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def build_vocab(words):
+    vocab = {w: idx for idx, w in enumerate(words)}
+    ivocab = {idx: w for idx, w in enumerate(words)}
+    return vocab, ivocab
+
+
+def as_vocab(words):
+    """words itself if it maps words to IDs (a VocabIndex or vocab dict), else the vocab dict of the list."""
+    return words if hasattr(words, 'get') else build_vocab(words)[0]
+
+
+def read_vectors(vectors_file, vocab):
+    """Read a text vectors file into a matrix whose rows follow vocab.
+
+    The '<unk>' row written by glove is skipped, as in the eval scripts.
+    """
+    W = None
+    with open(vectors_file, 'r') as f:
+        for line in f:
+            word, _, rest = line.rstrip().partition(' ')
+            if word == '<unk>':
+                continue
+            vals = np.array(rest.split(' '), dtype=np.float64)
+            if W is None:
+                W = np.zeros((len(vocab), len(vals)))
+            W[vocab[word], :] = vals
+    return W
+
+
+def read_bin(bin_file, vocab_size, model=2, rows=None):
+    """Read the word vectors from a glove '-binary' output file.
+
+    The file holds 2 * vocab_size rows of (vector_size + 1) doubles: word
+    vectors followed by context vectors, each with a trailing bias.  model
+    follows glove's '-model' option (1: word vectors, 2: word + context).
+    With rows, only the vectors of the rows most frequent words are read.
+    """
+    params = np.memmap(bin_file, dtype=np.float64, mode='r')
+    vector_size = params.size // (2 * vocab_size) - 1
+    params = params.reshape(2 * vocab_size, vector_size + 1)
+    rows = vocab_size if rows is None else min(rows, vocab_size)
+    W = np.array(params[:rows, :vector_size])
+    if model == 2:
+        W += params[vocab_size:vocab_size + rows, :vector_size]
+    return W
+
+
+def normalize(W):
+    """Scale each row of W to unit length, leaving all-zero rows at zero."""
+    d = np.sqrt(np.sum(W ** 2, 1))
+    d[d == 0] = 1
+    return W / d[:, np.newaxis]
+
+
+def write_normalized(vectors_file, words, output, block_rows=BLOCK_ROWS):
+    """Write the normalized matrix of vectors_file to the .npy file output.
+
+    Rows are normalized a block at a time into a memory-mapped output, so
+    neither the model nor its normalized copy has to fit in memory.
+    """
+    if vectors_file.endswith('.bin'):
+        vocab_size = len(words)
+        params = np.memmap(vectors_file, dtype=np.float64, mode='r')
+        vector_size = params.size // (2 * vocab_size) - 1
+        params = params.reshape(2 * vocab_size, vector_size + 1)
+        out = np.lib.format.open_memmap(output, mode='w+', dtype=np.float64, shape=(vocab_size, vector_size))
+        for start in range(0, vocab_size, block_rows):
+            stop = min(start + block_rows, vocab_size)
+            out[start:stop] = normalize(params[start:stop, :vector_size]
+                + params[vocab_size + start:vocab_size + stop, :vector_size])
+    else:
+        vocab = as_vocab(words)
+        out = None
+        with open(vectors_file, 'r') as f:
+            for line in f:
+                word, _, rest = line.rstrip().partition(' ')
+                if word == '<unk>':
+                    continue
+                vals = np.array(rest.split(' '), dtype=np.float64)
+                if out is None:
+                    out = np.lib.format.open_memmap(output, mode='w+', dtype=np.float64,
+                        shape=(len(words), len(vals)))
+                out[vocab[word], :] = vals
+        for start in range(0, len(words), block_rows):
+            out[start:start + block_rows] = normalize(out[start:start + block_rows])
+    out.flush()
+
+
+def norm_cache_path(vectors_file):
+    return vectors_file + '.norm.npy'
+
+
+def norm_key_path(vectors_file):
+    return vectors_file + '.norm.key'
+
+
+def tmp_path(path, suffix=''):
+    """Temporary name for writing path, unique to the process and thread, ending in suffix."""
+    return '%s.tmp.%d.%d%s' % (path, os.getpid(), threading.get_ident(), suffix)
+
+
+def _read_key(key_file):
+    try:
+        with open(key_file, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def load_normalized(vectors_file, words, cache=True):
+    """Return the normalized matrix for vectors_file, memory-mapped if cached.
+
+    The cache is rebuilt whenever it is older than vectors_file, or was
+    written for another word list (by fingerprint) or row count.
+    """
+    if cache:
+        cache_file = norm_cache_path(vectors_file)
+        key_file = norm_key_path(vectors_file)
+        key = fingerprint(words)
+        if (os.path.isfile(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(vectors_file)
+                and _read_key(key_file) == key):
+            W_norm = np.load(cache_file, mmap_mode='r')
+            if W_norm.shape[0] == len(words):
+                return W_norm
+
+        # the old key is dropped first and the new one written last, so a key never vouches
+        # for a matrix written for another word list
+        try:
+            os.remove(key_file)
+        except FileNotFoundError:
+            pass
+        tmp_file = tmp_path(cache_file, '.npy')
+        try:
+            write_normalized(vectors_file, words, tmp_file)
+            os.replace(tmp_file, cache_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+        tmp_file = tmp_path(key_file)
+        with open(tmp_file, 'w') as f:
+            f.write(key + '\n')
+        os.replace(tmp_file, key_file)
+        return np.load(cache_file, mmap_mode='r')
+    if vectors_file.endswith('.bin'):
+        return normalize(read_bin(vectors_file, len(words)))
+    return normalize(read_vectors(vectors_file, as_vocab(words)))
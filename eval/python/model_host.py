@@ -0,0 +1,271 @@
+"""Host a normalized model in shared memory for the worker processes of one box.
+
+A host process loads the normalized matrix once (from the '.norm.npy' cache
+of glove_vectors, a block at a time) into a multiprocessing.shared_memory
+segment together with its vocab_index.VocabIndex.  Workers attach by name
+and get zero-copy read-only NumPy views of the matrix, and the index as
+dict-like vocab / ivocab objects that can be passed to the eval functions.
+
+Every attachment takes a slot holding its pid in the segment header, under
+a file lock, so the host knows how many workers are attached; slots of dead
+workers are reclaimed.  On SIGTERM / SIGINT (or 'stop') the host refuses new
+attachments, waits up to --grace seconds for the attached workers to detach
+and unlinks the segment.
+
+    python eval/python/model_host.py serve --vocab_file vocab.txt --vectors_file vectors.bin --name glove_w8 &
+    python eval/python/tiled.py --shared glove_w8 --words paris
+    python eval/python/model_host.py status --name glove_w8
+    python eval/python/model_host.py stop --name glove_w8
+"""
+import argparse
+import fcntl
+import hashlib
+import os
+import signal
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+
+from glove_vectors import BLOCK_ROWS, load_normalized
+from vocab_index import VocabIndex, load_vocab_index
+
+MAGIC = 0x31304d4853564c47  # 'GLVSHM01'
+MAX_ATTACH = 1024
+# header words: magic, rows, dim, index bytes, host pid, closing, attached, then one pid per slot
+HEADER_WORDS = 7 + MAX_ATTACH
+ALIGN = 64
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve = sub.add_parser('serve', help='load a model and host it until SIGTERM / SIGINT')
+    serve.add_argument('--vocab_file', default='vocab.txt', type=str)
+    serve.add_argument('--vectors_file', default='vectors.txt', type=str)
+    serve.add_argument('--name', default=None, type=str, help='segment name (default: from the vectors file)')
+    serve.add_argument('--grace', default=30.0, type=float,
+        help='seconds to wait for attached workers at shutdown')
+    for command in ('status', 'stop'):
+        p = sub.add_parser(command)
+        p.add_argument('--name', required=True, type=str)
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        with attach(args.name, register=False) as model:
+            print('%s: %d x %d, host pid %d, %d attached %s%s' % (args.name, model.W.shape[0],
+                model.W.shape[1], model.host_pid, len(model.attached()), model.attached(),
+                ', closing' if model.closing else ''))
+        return 0
+    if args.command == 'stop':
+        with attach(args.name, register=False) as model:
+            os.kill(model.host_pid, signal.SIGTERM)
+        return 0
+
+    stop = []
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda signum, frame: stop.append(signum))
+    start = time.time()
+    words = load_vocab_index(args.vocab_file)
+    host = ModelHost(args.vectors_file, words, args.name)
+    sys.stderr.write("Hosting %s as %s: %d x %d, %.1f MB (%.1f s)\n" % (args.vectors_file, host.name,
+        len(words), host.W.shape[1], host.shm.size / 2.0 ** 20, time.time() - start))
+    print(host.name, flush=True)
+    while not stop:
+        signal.pause()
+    sys.stderr.write("%s: waiting for %d attached workers\n" % (host.name, len(host.attached())))
+    host.close(args.grace)
+    return 0
+
+
+def segment_name(vectors_file):
+    """Default segment name of a vectors file."""
+    return 'glove_' + hashlib.sha1(os.path.abspath(vectors_file).encode('utf-8')).hexdigest()[:12]
+
+
+def _lock_path(name):
+    return os.path.join(tempfile.gettempdir(), '%s.lock' % name)
+
+
+@contextmanager
+def _locked(name):
+    with open(_lock_path(name), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _open_segment(name):
+    """Attach to an existing segment without handing it to the resource tracker.
+
+    Before Python 3.13 every SharedMemory is registered with the resource
+    tracker, which unlinks it when the attaching process exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _layout(rows, dim, index_bytes):
+    """Byte offsets of the header, W and vocabulary index regions, and the total size."""
+    regions = [('header', HEADER_WORDS * 8), ('W', rows * dim * 8), ('index', index_bytes)]
+    layout = {}
+    pos = 0
+    for region, size in regions:
+        layout[region] = pos
+        pos += (size + ALIGN - 1) // ALIGN * ALIGN
+    return layout, max(pos, 1)
+
+
+class _Segment:
+    """Views of the regions of a segment."""
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        if self.header[0] != MAGIC:
+            raise ValueError('%s is not a glove model segment' % shm.name)
+        rows, dim, index_bytes = (int(x) for x in self.header[1:4])
+        layout, _ = _layout(rows, dim, index_bytes)
+        self.W = np.ndarray((rows, dim), dtype=np.float64, buffer=shm.buf, offset=layout['W'])
+        self.vocab = VocabIndex.from_buffer(shm.buf, layout['index'])
+        self.ivocab = self.vocab.ivocab
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def host_pid(self):
+        return int(self.header[4])
+
+    @property
+    def closing(self):
+        return bool(self.header[5])
+
+    def attached(self):
+        """pids of the live attachments, reclaiming the slots of dead processes."""
+        with _locked(self.name):
+            slots = self.header[7:]
+            for i in np.flatnonzero(slots):
+                try:
+                    os.kill(int(slots[i]), 0)
+                except ProcessLookupError:
+                    slots[i] = 0
+                except PermissionError:
+                    pass
+            self.header[6] = np.count_nonzero(slots)
+            return [int(pid) for pid in slots[slots != 0]]
+
+    def _release(self):
+        # views must go before the mapping can be closed
+        self.W = self.vocab = self.ivocab = self.header = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # the caller still holds views; the mapping goes with the process
+            pass
+
+
+class ModelHost(_Segment):
+    """Owner of the segment of a model; close() unlinks it."""
+
+    def __init__(self, vectors_file, words, name=None, block_rows=BLOCK_ROWS):
+        name = name or segment_name(vectors_file)
+        W_norm = load_normalized(vectors_file, words)
+        index = words if isinstance(words, VocabIndex) else VocabIndex.build(words)
+        rows, dim = W_norm.shape
+        _, index_bytes = index.layout()
+        layout, size = _layout(rows, dim, index_bytes)
+        shm = shared_memory.SharedMemory(name, create=True, size=size)
+        try:
+            header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+            header[:] = 0
+            header[1:5] = [rows, dim, index_bytes, os.getpid()]
+            W = np.ndarray((rows, dim), dtype=np.float64, buffer=shm.buf, offset=layout['W'])
+            for start in range(0, rows, block_rows):
+                W[start:start + block_rows] = W_norm[start:start + block_rows]
+            index.write_into(shm.buf, layout['index'])
+            # the magic goes last: until W and the index are filled, workers refuse the segment
+            header[0] = MAGIC
+            del header, W
+            _Segment.__init__(self, shm)
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+
+    def close(self, grace=30.0):
+        """Refuse new attachments, wait up to grace seconds for workers to detach, unlink."""
+        self.header[5] = 1
+        deadline = time.time() + grace
+        while self.attached() and time.time() < deadline:
+            time.sleep(0.1)
+        left = self.attached()
+        if left:
+            sys.stderr.write("%s: unlinking with %d workers still attached %s\n" % (self.name, len(left), left))
+        name = self.name
+        self.shm.unlink()
+        self._release()
+        if not left and os.path.exists(_lock_path(name)):
+            os.remove(_lock_path(name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SharedModel(_Segment):
+    """A worker's attachment to a hosted model; detach() releases its slot."""
+
+    def __init__(self, name, register=True):
+        _Segment.__init__(self, _open_segment(name))
+        self.slot = None
+        if register:
+            with _locked(name):
+                if self.closing:
+                    self._release()
+                    raise RuntimeError('%s is shutting down' % name)
+                slots = self.header[7:]
+                free = np.flatnonzero(slots == 0)
+                if not len(free):
+                    self._release()
+                    raise RuntimeError('%s has %d workers attached' % (name, MAX_ATTACH))
+                self.slot = int(free[0])
+                slots[self.slot] = os.getpid()
+                self.header[6] = np.count_nonzero(slots)
+        self.W.flags.writeable = False
+
+    def detach(self):
+        if self.header is None:
+            return
+        if self.slot is not None:
+            with _locked(self.name):
+                self.header[7 + self.slot] = 0
+                self.header[6] = np.count_nonzero(self.header[7:])
+        self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.detach()
+
+
+def attach(name, register=True):
+    """Attach to the model hosted as name; register=False does not count as a worker."""
+    return SharedModel(name, register)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
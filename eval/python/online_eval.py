@@ -0,0 +1,127 @@
+"""Evaluate a glove checkpoint while training goes on and extend an accuracy curve.
+
+glove starts this through '-checkpoint-command' after every checkpoint, with
+the checkpoint file, its iteration and the vocab file in GLOVE_CHECKPOINT,
+GLOVE_ITER and GLOVE_VOCAB_FILE.  The vectors of the --restrict_vocab most
+frequent words are read straight from the '.bin' checkpoint (text
+checkpoints are parsed in full) and scored on the analogy set and any
+similarity sets; one row per checkpoint is appended to the --curve TSV.
+When the accuracy gained over the last --patience checkpoints is below
+--min_delta, the configuration is reported as plateaued.
+
+    ./build/glove -checkpoint-every 1 -binary 2 ... \
+        -checkpoint-command 'OPENBLAS_NUM_THREADS=1 python eval/python/online_eval.py --set fr --curve curve.tsv'
+"""
+import argparse
+import fcntl
+import itertools
+import os
+import sys
+import time
+import numpy as np
+
+from glove_vectors import read_bin, read_vectors, normalize
+from questions import QUESTION_SETS, load_questions, score_questions
+from similarity import read_sim_file, spearman
+from evaluate_grid import summarize
+from vocab_index import VocabIndex, load_vocab_index
+
+CURVE_COLUMNS = ['iter', 'time', 'checkpoint', 'words', 'seen', 'semantic', 'syntactic', 'accuracy',
+    'eval_seconds']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vectors_file', default=os.environ.get('GLOVE_CHECKPOINT'), type=str)
+    parser.add_argument('--iter', default=os.environ.get('GLOVE_ITER'), type=int)
+    parser.add_argument('--vocab_file', default=os.environ.get('GLOVE_VOCAB_FILE', 'vocab.txt'), type=str)
+    parser.add_argument('--curve', required=True, type=str, help='TSV file the row is appended to')
+    parser.add_argument('--set', default='en', choices=sorted(QUESTION_SETS))
+    parser.add_argument('--restrict_vocab', default=30000, type=int,
+        help='evaluate on the most frequent words only; 0 for all')
+    parser.add_argument('--sim_files', default=[], type=str, nargs='*',
+        help='TSV files of (word1, word2, gold score)')
+    parser.add_argument('--split_size', default=100, type=int)
+    parser.add_argument('--patience', default=3, type=int)
+    parser.add_argument('--min_delta', default=0.1, type=float, help='accuracy points')
+    parser.add_argument('--nice', default=10, type=int, help='niceness increment, to leave CPU to training')
+    args = parser.parse_args()
+    if args.vectors_file is None or args.iter is None:
+        parser.error('--vectors_file and --iter (or GLOVE_CHECKPOINT and GLOVE_ITER) are required')
+
+    if args.nice:
+        os.nice(args.nice)
+    row = evaluate_checkpoint(args.vectors_file, args.iter, args.vocab_file, args.set,
+        args.restrict_vocab, args.sim_files, args.split_size)
+    curve = append_curve(args.curve, row)
+    sys.stderr.write("iter %03d: %.2f%% analogy accuracy on %d words (%.1f s)\n" %
+        (row['iter'], row['accuracy'], row['words'], row['eval_seconds']))
+    if plateaued(curve, args.patience, args.min_delta):
+        sys.stderr.write("%s: accuracy gained less than %.2f points over the last %d checkpoints\n" %
+            (args.curve, args.min_delta, args.patience))
+    return 0
+
+
+def load_checkpoint(vectors_file, vocab, rows):
+    """Normalized vectors of the first rows words of vocab, from a .bin or text checkpoint."""
+    if vectors_file.endswith('.bin'):
+        W = read_bin(vectors_file, len(vocab), rows=rows)
+    else:
+        W = read_vectors(vectors_file, vocab)[:rows]
+    return normalize(W)
+
+
+def evaluate_checkpoint(vectors_file, iteration, vocab_file, set_name='en', restrict_vocab=30000,
+        sim_files=(), split_size=100):
+    """Curve row of a checkpoint: analogy accuracies and the Spearman rho of each similarity set."""
+    start = time.time()
+    vocab = load_vocab_index(vocab_file)
+    rows = restrict_vocab if 0 < restrict_vocab < len(vocab) else len(vocab)
+    W = load_checkpoint(vectors_file, vocab, rows)
+    if rows < len(vocab):
+        # the restricted word list has its own fingerprint, so its questions are cached separately
+        vocab = VocabIndex.build(itertools.islice(vocab, rows))
+    questions = load_questions(vocab, set_name, vocab=vocab)
+    row = summarize(questions, score_questions(W, questions, split_size))
+    for sim_file in sim_files:
+        ind1, ind2, gold, _ = read_sim_file(sim_file, vocab)
+        row[os.path.basename(sim_file)] = spearman(np.einsum('ij,ij->i', W[ind1], W[ind2]), gold)
+    row.update(iter=iteration, time=time.strftime('%Y-%m-%dT%H:%M:%S'), checkpoint=vectors_file,
+        words=rows, eval_seconds=time.time() - start)
+    return row
+
+
+def append_curve(curve_file, row):
+    """Append row to the curve under a lock and return all rows of the curve.
+
+    Checkpoint commands can overlap, so rows are not necessarily in
+    iteration order.
+    """
+    columns = CURVE_COLUMNS + sorted(k for k in row if k not in CURVE_COLUMNS and k not in ('total',))
+    with open(curve_file, 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        lines = f.read().splitlines()
+        if not lines:
+            lines = ['\t'.join(columns)]
+            f.write(lines[0] + '\n')
+        header = lines[0].split('\t')
+        line = '\t'.join(('%.4f' % row[c]) if isinstance(row.get(c), float) else str(row.get(c, ''))
+            for c in header)
+        f.write(line + '\n')
+        f.flush()
+        fcntl.flock(f, fcntl.LOCK_UN)
+    return [dict(zip(header, l.split('\t'))) for l in lines[1:] + [line]]
+
+
+def plateaued(curve, patience, min_delta):
+    """True if the best accuracy of the last patience checkpoints beats the earlier best by less than min_delta."""
+    points = sorted((int(r['iter']), float(r['accuracy'])) for r in curve)
+    if len(points) <= patience:
+        return False
+    before = max(acc for _, acc in points[:-patience])
+    return max(acc for _, acc in points[-patience:]) - before < min_delta
+
+
+if __name__ == "__main__":
+    sys.exit(main())
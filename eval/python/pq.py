@@ -0,0 +1,234 @@
+"""Product-quantized index of normalized word vectors.
+
+The columns of the normalized matrix are split into num_subspaces groups and
+each group is quantized with its own k-means codebook of at most 256
+centroids, so a word is stored as num_subspaces uint8 codes.  Queries are
+scored by asymmetric distance: the query stays exact, and its dot product
+with every centroid is tabulated once per subspace, so a word's score is the
+sum of num_subspaces table lookups.  A shortlist of the best approximate
+candidates can be re-scored exactly against the (memory-mapped) normalized
+matrix.
+
+    python eval/python/pq.py --vocab_file vocab.txt --vectors_file vectors.txt --num_subspaces 32
+"""
+import argparse
+import sys
+import time
+import numpy as np
+
+from glove_vectors import load_normalized
+from questions import load_questions
+from analogy import predict, topk
+from vocab_index import load_vocab_index
+
+# rows scored at once, bounds the temporary (rows x queries) score block
+BLOCK_ROWS = 65536
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='vocab.txt', type=str)
+    parser.add_argument('--vectors_file', default=['vectors.txt'], type=str, nargs='+')
+    parser.add_argument('--num_subspaces', default=32, type=int)
+    parser.add_argument('--num_centroids', default=256, type=int)
+    parser.add_argument('--iter', default=20, type=int, help='k-means iterations')
+    parser.add_argument('--sample_size', default=100000, type=int,
+        help='number of rows used to train the codebooks')
+    parser.add_argument('--k', default=10, type=int, help='k of the recall@k report')
+    parser.add_argument('--num_queries', default=1000, type=int)
+    parser.add_argument('--shortlist', default=100, type=int,
+        help='candidates re-scored exactly; 0 disables re-ranking')
+    parser.add_argument('--analogy', action='store_true',
+        help='also report approximate accuracy on the English analogy questions')
+    args = parser.parse_args()
+
+    # the index also stands in for the word list
+    words = vocab = load_vocab_index(args.vocab_file)
+    for vectors_file in args.vectors_file:
+        W = load_normalized(vectors_file, words)
+        t = time.time()
+        index = train_pq(W, args.num_subspaces, args.num_centroids, args.iter, args.sample_size)
+        index['codes'] = encode(index, W)
+        save_index(vectors_file + '.pq.npz', index)
+        print('%s:' % vectors_file)
+        print('Trained and encoded in %.1f s' % (time.time() - t))
+        report_memory(W, index)
+        report_recall(W, index, args.k, args.num_queries, args.shortlist)
+        if args.analogy:
+            report_analogy(W, index, words, vocab, args.shortlist)
+
+
+def subspace_bounds(vector_size, num_subspaces):
+    """Column boundaries splitting vector_size columns into near-equal groups."""
+    if not 0 < num_subspaces <= vector_size:
+        raise ValueError("num_subspaces must be between 1 and the vector size (%d)" % vector_size)
+    return np.linspace(0, vector_size, num_subspaces + 1).astype(np.int64)
+
+
+def kmeans(X, num_centroids, num_iter, rng):
+    """Lloyd's k-means; empty clusters are reseeded from random rows."""
+    C = X[rng.choice(len(X), num_centroids, replace=False)].copy()
+    x_sq = np.sum(X ** 2, 1)
+    for _ in range(num_iter):
+        dist = x_sq[:, np.newaxis] - 2 * np.dot(X, C.T) + np.sum(C ** 2, 1)
+        assign = np.argmin(dist, 1)
+        counts = np.bincount(assign, minlength=num_centroids)
+        sums = np.zeros_like(C)
+        np.add.at(sums, assign, X)
+        empty = counts == 0
+        C[~empty] = sums[~empty] / counts[~empty, np.newaxis]
+        C[empty] = X[rng.choice(len(X), empty.sum(), replace=False)]
+    return C
+
+
+def train_pq(W, num_subspaces=32, num_centroids=256, num_iter=20, sample_size=100000, seed=1):
+    """Train one codebook per subspace on a row sample of the normalized W."""
+    if num_centroids > 256:
+        raise ValueError("at most 256 centroids fit in uint8 codes")
+    rng = np.random.default_rng(seed)
+    bounds = subspace_bounds(W.shape[1], num_subspaces)
+    rows = np.sort(rng.choice(W.shape[0], min(sample_size, W.shape[0]), replace=False))
+    sample = np.asarray(W[rows, :], dtype=np.float32)
+    num_centroids = min(num_centroids, len(sample))
+    codebooks = [kmeans(sample[:, bounds[j]:bounds[j + 1]], num_centroids, num_iter, rng)
+        for j in range(num_subspaces)]
+    return {'bounds': bounds, 'codebooks': codebooks}
+
+
+def encode(index, W):
+    """uint8 code of the nearest centroid of every row in every subspace."""
+    bounds = index['bounds']
+    codes = np.empty((W.shape[0], len(bounds) - 1), dtype=np.uint8)
+    for start in range(0, W.shape[0], BLOCK_ROWS):
+        block = np.asarray(W[start:start + BLOCK_ROWS, :], dtype=np.float32)
+        for j, C in enumerate(index['codebooks']):
+            X = block[:, bounds[j]:bounds[j + 1]]
+            dist = -2 * np.dot(X, C.T) + np.sum(C ** 2, 1)
+            codes[start:start + len(block), j] = np.argmin(dist, 1)
+    return codes
+
+
+def decode(index, rows):
+    """Approximate vectors of the given rows, rebuilt from their codes."""
+    codes = index['codes'][rows]
+    return np.hstack([C[codes[:, j]] for j, C in enumerate(index['codebooks'])])
+
+
+def save_index(filename, index):
+    np.savez(filename, bounds=index['bounds'], codes=index['codes'],
+        **{'codebook_%d' % j: C for j, C in enumerate(index['codebooks'])})
+
+
+def load_index(filename):
+    with np.load(filename) as data:
+        bounds = data['bounds']
+        return {
+            'bounds': bounds,
+            'codes': data['codes'],
+            'codebooks': [data['codebook_%d' % j] for j in range(len(bounds) - 1)],
+        }
+
+
+def adc_scores(index, queries):
+    """Approximate dot products of every row with each query: (rows x queries)."""
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    bounds = index['bounds']
+    # tables[j] holds the dot product of each query with each centroid of subspace j
+    tables = [np.dot(C, queries[:, bounds[j]:bounds[j + 1]].T)
+        for j, C in enumerate(index['codebooks'])]
+    codes = index['codes']
+    scores = np.empty((len(codes), len(queries)), dtype=np.float32)
+    for start in range(0, len(codes), BLOCK_ROWS):
+        block = codes[start:start + BLOCK_ROWS]
+        acc = tables[0][block[:, 0]]
+        for j in range(1, len(tables)):
+            acc += tables[j][block[:, j]]
+        scores[start:start + len(block)] = acc
+    return scores
+
+
+def search(index, queries, k, exclude=None, W=None, shortlist=0):
+    """Top-k rows for each query, best first.
+
+    exclude is an optional list (one per query) of rows that may not be
+    returned.  When W is given and shortlist > k, the shortlist best
+    approximate candidates are re-scored exactly against W.
+    """
+    queries = np.atleast_2d(queries)
+    scores = adc_scores(index, queries)
+    if exclude is not None:
+        for q, rows in enumerate(exclude):
+            scores[rows, q] = -np.inf
+    results = []
+    for q in range(len(queries)):
+        if W is not None and shortlist > k:
+            candidates = np.sort(topk(scores[:, q], shortlist))
+            candidates = candidates[np.isfinite(scores[candidates, q])]
+            exact = np.dot(W[candidates, :], queries[q])
+            results.append(candidates[topk(exact, k)])
+        else:
+            results.append(topk(scores[:, q], k))
+    return results
+
+
+def predict_pq(index, ind1, ind2, ind3, W=None, shortlist=0, split_size=100):
+    """analogy.predict over the compressed index; query vectors are decoded
+    from the codes unless the exact W is given."""
+    predictions = np.zeros(len(ind1), dtype=np.int64)
+    for start in range(0, len(ind1), split_size):
+        subset = slice(start, start + split_size)
+        if W is not None:
+            pred_vec = W[ind2[subset], :] - W[ind1[subset], :] + W[ind3[subset], :]
+        else:
+            pred_vec = decode(index, ind2[subset]) - decode(index, ind1[subset]) + decode(index, ind3[subset])
+        exclude = [list(x) for x in zip(ind1[subset], ind2[subset], ind3[subset])]
+        best = search(index, pred_vec, 1, exclude, W, shortlist)
+        predictions[subset] = [b[0] for b in best]
+    return predictions
+
+
+def report_memory(W, index):
+    exact = W.shape[0] * W.shape[1] * W.dtype.itemsize
+    compressed = index['codes'].nbytes + sum(C.nbytes for C in index['codebooks'])
+    print('Memory: %.1f MB exact, %.1f MB compressed (%.1fx smaller)' %
+        (exact / 2.0 ** 20, compressed / 2.0 ** 20, exact / float(compressed)))
+
+
+def report_recall(W, index, k, num_queries, shortlist):
+    """Recall@k of the approximate neighbours against exact cosine search."""
+    rng = np.random.default_rng(2)
+    rows = rng.choice(W.shape[0], min(num_queries, W.shape[0]), replace=False)
+    queries = np.asarray(W[rows, :])
+    exclude = [[r] for r in rows]
+    approx = search(index, queries, k, exclude)
+    reranked = search(index, queries, k, exclude, W, shortlist) if shortlist > k else None
+    hits = hits_reranked = 0
+    for q, row in enumerate(rows):
+        dist = np.dot(W, queries[q])
+        dist[row] = -np.inf
+        exact = set(topk(dist, k))
+        hits += len(exact.intersection(approx[q]))
+        if reranked is not None:
+            hits_reranked += len(exact.intersection(reranked[q]))
+    total = float(k * len(rows))
+    print('RECALL@%d: %.2f%%' % (k, 100 * hits / total))
+    if reranked is not None:
+        print('RECALL@%d with shortlist %d: %.2f%%' % (k, shortlist, 100 * hits_reranked / total))
+
+
+def report_analogy(W, index, words, vocab, shortlist):
+    questions = load_questions(words, 'en', vocab=vocab)
+    ind1, ind2, ind3, ind4 = questions['indices'].T
+    if len(ind1) == 0:
+        sys.stderr.write("No analogy question is covered by the vocabulary.\n")
+        return
+    exact = np.mean(predict(W, ind1, ind2, ind3) == ind4)
+    approx = np.mean(predict_pq(index, ind1, ind2, ind3) == ind4)
+    print('Analogy accuracy: %.2f%% exact, %.2f%% compressed' % (100 * exact, 100 * approx))
+    if shortlist > 1:
+        reranked = np.mean(predict_pq(index, ind1, ind2, ind3, W, shortlist) == ind4)
+        print('Analogy accuracy with shortlist %d: %.2f%%' % (shortlist, 100 * reranked))
+
+
+if __name__ == "__main__":
+    main()
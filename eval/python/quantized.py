@@ -0,0 +1,212 @@
+"""int8 scoring of normalized word vectors with exact re-scoring of a shortlist.
+
+Every row of the normalized matrix is stored as int8 codes with its own
+float32 scale (the row's largest absolute value / 127), 8x smaller than
+the float64 matrix.  Queries are quantized the same way and scored against
+blocks of codes; the products of int8 values are summed exactly in float32
+GEMM (a row of up to 1000 dimensions sums to less than 2**24), then scaled
+by the query and row scales.  The shortlist best candidates of each query
+are re-scored in float32 against the exact rows, which gives the top-1 /
+top-k.  The codes are cached next to the vectors file as
+<vectors_file>.q8.npy and <vectors_file>.q8.scales.npy and memory-mapped.
+
+    python eval/python/quantized.py --vocab_file vocab.txt --vectors_file vectors.bin --shortlist 10
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+from glove_vectors import load_normalized, norm_cache_path, tmp_path
+from questions import QUESTION_SETS, load_questions
+from analogy import predict
+from tiled import read_blocks, _merge_topk
+from vocab_index import load_vocab_index
+
+BLOCK_ROWS = 65536
+# rows of codes widened to float32 at once
+WIDEN_ROWS = 4096
+QMAX = 127
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='vocab.txt', type=str)
+    parser.add_argument('--vectors_file', default=['vectors.txt'], type=str, nargs='+')
+    parser.add_argument('--set', default='en', choices=sorted(QUESTION_SETS))
+    parser.add_argument('--shortlist', default=10, type=int,
+        help='candidates re-scored in float32 for each question')
+    parser.add_argument('--split_size', default=1024, type=int)
+    args = parser.parse_args()
+
+    # the index also stands in for the word list
+    words = vocab = load_vocab_index(args.vocab_file)
+    questions = load_questions(words, args.set, vocab=vocab)
+    ind1, ind2, ind3, ind4 = questions['indices'].T
+    for vectors_file in args.vectors_file:
+        W = load_normalized(vectors_file, words)
+        index = load_quantized(vectors_file, W)
+        print('%s:' % vectors_file)
+        print('Memory: %.1f MB float64, %.1f MB int8 codes and scales' %
+            (W.nbytes / 2.0 ** 20, (index['codes'].nbytes + index['scales'].nbytes) / 2.0 ** 20))
+        t = time.time()
+        exact = ind4 == predict(W, ind1, ind2, ind3)
+        exact_time = time.time() - t
+        t = time.time()
+        approx = ind4 == predict_quantized(index, W, ind1, ind2, ind3, args.shortlist,
+            split_size=args.split_size)
+        print('Scored %d questions in %.1f s float64, %.1f s int8 with shortlist %d' %
+            (len(ind1), exact_time, time.time() - t, args.shortlist))
+        report_deltas(questions, exact, approx)
+
+
+def quantize(W, codes=None, block_rows=BLOCK_ROWS):
+    """Per-row scaled int8 codes of W: {'codes': int8 (rows x dim), 'scales': float32 (rows,)}.
+
+    The codes are written a block of rows at a time into codes (such as a
+    memory map) if it is given.
+    """
+    if codes is None:
+        codes = np.empty(W.shape, dtype=np.int8)
+    scales = np.empty(W.shape[0], dtype=np.float32)
+    for start in range(0, W.shape[0], block_rows):
+        codes[start:start + block_rows], scales[start:start + block_rows] = \
+            quantize_rows(W[start:start + block_rows])
+    return {'codes': codes, 'scales': scales}
+
+
+def quantize_rows(X):
+    """(int8 codes, float32 scales) of the rows of X; all-zero rows get scale 0."""
+    X = np.asarray(X, dtype=np.float32)
+    scales = np.max(np.abs(X), 1) / QMAX
+    safe = np.where(scales > 0, scales, 1)
+    codes = np.clip(np.rint(X / safe[:, np.newaxis]), -QMAX, QMAX).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantized_paths(vectors_file):
+    return vectors_file + '.q8.npy', vectors_file + '.q8.scales.npy'
+
+
+def load_quantized(vectors_file, W, cache=True):
+    """The int8 index of the normalized W of vectors_file, memory-mapped if cached.
+
+    The cache is rebuilt when it is older than the normalized matrix cache
+    (or vectors_file) or its shape differs from W.
+    """
+    codes_file, scales_file = quantized_paths(vectors_file)
+    source = norm_cache_path(vectors_file)
+    source = source if os.path.isfile(source) else vectors_file
+    if (cache and os.path.isfile(codes_file) and os.path.isfile(scales_file)
+            and os.path.getmtime(codes_file) >= os.path.getmtime(source)):
+        index = {'codes': np.load(codes_file, mmap_mode='r'), 'scales': np.load(scales_file)}
+        if index['codes'].shape == W.shape:
+            return index
+    if not cache:
+        return quantize(W)
+    # concurrent evaluations of one model each write their own temporary files
+    tmp_codes, tmp_scales = tmp_path(codes_file, '.npy'), tmp_path(scales_file, '.npy')
+    try:
+        index = quantize(W, np.lib.format.open_memmap(tmp_codes, mode='w+', dtype=np.int8, shape=W.shape))
+        index['codes'].flush()
+        scales = index['scales']
+        del index
+        np.save(tmp_scales, scales)
+        os.replace(tmp_scales, scales_file)
+        os.replace(tmp_codes, codes_file)
+    finally:
+        for tmp_file in (tmp_codes, tmp_scales):
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    return {'codes': np.load(codes_file, mmap_mode='r'), 'scales': scales}
+
+
+def _widened_blocks(codes, block_rows, widen_rows=WIDEN_ROWS):
+    """Yield (start, float32 block) of the int8 codes, widen_rows rows at a time.
+
+    The codes are read ahead by read_blocks.  int8 products are summed
+    exactly by float32 GEMM; widening a few rows at a time keeps the float32
+    copy small next to the blocks of codes.
+    """
+    for block_start, block in read_blocks(codes, block_rows):
+        for i in range(0, len(block), widen_rows):
+            yield block_start + i, block[i:i + widen_rows].astype(np.float32)
+
+
+def search_quantized(index, W, queries, k=1, exclude=None, shortlist=10,
+        block_rows=BLOCK_ROWS, split_size=1024):
+    """Indices of the k best rows for each query, best first.
+
+    Candidates are ranked by their int8 scores; the best max(k, shortlist)
+    of each query are re-scored in float32 against the rows of W.  exclude
+    is an optional (queries x m) array of rows that may not be returned.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    num_queries = len(queries)
+    shortlist = min(max(k, shortlist), len(index['scales']))
+    q_codes, q_scales = quantize_rows(queries)
+    q_codes = q_codes.astype(np.float32)
+    if exclude is not None:
+        exclude = np.asarray(exclude, dtype=np.int64)
+        exclude = exclude.reshape(num_queries, exclude.size // max(num_queries, 1))
+    scores = np.full((num_queries, shortlist), -np.inf, dtype=np.float32)
+    candidates = np.full((num_queries, shortlist), -1, dtype=np.int64)
+
+    for start, block in _widened_blocks(index['codes'], block_rows):
+        row_scales = index['scales'][start:start + len(block)]
+        for q in range(0, num_queries, split_size):
+            subset = slice(q, q + split_size)
+            dist = np.dot(q_codes[subset], block.T)
+            dist *= q_scales[subset, np.newaxis]
+            dist *= row_scales
+            if exclude is not None:
+                rows = exclude[subset] - start
+                hit = (rows >= 0) & (rows < len(block))
+                dist[np.nonzero(hit)[0], rows[hit]] = -np.inf
+            kk = min(shortlist, dist.shape[1])
+            best = np.argpartition(-dist, kk - 1, axis=1)[:, :kk]
+            scores[subset], candidates[subset] = _merge_topk(scores[subset], candidates[subset],
+                np.take_along_axis(dist, best, 1), best + start, shortlist)
+
+    # exact float32 re-scoring; rows ranked -inf (excluded, or never filled) stay last
+    results = np.empty((num_queries, min(k, shortlist)), dtype=np.int64)
+    for q in range(0, num_queries, split_size):
+        subset = slice(q, q + split_size)
+        cand = candidates[subset]
+        rows = np.asarray(W[np.maximum(cand, 0).ravel()], dtype=np.float32).reshape(cand.shape + (-1,))
+        exact = np.einsum('qd,qsd->qs', queries[subset], rows)
+        exact[~np.isfinite(scores[subset])] = -np.inf
+        order = np.argsort(-exact, axis=1, kind='stable')[:, :results.shape[1]]
+        results[subset] = np.take_along_axis(cand, order, 1)
+    return results
+
+
+def predict_quantized(index, W, ind1, ind2, ind3, shortlist=10, block_rows=BLOCK_ROWS, split_size=1024):
+    """analogy.predict with int8 candidate scoring and float32 re-scoring of a shortlist."""
+    pred_vec = np.asarray(W[ind2, :] - W[ind1, :] + W[ind3, :], dtype=np.float32)
+    return search_quantized(index, W, pred_vec, 1, np.stack([ind1, ind2, ind3], 1), shortlist,
+        block_rows, split_size)[:, 0]
+
+
+def report_deltas(questions, exact, approx):
+    """Accuracy of each question category with float64 and int8 scoring."""
+    names = questions['names']
+    category = questions['category']
+    count = np.bincount(category, minlength=len(names))
+    correct = np.bincount(category, weights=exact, minlength=len(names))
+    correct_q = np.bincount(category, weights=approx, minlength=len(names))
+    print('%-40s %8s %10s %10s %8s %8s' % ('category', 'seen', 'float64', 'int8', 'delta', 'flipped'))
+    for i, name in enumerate(list(names) + ['total']):
+        mask = category == i if i < len(names) else np.ones(len(category), dtype=bool)
+        n = count[i] if i < len(names) else count.sum()
+        if not n:
+            continue
+        a = 100.0 * (correct[i] if i < len(names) else correct.sum()) / n
+        b = 100.0 * (correct_q[i] if i < len(names) else correct_q.sum()) / n
+        print('%-40s %8d %9.2f%% %9.2f%% %+7.2f %8d' % (name, n, a, b, b - a,
+            np.count_nonzero(exact[mask] != approx[mask])))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""Analogy question sets compiled to vocabulary indices and cached on disk.
+
+Compiling a question set resolves every question to four int32 vocabulary
+indices, dropping questions with an unknown word.  The result depends only
+on the vocabulary, so it is stored under a fingerprint of the word list and
+reused by every model trained with the same vocab file.
+"""
+import os
+import sys
+import numpy as np
+
+from analogy import predict
+from glove_vectors import fingerprint, tmp_path
+
+QUESTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..', 'question-data')
+
+# question files of each set and how many of the leading files are semantic
+QUESTION_SETS = {
+    'en': ([
+        'capital-common-countries.txt', 'capital-world.txt', 'currency.txt',
+        'city-in-state.txt', 'family.txt', 'gram1-adjective-to-adverb.txt',
+        'gram2-opposite.txt', 'gram3-comparative.txt', 'gram4-superlative.txt',
+        'gram5-present-participle.txt', 'gram6-nationality-adjective.txt',
+        'gram7-past-tense.txt', 'gram8-plural.txt', 'gram9-plural-verbs.txt',
+        ], 5),
+    'fr': (['filtered-question-words-fr.txt'], 0),
+}
+
+
+def compile_questions(vocab, set_name='en', prefix=QUESTION_DIR):
+    filenames, num_semantic = QUESTION_SETS[set_name]
+    indices = []
+    category = []
+    full_counts = []
+    for i, filename in enumerate(filenames):
+        with open(os.path.join(prefix, filename), 'r') as f:
+            full_data = [line.rstrip().split(' ') for line in f]
+        full_counts.append(len(full_data))
+        data = [[vocab[word] for word in x] for x in full_data
+            if all(word in vocab for word in x)]
+        indices.extend(data)
+        category.extend([i] * len(data))
+
+    return {
+        'indices': np.array(indices, dtype=np.int32).reshape(-1, 4),
+        'category': np.array(category, dtype=np.int16),
+        'names': np.array(filenames),
+        'full_counts': np.array(full_counts, dtype=np.int64),
+        'semantic': np.arange(len(filenames)) < num_semantic,
+    }
+
+
+def load_questions(words, set_name='en', prefix=QUESTION_DIR, cache_dir=None,
+        vocab=None):
+    """Return the compiled question set for words, compiling it on a cache miss.
+
+    The cache file lives in cache_dir (default: '<prefix>/compiled') and is
+    recompiled when any question file is newer than it.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(prefix, 'compiled')
+    cache_file = os.path.join(cache_dir, '%s.%s.npz' % (set_name, fingerprint(words)[:16]))
+
+    filenames = QUESTION_SETS[set_name][0]
+    if os.path.isfile(cache_file):
+        mtime = os.path.getmtime(cache_file)
+        if all(os.path.getmtime(os.path.join(prefix, f)) <= mtime for f in filenames):
+            with np.load(cache_file) as data:
+                return {k: data[k] for k in data.files}
+
+    if vocab is None:
+        vocab = {w: idx for idx, w in enumerate(words)}
+    questions = compile_questions(vocab, set_name, prefix)
+    # processes sharing cache_dir each write their own temporary file
+    tmp_file = tmp_path(cache_file, '.npz')
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        np.savez(tmp_file, **questions)
+        os.replace(tmp_file, cache_file)
+    except OSError as ex:
+        sys.stderr.write("Could not cache question set in %s: %s\n" % (cache_dir, ex))
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return questions
+
+
+def score_questions(W, questions, split_size=100):
+    """Return a boolean array marking the correctly answered questions."""
+    ind1, ind2, ind3, ind4 = questions['indices'].T
+    predictions = predict(W, ind1, ind2, ind3, split_size)
+    return ind4 == predictions
+
+
+def print_report(questions, val, file=None):
+    """Print accuracies in the format of evaluate.py, to file (default stdout)."""
+    names = questions['names']
+    semantic = questions['semantic']
+    count = np.bincount(questions['category'], minlength=len(names))
+    correct = np.bincount(questions['category'], weights=val, minlength=len(names))
+
+    def pct(a, b):
+        return 100 * a / float(b) if b else float('nan')
+
+    if len(names) > 1:
+        for i, name in enumerate(names):
+            print("%s:" % name, file=file)
+            print('ACCURACY TOP1: %.2f%% (%d/%d)' %
+                (pct(correct[i], count[i]), correct[i], count[i]), file=file)
+
+    count_tot = count.sum()
+    correct_tot = correct.sum()
+    full_count = questions['full_counts'].sum()
+    print('Questions seen/total: %.2f%% (%d/%d)' %
+        (pct(count_tot, full_count), count_tot, full_count), file=file)
+    if semantic.any():
+        count_sem, correct_sem = count[semantic].sum(), correct[semantic].sum()
+        count_syn, correct_syn = count[~semantic].sum(), correct[~semantic].sum()
+        print('Semantic accuracy: %.2f%%  (%i/%i)' %
+            (pct(correct_sem, count_sem), correct_sem, count_sem), file=file)
+        print('Syntactic accuracy: %.2f%%  (%i/%i)' %
+            (pct(correct_syn, count_syn), correct_syn, count_syn), file=file)
+    print('Total accuracy: %.2f%%  (%i/%i)' % (pct(correct_tot, count_tot), correct_tot, count_tot), file=file)
@@ -0,0 +1,221 @@
+"""Row-sharded analogy and neighbour search with a scatter-gather top-k.
+
+The rows of the normalized matrix are split by vocabulary range across
+--shards worker processes, which stand in for the nodes of a cluster: each
+holds only its own rows in memory.  The coordinator gathers the vectors of
+the query words from the shards that own them, broadcasts the queries with
+their excluded words (global IDs; each shard masks the ones in its range),
+and merges the local top-k of every shard.  The compute time of each shard
+and the round trip of each batch are reported.
+
+    python eval/python/sharded.py --vocab_file vocab.txt --vectors_file vectors.bin --shards 4 --analogy
+    python eval/python/sharded.py --vocab_file vocab.txt --vectors_file vectors.bin --shards 4 --words paris --k 10
+"""
+import argparse
+import multiprocessing
+import sys
+import time
+import traceback
+import numpy as np
+
+from glove_vectors import load_normalized, norm_cache_path
+from questions import QUESTION_SETS, load_questions, print_report
+from tiled import tiled_topk, _merge_topk
+from vocab_index import load_vocab_index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='vocab.txt', type=str)
+    parser.add_argument('--vectors_file', default='vectors.txt', type=str)
+    parser.add_argument('--shards', default=4, type=int)
+    parser.add_argument('--analogy', action='store_true', help='score the analogy set')
+    parser.add_argument('--set', default='en', choices=sorted(QUESTION_SETS))
+    parser.add_argument('--words', default=[], type=str, nargs='*',
+        help='print the nearest neighbours of each word')
+    parser.add_argument('--k', default=100, type=int)
+    parser.add_argument('--split_size', default=1024, type=int, help='queries per scatter')
+    args = parser.parse_args()
+
+    vocab = load_vocab_index(args.vocab_file)
+    ivocab = vocab.ivocab
+    with ShardedIndex(args.vectors_file, vocab, args.shards) as index:
+        sys.stderr.write("%d rows in %d shards: %s\n" % (len(vocab), len(index.bounds) - 1,
+            ' '.join('[%d, %d)' % r for r in zip(index.bounds[:-1], index.bounds[1:]))))
+        if args.analogy:
+            questions = load_questions(vocab, args.set, vocab=vocab)
+            ind1, ind2, ind3, ind4 = questions['indices'].T
+            start = time.time()
+            predictions = index.predict(ind1, ind2, ind3, args.split_size)
+            sys.stderr.write("Scored %d questions in %.1f s\n" % (len(ind1), time.time() - start))
+            print_report(questions, ind4 == predictions)
+
+        for word in args.words:
+            if word not in vocab:
+                print('Word: %s  Out of dictionary!' % word)
+                continue
+            query = index.rows([vocab[word]])
+            indices, scores = index.topk(query, args.k, [[vocab[word]]])
+            print("\n                               Word       Cosine distance\n")
+            print("---------------------------------------------------------\n")
+            for i, score in zip(indices[0], scores[0]):
+                print("%35s\t\t%f\n" % (ivocab[i], score))
+        index.report_latency(sys.stderr)
+    return 0
+
+
+def shard_bounds(rows, num_shards):
+    """Row boundaries of num_shards contiguous, near-equal vocabulary ranges."""
+    num_shards = max(1, min(num_shards, rows))
+    return [int(x) for x in np.linspace(0, rows, num_shards + 1).round()]
+
+
+def local_topk(W, queries, k, exclude, offset, split_size=1024):
+    """Global indices and scores of the k best rows of the shard W (rows offset..) per query.
+
+    Excluded global IDs outside the shard are ignored.
+    """
+    indices, scores = tiled_topk(W, queries, k, None if exclude is None else exclude - offset,
+        split_size=split_size)
+    return indices + offset, scores
+
+
+def _serve_shard(conn, cache_file, lo, hi):
+    """Shard process: hold rows lo..hi of the normalized matrix and answer requests."""
+    try:
+        W = np.array(np.load(cache_file, mmap_mode='r')[lo:hi])
+        conn.send(('ok', W.nbytes))
+    except BaseException:
+        conn.send(('error', traceback.format_exc()))
+        return
+    while True:
+        request = conn.recv()
+        try:
+            start = time.time()
+            if request[0] == 'close':
+                return
+            if request[0] == 'rows':
+                result = W[np.asarray(request[1]) - lo]
+            elif request[0] == 'topk':
+                queries, k, exclude, split_size = request[1:]
+                result = local_topk(W, queries, k, exclude, lo, split_size)
+            conn.send(('ok', result, time.time() - start))
+        except BaseException:
+            conn.send(('error', traceback.format_exc()))
+
+
+class ShardedIndex:
+    """Coordinator of the shard processes of a normalized matrix."""
+
+    def __init__(self, vectors_file, words, num_shards=4):
+        # the shards map the normalized cache, which is written here if needed
+        load_normalized(vectors_file, words)
+        self.bounds = shard_bounds(len(words), num_shards)
+        self.conns = []
+        self.procs = []
+        # per shard: compute seconds of each request, and round trip seconds of each scatter
+        self.compute = [[] for _ in self.bounds[1:]]
+        self.round_trip = []
+        for lo, hi in zip(self.bounds[:-1], self.bounds[1:]):
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_serve_shard,
+                args=(child, norm_cache_path(vectors_file), lo, hi), daemon=True)
+            proc.start()
+            child.close()
+            self.conns.append(parent)
+            self.procs.append(proc)
+        for conn in self.conns:
+            self._reply(conn)
+
+    def _reply(self, conn):
+        reply = conn.recv()
+        if reply[0] == 'error':
+            raise RuntimeError('shard failed:\n' + reply[1])
+        return reply[1:]
+
+    def _scatter(self, requests):
+        """Send {shard: request}, return {shard: result}; shards work concurrently."""
+        start = time.time()
+        for shard, request in requests.items():
+            self.conns[shard].send(request)
+        results = {}
+        for shard in requests:
+            results[shard], seconds = self._reply(self.conns[shard])
+            self.compute[shard].append(seconds)
+        self.round_trip.append(time.time() - start)
+        return results
+
+    def rows(self, ids):
+        """The rows of the global IDs, gathered from the shards that own them."""
+        ids = np.asarray(ids, dtype=np.int64)
+        owner = np.searchsorted(self.bounds, ids, side='right') - 1
+        requests = {int(s): ('rows', ids[owner == s]) for s in np.unique(owner)}
+        out = None
+        for shard, rows in self._scatter(requests).items():
+            if out is None:
+                out = np.empty((len(ids), rows.shape[1]), dtype=rows.dtype)
+            out[owner == shard] = rows
+        return out
+
+    def topk(self, queries, k=1, exclude=None, split_size=1024):
+        """Indices and scores of the k best rows over all shards, as tiled.tiled_topk."""
+        queries = np.atleast_2d(queries)
+        if exclude is not None:
+            exclude = np.asarray(exclude, dtype=np.int64)
+            exclude = exclude.reshape(len(queries), exclude.size // max(len(queries), 1))
+        results = self._scatter({s: ('topk', queries, k, exclude, split_size)
+            for s in range(len(self.conns))})
+        k = min(k, self.bounds[-1])
+        scores = np.full((len(queries), k), -np.inf)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        # shards in row order, so ties go to the lowest row
+        for shard in range(len(self.conns)):
+            shard_indices, shard_scores = results[shard]
+            scores, indices = _merge_topk(scores, indices, shard_scores, shard_indices, k)
+        return indices, scores
+
+    def predict(self, ind1, ind2, ind3, split_size=1024):
+        """analogy.predict over the shards."""
+        predictions = np.zeros(len(ind1), dtype=np.int64)
+        for start in range(0, len(ind1), split_size):
+            subset = slice(start, start + split_size)
+            ids = np.concatenate([ind1[subset], ind2[subset], ind3[subset]])
+            vecs = self.rows(ids)
+            vecs = vecs.reshape(3, -1, vecs.shape[1])
+            pred_vec = vecs[1] - vecs[0] + vecs[2]
+            exclude = np.stack([ind1[subset], ind2[subset], ind3[subset]], 1)
+            predictions[subset] = self.topk(pred_vec, 1, exclude)[0][:, 0]
+        return predictions
+
+    def report_latency(self, f):
+        for shard, (lo, hi) in enumerate(zip(self.bounds[:-1], self.bounds[1:])):
+            seconds = np.array(self.compute[shard] or [0.0])
+            f.write("shard %d [%d, %d): %d requests, compute mean %.1f ms, p99 %.1f ms, total %.2f s\n" %
+                (shard, lo, hi, len(self.compute[shard]), 1000 * seconds.mean(),
+                1000 * np.percentile(seconds, 99), seconds.sum()))
+        if self.round_trip:
+            f.write("scatter-gather: %d round trips, mean %.1f ms, max %.1f ms\n" % (len(self.round_trip),
+                1000 * np.mean(self.round_trip), 1000 * np.max(self.round_trip)))
+
+    def close(self):
+        for conn, proc in zip(self.conns, self.procs):
+            try:
+                conn.send(('close',))
+            except (BrokenPipeError, OSError):
+                pass
+            proc.join(5)
+            if proc.is_alive():
+                proc.terminate()
+            conn.close()
+        self.conns = []
+        self.procs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
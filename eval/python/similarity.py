@@ -0,0 +1,108 @@
+import argparse
+import os
+import numpy as np
+
+from glove_vectors import load_normalized
+from vocab_index import load_vocab_index
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='vocab.txt', type=str)
+    parser.add_argument('--vectors_file', default=['vectors.txt'], type=str, nargs='+')
+    parser.add_argument('--sim_files', required=True, type=str, nargs='+',
+        help='TSV files of (word1, word2, gold score)')
+    parser.add_argument('--lowercase', action='store_true',
+        help='lowercase the words of the similarity sets before lookup')
+    parser.add_argument('--no_cache', action='store_true',
+        help='do not read or write the normalized matrix cache')
+    args = parser.parse_args()
+
+    # the index also stands in for the word list
+    words = vocab = load_vocab_index(args.vocab_file)
+    sim_sets = [read_sim_file(f, vocab, args.lowercase) for f in args.sim_files]
+
+    for vectors_file in args.vectors_file:
+        W = load_normalized(vectors_file, words, cache=not args.no_cache)
+        if len(args.vectors_file) > 1:
+            print('%s:' % vectors_file)
+        evaluate_similarity(W, args.sim_files, sim_sets)
+
+
+def read_sim_file(filename, vocab, lowercase=False):
+    """Resolve a similarity set to (ind1, ind2, gold, full_count).
+
+    Blank lines, '#' comments and rows whose third column is not a number
+    (such as a header) are skipped.  Pairs with a word missing from vocab are
+    dropped but still counted in full_count.
+    """
+    ind1, ind2, gold = [], [], []
+    full_count = 0
+    with open(filename, 'r') as f:
+        for line in f:
+            row = line.split()
+            if len(row) < 3 or row[0].startswith('#'):
+                continue
+            try:
+                score = float(row[2])
+            except ValueError:
+                continue
+            full_count += 1
+            w1, w2 = (row[0].lower(), row[1].lower()) if lowercase else row[:2]
+            if w1 in vocab and w2 in vocab:
+                ind1.append(vocab[w1])
+                ind2.append(vocab[w2])
+                gold.append(score)
+    return (np.array(ind1, dtype=np.int64), np.array(ind2, dtype=np.int64),
+        np.array(gold), full_count)
+
+
+def rankdata(x):
+    """Ranks of x starting at 1, with ties given their average rank."""
+    order = np.argsort(x, kind='mergesort')
+    ranks = np.empty(len(x))
+    ranks[order] = np.arange(1, len(x) + 1)
+    _, inverse, counts = np.unique(x, return_inverse=True, return_counts=True)
+    sums = np.bincount(inverse, weights=ranks)
+    return sums[inverse] / counts[inverse]
+
+
+def pearson(x, y):
+    if len(x) < 2:
+        return np.nan
+    return np.corrcoef(x, y)[0, 1]
+
+
+def spearman(x, y):
+    if len(x) < 2:
+        return np.nan
+    return pearson(rankdata(x), rankdata(y))
+
+
+def evaluate_similarity(W, filenames, sim_sets):
+    """Score every similarity set against the normalized vectors in W"""
+
+    # gather the pairs of all sets at once so that the cosines are a single
+    # row-wise dot product over W
+    ind1 = np.concatenate([s[0] for s in sim_sets])
+    ind2 = np.concatenate([s[1] for s in sim_sets])
+    cosines = np.einsum('ij,ij->i', W[ind1, :], W[ind2, :])
+    bounds = np.cumsum([0] + [len(s[0]) for s in sim_sets])
+
+    count_tot = 0
+    full_tot = 0
+    for i, (_, _, gold, full_count) in enumerate(sim_sets):
+        cos = cosines[bounds[i]:bounds[i + 1]]
+        count_tot += len(gold)
+        full_tot += full_count
+        print("%s:" % os.path.basename(filenames[i]))
+        print('SPEARMAN: %.4f  PEARSON: %.4f' % (spearman(cos, gold), pearson(cos, gold)))
+        print('Pairs seen/total: %.2f%% (%d/%d)' %
+            (100 * len(gold) / float(max(full_count, 1)), len(gold), full_count))
+
+    print('Pairs seen/total: %.2f%% (%d/%d)' %
+        (100 * count_tot / float(max(full_tot, 1)), count_tot, full_tot))
+
+
+if __name__ == "__main__":
+    main()
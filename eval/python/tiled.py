@@ -0,0 +1,194 @@
+"""Out-of-core analogy and neighbour search over a memory-mapped normalized matrix.
+
+analogy.predict and distance() score every query against the whole matrix
+at once, so the model, its normalized copy and the (vocab x batch) score
+matrix must all fit in memory.  Here the memory-mapped normalized matrix
+(the '.norm.npy' cache of glove_vectors, written a block at a time) is
+walked in blocks of rows.  A background thread reads the next blocks while
+the current one is multiplied with the queries, a running top-k is kept for
+every query and the excluded rows of each query (its question words) are
+masked block by block.  --memory bounds the row blocks in flight and the
+score block, so 5M-word models can be evaluated on small nodes.
+
+    python eval/python/tiled.py --vocab_file vocab.txt --vectors_file vectors.bin --memory 2048 --analogy
+    python eval/python/tiled.py --vocab_file vocab.txt --vectors_file vectors.bin --words paris king --k 10
+"""
+import argparse
+import queue
+import sys
+import threading
+import time
+import numpy as np
+
+from glove_vectors import load_normalized
+from questions import QUESTION_SETS, load_questions, print_report
+from model_host import attach
+from vocab_index import load_vocab_index
+
+# row blocks read_blocks reads ahead of the one being scored
+PREFETCH = 2
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='vocab.txt', type=str)
+    parser.add_argument('--vectors_file', default='vectors.txt', type=str)
+    parser.add_argument('--shared', default=None, type=str,
+        help='attach to the model hosted under this name by model_host.py')
+    parser.add_argument('--memory', default=2048, type=int,
+        help='MB for the row blocks and the score block')
+    parser.add_argument('--analogy', action='store_true', help='score the analogy set')
+    parser.add_argument('--set', default='en', choices=sorted(QUESTION_SETS))
+    parser.add_argument('--words', default=[], type=str, nargs='*',
+        help='print the nearest neighbours of each word')
+    parser.add_argument('--k', default=100, type=int)
+    args = parser.parse_args()
+
+    if args.shared:
+        model = attach(args.shared)
+        W, vocab = model.W, model.vocab
+    else:
+        vocab = load_vocab_index(args.vocab_file)
+        W = load_normalized(args.vectors_file, vocab)
+    ivocab = vocab.ivocab
+    block_rows, split_size = plan_blocks(args.memory << 20, W.shape[1], W.dtype.itemsize,
+        args.k if args.words else 1)
+    sys.stderr.write("%d x %d matrix, blocks of %d rows, %d queries at a time\n" %
+        (W.shape[0], W.shape[1], block_rows, split_size))
+
+    if args.analogy:
+        questions = load_questions(vocab, args.set, vocab=vocab)
+        ind1, ind2, ind3, ind4 = questions['indices'].T
+        start = time.time()
+        predictions = predict_tiled(W, ind1, ind2, ind3, block_rows, split_size)
+        sys.stderr.write("Scored %d questions in %.1f s\n" % (len(ind1), time.time() - start))
+        print_report(questions, ind4 == predictions)
+
+    for word in args.words:
+        if word not in vocab:
+            print('Word: %s  Out of dictionary!' % word)
+            continue
+        query = np.asarray(W[vocab[word]])
+        indices, scores = tiled_topk(W, query[np.newaxis], args.k, [[vocab[word]]], block_rows, split_size)
+        print("\n                               Word       Cosine distance\n")
+        print("---------------------------------------------------------\n")
+        for i, score in zip(indices[0], scores[0]):
+            print("%35s\t\t%f\n" % (ivocab[i], score))
+    if args.shared:
+        # the views of the segment must go before it can be closed
+        del W, vocab, ivocab
+        query = None
+        model.detach()
+    return 0
+
+
+def plan_blocks(memory_bytes, vector_size, itemsize=8, k=1, prefetch=PREFETCH):
+    """(block_rows, split_size) for a memory budget.
+
+    Half the budget holds the prefetch + 2 row blocks in flight: those
+    queued by read_blocks, the one its reader holds while waiting to queue
+    it and the one being scored.  The other half holds the (split_size x
+    block_rows) score block and, for k > 1, its negated copy and the
+    argpartition indices.
+    """
+    block_rows = max(1024, memory_bytes // (2 * (prefetch + 2)) // (vector_size * itemsize))
+    score_arrays = 1 if k == 1 else 3
+    split_size = max(1, memory_bytes // 2 // (score_arrays * block_rows * 8))
+    return block_rows, split_size
+
+
+def read_blocks(W, block_rows, prefetch=PREFETCH):
+    """Yield (start, block) for consecutive row blocks of W, read ahead by a thread.
+
+    The blocks are copied into memory by the thread, so the page faults of
+    a memory map are taken while the previous block is being scored.
+    """
+    blocks = queue.Queue(prefetch)
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for start in range(0, W.shape[0], block_rows):
+                if stop.is_set():
+                    return
+                blocks.put((start, np.array(W[start:start + block_rows])))
+            blocks.put(None)
+        except BaseException as ex:
+            blocks.put(ex)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = blocks.get()
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        while thread.is_alive():
+            try:
+                blocks.get_nowait()
+            except queue.Empty:
+                thread.join(0.01)
+
+
+def _merge_topk(scores, indices, new_scores, new_indices, k):
+    """Keep the k best of the running and the new candidates; earlier rows win ties."""
+    if k == 1:
+        better = new_scores[:, 0] > scores[:, 0]
+        scores[better, 0] = new_scores[better, 0]
+        indices[better, 0] = new_indices[better, 0]
+        return scores, indices
+    all_scores = np.hstack([scores, new_scores])
+    all_indices = np.hstack([indices, new_indices])
+    order = np.argsort(-all_scores, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(all_scores, order, 1), np.take_along_axis(all_indices, order, 1)
+
+
+def tiled_topk(W, queries, k=1, exclude=None, block_rows=65536, split_size=1024):
+    """Indices and scores of the k rows of W with the largest dot product with each query.
+
+    exclude is an optional (queries x m) array of rows that may not be
+    returned for each query.  Results are sorted best first; with k = 1
+    ties go to the lowest row, as with np.argmax.
+    """
+    queries = np.atleast_2d(np.asarray(queries, dtype=W.dtype))
+    num_queries = len(queries)
+    k = min(k, W.shape[0])
+    scores = np.full((num_queries, k), -np.inf)
+    indices = np.full((num_queries, k), -1, dtype=np.int64)
+    if exclude is not None:
+        exclude = np.asarray(exclude, dtype=np.int64)
+        exclude = exclude.reshape(num_queries, exclude.size // max(num_queries, 1))
+
+    for start, block in read_blocks(W, block_rows):
+        for q in range(0, num_queries, split_size):
+            subset = slice(q, q + split_size)
+            dist = np.dot(queries[subset], block.T)
+            if exclude is not None:
+                rows = exclude[subset] - start
+                hit = (rows >= 0) & (rows < len(block))
+                dist[np.nonzero(hit)[0], rows[hit]] = -np.inf
+            if k == 1:
+                best = np.argmax(dist, 1)[:, np.newaxis]
+            else:
+                kk = min(k, dist.shape[1])
+                best = np.argpartition(-dist, kk - 1, axis=1)[:, :kk]
+            scores[subset], indices[subset] = _merge_topk(scores[subset], indices[subset],
+                np.take_along_axis(dist, best, 1), best + start, k)
+    return indices, scores
+
+
+def predict_tiled(W, ind1, ind2, ind3, block_rows=65536, split_size=1024):
+    """analogy.predict over row blocks of a memory-mapped W."""
+    # fancy indexing reads only the question rows of the memory map
+    pred_vec = W[ind2, :] - W[ind1, :] + W[ind3, :]
+    indices, _ = tiled_topk(W, pred_vec, 1, np.stack([ind1, ind2, ind3], 1), block_rows, split_size)
+    return indices[:, 0]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Bulk lookup of word vectors for batches of tokens.
+
+The eval scripts fetch vectors one word at a time (W[vocab[term], :] in a
+Python loop).  VectorLookup resolves a whole batch of tokens to row IDs at
+once (VocabIndex.lookup, or the vocab dict), gathers the rows with np.take
+into a caller-provided buffer, and replaces unknown tokens with the '<unk>'
+vector.  As in glove's save_params, that vector is the average of the rows
+of the num_rare_words (100) least frequent words; computed on the raw
+vectors (read_bin) it is exactly the '<unk>' row glove writes.  The IDs of
+token sequences are kept in an LRU cache, so repeated sequences skip the
+lookup.
+
+    python eval/python/vector_lookup.py --vocab_file vocab.txt --vectors_file vectors.bin --tokens 1000000
+"""
+import argparse
+import sys
+import time
+from collections import OrderedDict
+import numpy as np
+
+from glove_vectors import read_words, build_vocab, load_normalized
+from vocab_index import VocabIndex, load_vocab_index
+
+UNK = -1
+NUM_RARE_WORDS = 100
+CACHE_SIZE = 65536
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='vocab.txt', type=str)
+    parser.add_argument('--vectors_file', default='vectors.txt', type=str)
+    parser.add_argument('--tokens', default=1000000, type=int, help='tokens looked up in the benchmark')
+    parser.add_argument('--sequence_length', default=20, type=int)
+    args = parser.parse_args()
+
+    words = read_words(args.vocab_file)
+    vocab, _ = build_vocab(words)
+    W = np.array(load_normalized(args.vectors_file, words))
+    rng = np.random.default_rng(0)
+    ranks = np.minimum(rng.zipf(1.1, args.tokens) - 1, len(words) - 1)
+    tokens = [words[r] for r in ranks]
+    for i in range(0, len(tokens), 50):
+        tokens[i] = tokens[i] + '\x01'
+    sequences = [tokens[i:i + args.sequence_length] for i in range(0, len(tokens), args.sequence_length)]
+
+    # the per-word loop of word_analogy.py / distance.py
+    start = time.time()
+    unk = unk_vector(W)
+    expected = np.array([W[vocab[term], :] if term in vocab else unk for term in tokens])
+    loop_time = time.time() - start
+
+    out = np.empty((len(tokens), W.shape[1]), dtype=W.dtype)
+    results = [('per-word loop', loop_time)]
+    for name, lookup in (('VectorLookup, dict', VectorLookup(W, vocab)),
+            ('VectorLookup, VocabIndex', VectorLookup(W, load_vocab_index(args.vocab_file)))):
+        start = time.time()
+        lookup.gather(tokens, out)
+        results.append((name + ', flat', time.time() - start))
+        assert np.array_equal(out, expected)
+        for label in ('cold cache', 'warm cache'):
+            start = time.time()
+            lookup.gather_batch(sequences, out)
+            results.append((name + ', sequences, ' + label, time.time() - start))
+            assert np.array_equal(out, expected)
+
+    print('%d tokens, %d x %d matrix' % (len(tokens), W.shape[0], W.shape[1]))
+    print('%-50s %10s %12s %8s' % ('', 'seconds', 'ns / token', 'speedup'))
+    for name, seconds in results:
+        print('%-50s %10.3f %12.0f %7.1fx' % (name, seconds, 1e9 * seconds / len(tokens), loop_time / seconds))
+    return 0
+
+
+def unk_vector(W, num_rare_words=NUM_RARE_WORDS):
+    """Average of the rows of the num_rare_words least frequent words, as save_params' '<unk>'."""
+    num_rare_words = min(num_rare_words, len(W))
+    return np.asarray(W[len(W) - num_rare_words:], dtype=np.float64).mean(0)
+
+
+class VectorLookup:
+    """Row gathering of W for batches of tokens, with an '<unk>' fallback."""
+
+    def __init__(self, W, vocab, unk=None, cache_size=CACHE_SIZE):
+        self.W = W
+        self.vocab = vocab
+        self.unk = unk_vector(W) if unk is None else np.asarray(unk)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def ids(self, tokens):
+        """int64 row IDs of the tokens, UNK for words outside the vocabulary.
+
+        tokens may also be an integer array of IDs, passed through.
+        """
+        if isinstance(tokens, np.ndarray) and tokens.dtype.kind in 'iu':
+            return tokens.astype(np.int64, copy=False)
+        if isinstance(self.vocab, VocabIndex):
+            return self.vocab.lookup(tokens, UNK)
+        get = self.vocab.get
+        return np.fromiter((get(t, UNK) for t in tokens), dtype=np.int64, count=len(tokens))
+
+    def sequence_ids(self, sequences):
+        """Row IDs of each token sequence, through the LRU cache.
+
+        The sequences missing from the cache are resolved together in one
+        bulk lookup.
+        """
+        keys = [tuple(s) for s in sequences]
+        cache = self._cache
+        missing = [k for k in dict.fromkeys(keys) if k not in cache]
+        if missing:
+            ids = self.ids([t for k in missing for t in k])
+            ids.flags.writeable = False
+            ends = np.cumsum([len(k) for k in missing])
+            for k, start, end in zip(missing, ends - [len(k) for k in missing], ends):
+                cache[k] = ids[start:end]
+        result = []
+        for k in keys:
+            cache.move_to_end(k)
+            result.append(cache[k])
+        while len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return result
+
+    def take(self, ids, out=None):
+        """Rows of W for the IDs into out ((len(ids), dim), any float dtype); UNK rows get the unk vector."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if out is None:
+            out = np.empty((len(ids), self.W.shape[1]), dtype=self.W.dtype)
+        elif out.shape != (len(ids), self.W.shape[1]):
+            raise ValueError('out has shape %s, expected %s' % (out.shape, (len(ids), self.W.shape[1])))
+        unknown = ids < 0
+        if (ids >= len(self.W)).any():
+            raise IndexError('row ID out of range for %d rows' % len(self.W))
+        # unknown IDs are clipped to row 0 by the gather and then overwritten
+        np.take(self.W, ids, axis=0, out=out, mode='clip')
+        if unknown.any():
+            out[unknown] = self.unk
+        return out
+
+    def gather(self, tokens, out=None):
+        """Vectors of a flat batch of tokens (or IDs), one row per token."""
+        return self.take(self.ids(tokens), out)
+
+    def gather_batch(self, sequences, out=None):
+        """Vectors of all the tokens of a batch of token sequences, one row per token, in order.
+
+        The IDs of each sequence come from the LRU cache; the offsets of the
+        sequences are the cumulative sum of their lengths.
+        """
+        ids = self.sequence_ids(sequences)
+        return self.take(np.concatenate(ids) if ids else np.empty(0, dtype=np.int64), out)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,333 @@
+"""Compact, memory-mappable vocabulary index.
+
+The vocab / ivocab dicts of the eval scripts cost roughly 200 bytes per
+word in Python objects and seconds to build for a few million words.  Here
+the words are one UTF-8 blob with an int64 offsets array, and word -> ID is
+an open-addressed hash table (linear probing on zlib's CRC-32, at most half
+full) of int32 IDs, with the CRC of every word kept alongside so that most
+probes never touch the blob.  Batches are probed vectorized.  The tables
+are saved next to the vocab file as '<vocab_file>.vidx', which later runs
+memory-map.
+
+VocabIndex answers vocab[word], word in vocab and vocab.get(word) like the
+dict, vocab.ivocab[idx] like ivocab, and vocab.lookup(words) resolves a
+batch of words to an ID array in NumPy.  It can also be passed where a
+word list is expected (it has a length and iterates over the words).
+
+    python eval/python/vocab_index.py --vocab_file vocab.txt --queries 1000000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import zlib
+import numpy as np
+
+from glove_vectors import read_words, build_vocab, tmp_path
+
+MAGIC = b'GLVVIDX1'
+EMPTY = -1
+ALIGN = 64
+# arrays of an index, in file order
+ARRAYS = (('blob', np.uint8), ('offsets', np.int64), ('hashes', np.uint32), ('table', np.int32))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='vocab.txt', type=str)
+    parser.add_argument('--queries', default=1000000, type=int, help='words looked up in the benchmark')
+    args = parser.parse_args()
+
+    start = time.time()
+    words = read_words(args.vocab_file)
+    read_time = time.time() - start
+
+    tracemalloc.start()
+    start = time.time()
+    vocab, ivocab = build_vocab(words)
+    dict_time = time.time() - start
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.time()
+    index = VocabIndex.build(words)
+    build_time = time.time() - start
+    index_file = index_path(args.vocab_file)
+    index.save_as(index_file)
+    start = time.time()
+    index = VocabIndex.load(index_file)
+    map_time = time.time() - start
+
+    print('%d words (read in %.2f s, words list not counted below)' % (len(words), read_time))
+    print('%-28s %10s %12s' % ('', 'MB', 'seconds'))
+    print('%-28s %10.1f %12.3f' % ('vocab + ivocab dicts', dict_bytes / 2.0 ** 20, dict_time))
+    print('%-28s %10.1f %12.3f' % ('VocabIndex build', index.nbytes / 2.0 ** 20, build_time))
+    print('%-28s %10s %12.3f' % ('VocabIndex memory map', '', map_time))
+
+    rng = np.random.default_rng(0)
+    # a Zipf-like mix of frequent and rare words, and some unknown ones
+    ranks = np.minimum(rng.zipf(1.1, args.queries) - 1, len(words) - 1)
+    queries = [words[r] for r in ranks]
+    for i in range(0, len(queries), 50):
+        queries[i] = queries[i] + '\x01'
+
+    start = time.time()
+    expected = np.array([vocab.get(w, -1) for w in queries])
+    dict_lookup = time.time() - start
+    start = time.time()
+    single = np.array([index.get(w, -1) for w in queries])
+    index_lookup = time.time() - start
+    start = time.time()
+    batch = index.lookup(queries)
+    batch_lookup = time.time() - start
+    assert (single == expected).all() and (batch == expected).all()
+    start = time.time()
+    for i in ranks[:100000]:
+        ivocab[i]
+    dict_reverse = time.time() - start
+    start = time.time()
+    for i in ranks[:100000]:
+        index.ivocab[i]
+    index_reverse = time.time() - start
+
+    print('%-28s %12s' % ('%d lookups' % len(queries), 'ns / word'))
+    print('%-28s %12.0f' % ('dict.get', 1e9 * dict_lookup / len(queries)))
+    print('%-28s %12.0f' % ('VocabIndex.get', 1e9 * index_lookup / len(queries)))
+    print('%-28s %12.0f' % ('VocabIndex.lookup (batch)', 1e9 * batch_lookup / len(queries)))
+    print('%-28s %12.0f' % ('ivocab[idx]', 1e9 * dict_reverse / min(len(ranks), 100000)))
+    print('%-28s %12.0f' % ('VocabIndex.ivocab[idx]', 1e9 * index_reverse / min(len(ranks), 100000)))
+    return 0
+
+
+def hash_words(encoded):
+    """uint32 CRC-32 of each encoded word."""
+    return np.fromiter((zlib.crc32(w) for w in encoded), dtype=np.uint32, count=len(encoded))
+
+
+def _encode(words):
+    """(blob, offsets, hashes) of the UTF-8 encoded words."""
+    encoded = [w.encode('utf-8') for w in words]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(w) for w in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets, hash_words(encoded)
+
+
+def _segments_equal(blob_a, offsets_a, ids_a, blob_b, offsets_b, ids_b):
+    """Whether segment ids_a of blob_a equals segment ids_b of blob_b, elementwise."""
+    start_a, start_b = offsets_a[ids_a], offsets_b[ids_b]
+    lengths = offsets_a[ids_a + 1] - start_a
+    equal = lengths == offsets_b[ids_b + 1] - start_b
+    active = np.flatnonzero(equal)
+    pos = 0
+    while len(active):
+        active = active[lengths[active] > pos]
+        differ = blob_a[start_a[active] + pos] != blob_b[start_b[active] + pos]
+        equal[active[differ]] = False
+        active = active[~differ]
+        pos += 1
+    return equal
+
+
+def index_path(vocab_file):
+    return vocab_file + '.vidx'
+
+
+class IVocab:
+    """ID -> word view of a VocabIndex, for code written against the ivocab dict."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, idx):
+        if not 0 <= idx < len(self.index):
+            raise KeyError(idx)
+        return self.index.word(idx)
+
+    def get(self, idx, default=None):
+        return self.index.word(idx) if 0 <= idx < len(self.index) else default
+
+    def __len__(self):
+        return len(self.index)
+
+
+class VocabIndex:
+    """word -> ID over a UTF-8 blob, its offsets and an open-addressed hash table."""
+
+    def __init__(self, blob, offsets, hashes, table):
+        self.blob = blob
+        self.offsets = offsets
+        self.hashes = hashes
+        self.table = table
+        self.mask = len(table) - 1
+        # single-word lookups index memoryviews, which return Python ints and bytes without NumPy scalars
+        self._blob = memoryview(blob)
+        self._offsets = memoryview(offsets)
+        self._hashes = memoryview(hashes)
+        self._table = memoryview(table)
+
+    @property
+    def ivocab(self):
+        return IVocab(self)
+
+    @classmethod
+    def build(cls, words):
+        blob, offsets, hashes = _encode(words)
+        size = 1 << max(4, int(2 * max(len(hashes), 1) - 1).bit_length())
+        table = np.full(size, EMPTY, dtype=np.int32)
+        pending = np.arange(len(hashes), dtype=np.int64)
+        slots = hashes.astype(np.int64) & (size - 1)
+        # insert in ID order: each round, the lowest pending ID of every free slot takes it
+        while len(pending):
+            free = table[slots] == EMPTY
+            _, first = np.unique(slots[free], return_index=True)
+            placed = np.flatnonzero(free)[first]
+            table[slots[placed]] = pending[placed]
+            keep = np.ones(len(pending), dtype=bool)
+            keep[placed] = False
+            pending, slots = pending[keep], (slots[keep] + 1) & (size - 1)
+        return cls(blob, offsets, hashes, table)
+
+    def _find(self, word):
+        if not isinstance(word, str):
+            # as for a dict, a key of another type is just not found
+            return -1
+        key = word.encode('utf-8')
+        h = zlib.crc32(key)
+        slot = h & self.mask
+        table, hashes, offsets = self._table, self._hashes, self._offsets
+        while True:
+            idx = table[slot]
+            if idx == EMPTY:
+                return -1
+            if hashes[idx] == h and self._blob[offsets[idx]:offsets[idx + 1]] == key:
+                return idx
+            slot = (slot + 1) & self.mask
+
+    def __getitem__(self, word):
+        idx = self._find(word)
+        if idx < 0:
+            raise KeyError(word)
+        return idx
+
+    def get(self, word, default=None):
+        idx = self._find(word)
+        return default if idx < 0 else idx
+
+    def __contains__(self, word):
+        return self._find(word) >= 0
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        blob = self.blob.tobytes()
+        offsets = self.offsets.tolist()
+        for i in range(len(offsets) - 1):
+            yield blob[offsets[i]:offsets[i + 1]].decode('utf-8')
+
+    def word(self, idx):
+        return str(self._blob[self._offsets[idx]:self._offsets[idx + 1]], 'utf-8')
+
+    def words(self):
+        return list(self)
+
+    def lookup(self, words, default=-1):
+        """int64 IDs of a batch of words, default for unknown ones."""
+        q_blob, q_offsets, h = _encode(words)
+        ids = np.full(len(h), default, dtype=np.int64)
+        pending = np.arange(len(h))
+        slots = h.astype(np.int64) & self.mask
+        while len(pending):
+            cand = self.table[slots].astype(np.int64)
+            found = cand != EMPTY
+            match = np.zeros(len(pending), dtype=bool)
+            same = np.flatnonzero(found)
+            same = same[self.hashes[cand[same]] == h[pending[same]]]
+            match[same] = _segments_equal(self.blob, self.offsets, cand[same], q_blob, q_offsets, pending[same])
+            ids[pending[match]] = cand[match]
+            # unmatched words probe the next slot until they hit an empty one
+            keep = found & ~match
+            pending, slots = pending[keep], (slots[keep] + 1) & self.mask
+        return ids
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name, _ in ARRAYS)
+
+    def layout(self):
+        """[(name, dtype, length, byte offset)] of the arrays after a 64-byte header, and the total size."""
+        entries = []
+        pos = ALIGN
+        for name, dtype in ARRAYS:
+            length = len(getattr(self, name))
+            entries.append((name, dtype, length, pos))
+            pos += (length * np.dtype(dtype).itemsize + ALIGN - 1) // ALIGN * ALIGN
+        return entries, pos
+
+    def write_into(self, buf, offset=0):
+        """Write the index into a writable buffer (such as shared memory) at offset."""
+        entries, _ = self.layout()
+        buf[offset:offset + len(MAGIC)] = np.frombuffer(MAGIC, dtype=np.uint8)
+        np.frombuffer(buf, dtype=np.int64, count=len(entries), offset=offset + len(MAGIC))[:] = \
+            [length for _, _, length, _ in entries]
+        for name, dtype, length, pos in entries:
+            np.frombuffer(buf, dtype=dtype, count=length, offset=offset + pos)[:] = getattr(self, name)
+
+    def save(self, path):
+        _, size = self.layout()
+        out = np.memmap(path, dtype=np.uint8, mode='w+', shape=(size,))
+        self.write_into(out)
+        out.flush()
+
+    def save_as(self, path):
+        """Save to path through a temporary file unique to the process and thread."""
+        tmp_file = tmp_path(path)
+        try:
+            self.save(tmp_file)
+            os.replace(tmp_file, path)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    @classmethod
+    def from_buffer(cls, buf, offset=0):
+        """Index over a buffer holding a saved index at offset (a memory map or shared memory)."""
+        if bytes(buf[offset:offset + len(MAGIC)]) != MAGIC:
+            raise ValueError('not a vocabulary index')
+        lengths = np.frombuffer(buf, dtype=np.int64, count=len(ARRAYS), offset=offset + len(MAGIC))
+        arrays = []
+        pos = ALIGN
+        for (name, dtype), length in zip(ARRAYS, lengths):
+            arrays.append(np.frombuffer(buf, dtype=dtype, count=int(length), offset=offset + pos))
+            pos += (int(length) * np.dtype(dtype).itemsize + ALIGN - 1) // ALIGN * ALIGN
+        return cls(*arrays)
+
+    @classmethod
+    def load(cls, path):
+        return cls.from_buffer(np.memmap(path, dtype=np.uint8, mode='r'))
+
+
+def load_vocab_index(vocab_file, cache=True):
+    """The VocabIndex of vocab_file, memory-mapped from '<vocab_file>.vidx' when it is current.
+
+    When the cache cannot be written (a read-only vocab directory), the
+    index is built in memory.
+    """
+    cache_file = index_path(vocab_file)
+    if (cache and os.path.isfile(cache_file)
+            and os.path.getmtime(cache_file) >= os.path.getmtime(vocab_file)):
+        return VocabIndex.load(cache_file)
+    index = VocabIndex.build(read_words(vocab_file))
+    if cache:
+        try:
+            index.save_as(cache_file)
+        except OSError as ex:
+            sys.stderr.write("Could not cache vocabulary index in %s: %s\n" % (cache_file, ex))
+            return index
+        return VocabIndex.load(cache_file)
+    return index
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,23 +2,33 @@ import argparse
 import numpy as np
 import sys
 
+from glove_vectors import load_normalized
+from quantized import load_quantized, search_quantized
+from vocab_index import load_vocab_index
+
 def generate():
     parser = argparse.ArgumentParser()
     parser.add_argument('--vocab_file', default='vocab.txt', type=str)
     parser.add_argument('--vectors_file', default='vectors.txt', type=str)
+    parser.add_argument('--quantized', action='store_true',
+        help='score with per-row scaled int8 codes and re-score a shortlist in float32 (see quantized.py); '
+        'the codes and the normalized matrix are memory-mapped caches written next to the vectors file')
+    parser.add_argument('--shortlist', default=200, type=int)
     args = parser.parse_args()
 
-    with open(args.vocab_file, 'r') as f:
-        words = [x.rstrip().split(' ')[0] for x in f.readlines()]
+    vocab = load_vocab_index(args.vocab_file)
+    ivocab = vocab.ivocab
+    if args.quantized:
+        # the codes are scored and the shortlist re-scored from the mapped normalized rows
+        W_norm = load_normalized(args.vectors_file, vocab)
+        return (W_norm, vocab, ivocab, load_quantized(args.vectors_file, W_norm), args.shortlist)
     with open(args.vectors_file, 'r') as f:
         vectors = {}
         for line in f:
             vals = line.rstrip().split(' ')
             vectors[vals[0]] = [float(x) for x in vals[1:]]
 
-    vocab_size = len(words)
-    vocab = {w: idx for idx, w in enumerate(words)}
-    ivocab = {idx: w for idx, w in enumerate(words)}
+    vocab_size = len(vocab)
 
     vector_dim = len(vectors[ivocab[0]])
     W = np.zeros((vocab_size, vector_dim))
@@ -31,10 +41,10 @@ def generate():
     W_norm = np.zeros(W.shape)
     d = (np.sum(W ** 2, 1) ** (0.5))
     W_norm = (W.T / d).T
-    return (W_norm, vocab, ivocab)
+    return (W_norm, vocab, ivocab, None, args.shortlist)
 
 
-def distance(W, vocab, ivocab, input_term):
+def distance(W, vocab, ivocab, input_term, quantized=None, shortlist=200):
     vecs = {}
     if len(input_term.split(' ')) < 3:
         print("Only %i words were entered.. three words are needed at the input to perform the calculation\n" % len(input_term.split(' ')))
@@ -54,13 +64,19 @@ def distance(W, vocab, ivocab, input_term):
         d = (np.sum(vec_result ** 2,) ** (0.5))
         vec_norm = (vec_result.T / d).T
 
-        dist = np.dot(W, vec_norm.T)
+        if quantized is None:
+            dist = np.dot(W, vec_norm.T)
 
-        for term in input_term.split(' '):
-            index = vocab[term]
-            dist[index] = -np.Inf
+            for term in input_term.split(' '):
+                index = vocab[term]
+                dist[index] = -np.Inf
 
-        a = np.argsort(-dist)[:N]
+            a = np.argsort(-dist)[:N]
+        else:
+            # int8 scores for the vocabulary, float32 re-scoring of the shortlist
+            exclude = [[vocab[term] for term in input_term.split(' ')]]
+            a = search_quantized(quantized, W, vec_norm, N, exclude, shortlist)[0]
+            dist = {x: np.dot(W[x, :], vec_norm) for x in a}
 
         print("\n                               Word       Cosine distance\n")
         print("---------------------------------------------------------\n")
@@ -70,11 +86,11 @@ def distance(W, vocab, ivocab, input_term):
 
 if __name__ == "__main__":
     N = 100;          # number of closest words that will be shown
-    W, vocab, ivocab = generate()
+    W, vocab, ivocab, quantized, shortlist = generate()
     while True:
         input_term = raw_input("\nEnter three words (EXIT to break): ")
         if input_term == 'EXIT':
             break
         else:
-            distance(W, vocab, ivocab, input_term)
+            distance(W, vocab, ivocab, input_term, quantized, shortlist)
 
@@ -0,0 +1,231 @@
+"""Host and domain helpers for snake_glove.py.
+
+They live outside the Snakefile so that the langstat workers of the process
+pool can import them.  The host map cache lets a workflow start without
+re-reading hosts.gz and re-resolving every domain when nothing changed.
+"""
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from functools import lru_cache
+
+import tldextract
+from tqdm import tqdm
+
+from streamio import OpenCompressed
+
+DOMAIN_CACHE_SIZE = 1 << 20
+
+
+def _extract_domain(host):
+    return tldextract.extract(host).domain
+
+_domain_cache = lru_cache(maxsize=DOMAIN_CACHE_SIZE)(_extract_domain)
+
+
+def SetDomainCacheSize(size):
+    """Replace the shared domain cache with an empty one holding size hosts."""
+    global _domain_cache
+    _domain_cache = lru_cache(maxsize=size)(_extract_domain)
+
+
+def DomainOf(host):
+    """tldextract domain of host, memoized in a bounded LRU cache shared by
+    every caller in the process."""
+    return _domain_cache(host)
+
+
+###########################################################
+# LANGSTAT
+
+# per-worker state, set once by _InitLangstatWorker
+_worker = {}
+
+def _InitLangstatWorker(l12, threshold, excluded_set):
+    _worker['l12'] = l12
+    _worker['threshold'] = threshold
+    _worker['excluded'] = excluded_set
+
+
+def _HostsFromLangstatChunk(chunk):
+    """Hosts of chunk with both languages above the threshold.
+
+    chunk is a block of whole langstat lines in which every host's rows are
+    contiguous and complete, so hosts can be decided independently of the
+    neighbouring chunks.
+    """
+    l12 = _worker['l12']
+    threshold = _worker['threshold']
+    excluded_set = _worker['excluded']
+    hostsToCrawl = set()
+
+    def accept(host, langContent):
+        if len(langContent) == 2:
+            if langContent[l12[0]] >= threshold and langContent[l12[1]] >= threshold:
+                hostsToCrawl.add(host)
+
+    prevHost = None
+    excluded = False
+    langContent = {}
+    for line in chunk.decode('utf-8').splitlines():
+        split_line = line.split()
+        if len(split_line) != 3:
+            continue
+
+        host, lang, byte_len = split_line
+        if host != prevHost:
+            # start of new host. Process previous entries
+            accept(prevHost, langContent)
+            prevHost = host
+            langContent = {}
+            # the domain is only needed, and resolved once per host, when excluding
+            excluded = bool(excluded_set) and DomainOf(host) in excluded_set
+
+        lang = lang.lower()
+        if lang in l12 and not excluded:
+            langContent[lang] = int(byte_len)
+
+    # last host
+    accept(prevHost, langContent)
+    return hostsToCrawl
+
+
+def _SplitLastHost(lines):
+    """Split lines before the rows of the last host, which may continue in
+    the next block."""
+    i = len(lines)
+    last = None
+    while i > 0:
+        split_line = lines[i - 1].split()
+        if len(split_line) == 3:
+            if last is None:
+                last = split_line[0]
+            elif split_line[0] != last:
+                break
+        i -= 1
+    return lines[:i], lines[i:]
+
+
+def _ReadLangstatChunks(langstat_path, chunk_bytes):
+    """Yield (chunk, num_lines) blocks that never split the rows of a host."""
+    with OpenCompressed(langstat_path, 'rb') as f:
+        carry = []
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if not lines:
+                break
+            head, carry = _SplitLastHost(carry + lines)
+            if head:
+                yield b''.join(head), len(head)
+        if carry:
+            yield b''.join(carry), len(carry)
+
+
+def HostsFromLangstat(langstat_path, lang1, lang2, threshold, excluded_set,
+        processes=None, chunk_bytes=16 << 20):
+    """Parallel version of the langstat scan of snake_glove.py.
+
+    Blocks of the (gzip, xz or plain) langstat file are parsed in a process
+    pool; at most two blocks per worker are in flight so memory stays
+    bounded.  Progress is reported in lines/sec.
+    """
+    l12 = [lang1.lower(), lang2.lower()]
+    processes = processes or os.cpu_count()
+    hostsToCrawl = set()
+    start = time.time()
+
+    with tqdm(total=None, unit=" lines", unit_scale=True) as pbar, \
+            ProcessPoolExecutor(processes, initializer=_InitLangstatWorker,
+                initargs=(l12, threshold, excluded_set)) as pool:
+        pending = {}
+        for chunk, chunk_lines in _ReadLangstatChunks(langstat_path, chunk_bytes):
+            pending[pool.submit(_HostsFromLangstatChunk, chunk)] = chunk_lines
+            if len(pending) >= 2 * processes:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    hostsToCrawl.update(future.result())
+                    pbar.update(pending.pop(future))
+        for future in list(pending):
+            hostsToCrawl.update(future.result())
+            pbar.update(pending.pop(future))
+        num_lines = pbar.n
+
+    elapsed = max(time.time() - start, 1e-9)
+    sys.stderr.write("langstat: {0} lines in {1:.1f}s ({2:.0f} lines/sec), {3} hosts\n".format(
+        num_lines, elapsed, num_lines / elapsed, len(hostsToCrawl)))
+    return hostsToCrawl
+
+
+###########################################################
+# HOST MAP CACHE
+
+# bump when the cached structures or the way they are computed change
+HOSTMAP_CACHE_VERSION = 1
+
+
+def _FileHash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _Stamp(path, old=None):
+    """(mtime_ns, size, sha1) of path, or None if it does not exist.
+
+    The file is only hashed when its mtime or size differ from old.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if old is not None and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+        return old
+    return (st.st_mtime_ns, st.st_size, _FileHash(path))
+
+
+def _SettingsKey(settings):
+    return json.dumps([HOSTMAP_CACHE_VERSION, tldextract.__version__, settings], sort_keys=True)
+
+
+def LoadHostMapCache(cache_path, inputs, settings):
+    """Return the cached host map if it was built from the same inputs.
+
+    inputs are the files the map depends on and settings the relevant config
+    values.  A changed mtime alone does not invalidate the cache as long as
+    the content hash is unchanged.
+    """
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    if cache.get('key') != _SettingsKey(settings) or sorted(cache['inputs']) != sorted(inputs):
+        return None
+    for path, old in cache['inputs'].items():
+        stamp = _Stamp(path, old)
+        if (stamp is None) != (old is None) or (stamp is not None and stamp[2] != old[2]):
+            return None
+        cache['inputs'][path] = stamp
+    return cache
+
+
+def SaveHostMapCache(cache_path, inputs, settings, hosts, domainKey2Hosts, linked, old=None):
+    """Atomically write the host map together with the stamps of its inputs."""
+    old_stamps = old['inputs'] if old else {}
+    cache = {
+        'key': _SettingsKey(settings),
+        'inputs': {path: _Stamp(path, old_stamps.get(path)) for path in inputs},
+        'hosts': hosts,
+        'domainKey2Hosts': domainKey2Hosts,
+        'linked': linked,
+    }
+    tmp_path = "{0}.tmp.{1}".format(cache_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
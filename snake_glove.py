@@ -4,21 +4,26 @@
 import sys
 import glob
 import gzip
-import lzma
-import tldextract
 import os
 import os.path
 import socket
-import shutil
+import threading
+import time
 from tld import get_tld
-from tqdm import tqdm
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from pathlib import Path
 from toolwrapper import ToolWrapper
 from func_timeout import func_timeout, FunctionTimedOut
 from cerberus import Validator
 
+# helper modules next to this Snakefile
+sys.path.insert(0, workflow.basedir)
+from hostmap import DomainOf, SetDomainCacheSize, HostsFromLangstat, LoadHostMapCache, SaveHostMapCache
+from streamio import ConcatXz, OpenCompressed, AppendFile, FsyncFile
+from dictsym import SymmetriseDic
+
 ###########################################################
 # UTILS
 
@@ -45,25 +50,76 @@ def systemCheck(cmd):
 
     subprocess.check_call(cmd, shell=True)
 
-@contextmanager
-def open_gzip_or_plain(file_path):
+NETWORK_FS_TYPES = {"nfs", "nfs4", "lustre", "gpfs", "cifs", "smb3", "beegfs", "ceph", "panfs", "fuse.glusterfs"}
 
-    def decode_text(file_handler):
-        for line in file_handler:
-            yield line.decode('utf-8')
+def IsNetworkFS(path):
+    """True if path lives on a network filesystem, according to /proc/mounts"""
+    path = os.path.realpath(path)
+    mount, fstype = "", ""
+    try:
+        with open("/proc/mounts", "rt") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                if (path == fields[1] or path.startswith(fields[1].rstrip("/") + "/")) and len(fields[1]) > len(mount):
+                    mount, fstype = fields[1], fields[2]
+    except OSError:
+        return False
+    return fstype in NETWORK_FS_TYPES
+
+def FsMap(func, items, threads):
+    """map() over filesystem calls, in a thread pool when threads > 1"""
+    if threads > 1 and len(items) > 1:
+        with ThreadPoolExecutor(threads) as pool:
+            return list(pool.map(func, items))
+    return [func(item) for item in items]
+
+def ApplyLinks(links, threads=1, replace=True):
+    """Create the (target, link) symlinks in-process, creating missing parent directories.
+
+    With replace=True an existing link is swapped atomically for the new one (like ln -sfn);
+    with replace=False existing paths are left alone. A link listed more than once keeps its
+    first target. Prints a summary of what changed.
+    """
+    first = {}
+    for target, link in links:
+        first.setdefault(link, target)
+    links = [(target, link) for link, target in first.items()]
+    dirs = sorted({os.path.dirname(link) for target, link in links})
+    newDirs = [d for d, isdir in zip(dirs, FsMap(os.path.isdir, dirs, threads)) if not isdir]
+    FsMap(lambda d: os.makedirs(d, exist_ok=True), newDirs, threads)
+
+    def link_one(pair):
+        target, link = pair
+        if not replace:
+            try:
+                os.symlink(target, link)
+            except FileExistsError:
+                return "unchanged"
+            return "created"
+        existed = os.path.lexists(link)
+        if existed and os.path.islink(link) and os.readlink(link) == target:
+            return "unchanged"
+        # one temporary name per thread, so concurrent calls never collide
+        tmp = "{link}.tmp.{pid}.{tid}".format(link=link, pid=os.getpid(), tid=threading.get_ident())
+        os.symlink(target, tmp)
+        os.replace(tmp, link)
+        return "replaced" if existed else "created"
+
+    results = FsMap(link_one, links, threads)
+    if links:
+        sys.stderr.write("links: {0} created, {1} replaced, {2} unchanged; {3} directories created\n".format(
+            results.count("created"), results.count("replaced"), results.count("unchanged"), len(newDirs)))
+    return results
 
+@contextmanager
+def open_gzip_or_plain(file_path):
     f = None
     try:
         #print("file_path", file_path)
-        if file_path[-3:] == ".gz":
-            f = gzip.open(file_path, 'rb')
-            yield decode_text(f)
-        elif file_path[-3:] == ".xz":
-            f = lzma.open(file_path, 'rb')
-            yield decode_text(f)
-        else:
-            f = open(file_path, 'r')
-            yield f
+        f = OpenCompressed(file_path, 'rt')
+        yield f
 
     except Exception as ex:
         sys.stderr.write(str(ex)+"\n")
@@ -73,6 +129,62 @@ def open_gzip_or_plain(file_path):
         if f:
             f.close()
 
+# characters of aggregated bleualign output handed to the compressor at once
+AGGREGATE_BATCH = 16*1024*1024
+
+def ReadAlignedDocument(filename, urls):
+    """Lines of a bleualign/aligned.{id}.gz file, each prefixed with urls and a tab"""
+    with open(filename, 'rb') as f:
+        text = gzip.decompress(f.read()).decode('utf-8')
+    if len(text) == 0:
+        return text
+    prefix = urls + "\t"
+    prefixed = prefix + text.replace("\n", "\n" + prefix)
+    if text.endswith("\n"):
+        prefixed = prefixed[:-len(prefix)]
+    return prefixed
+
+def AggregateBleualign(alignInfo, dir, output, threads):
+    """Concatenate the aligned.{id}.gz files listed in alignInfo into output, in order.
+
+    The files are read and decompressed in a thread pool, at most 4 per thread
+    ahead of the writer, and written to the compressor in batches.
+    """
+    start = time.time()
+    documents = 0
+    batch = []
+    batchSize = 0
+    with OpenCompressed(output, "wt") as algFile, ThreadPoolExecutor(threads) as pool:
+        pending = deque()
+
+        def take():
+            nonlocal batchSize
+            text = pending.popleft().result()
+            batch.append(text)
+            batchSize += len(text)
+            if batchSize >= AGGREGATE_BATCH:
+                algFile.write("".join(batch))
+                batch.clear()
+                batchSize = 0
+
+        with open_gzip_or_plain(alignInfo) as urlsFile:
+            for urlAlg in urlsFile:
+                urlAlg = urlAlg.strip()
+                if len(urlAlg) == 0:
+                    continue
+                fields = urlAlg.split("\t")
+                filename = dir + "/bleualign/aligned." + str(fields[0]) + ".gz"
+                pending.append(pool.submit(ReadAlignedDocument, filename, "\t".join(fields[1:])))
+                documents += 1
+                while len(pending) >= 4 * threads or (pending and pending[0].done()):
+                    take()
+        while pending:
+            take()
+        algFile.write("".join(batch))
+    FsyncFile(output)
+    elapsed = max(time.time() - start, 1e-9)
+    sys.stderr.write("Aggregated {0} bleualign documents in {1:.1f}s ({2:.0f} documents/sec)\n".format(documents, elapsed, documents / elapsed))
+
 
 def ValidateArgs(config):
     schema = {'bitextor': {'required': True, 'type': 'string'},
@@ -96,6 +208,7 @@ def ValidateArgs(config):
            'maxSizeWARC': {'type': 'integer'},
 
            'dic': {'type': 'string'},
+           'symmetriseMemory': {'type': 'integer'},
            'LANG1Tokenizer': {'type': 'string'},
            'LANG2Tokenizer': {'type': 'string'},
            'LANG2Detokenizer': {'type': 'string'},
@@ -119,6 +232,7 @@ def ValidateArgs(config):
            'bleualign': {'type': 'boolean'},
            'docAlignThreshold': {'type': 'float'},
            'bleuAlignThreshold': {'type': 'float'},
+           'bleualignAggregateThreads': {'type': 'integer'},
 
            'bicleaner': {'type': 'string'},
            'bicleanerThreshold': {'type': 'float'},
@@ -137,6 +251,9 @@ def ValidateArgs(config):
            'langstat': {'type': 'string'},
            'langstatExcludeStrings': {'type': 'string'},
            'langstatThreshold': {'type': 'integer'},
+           'langstatProcesses': {'type': 'integer'},
+           'domainCacheSize': {'type': 'integer'},
+           'fsThreads': {'type': 'integer'},
 
            'initCorpusTrainPrefix': {'type': 'list'},
            'initCorpusDevPrefix': {'type': 'list'},
@@ -255,12 +372,26 @@ if "profiling" in config and config["profiling"]:
 systemCheck("mkdir -p " + permanent)
 systemCheck("mkdir -p " + transient)
 
+#Threads used to prepare links and directories; a thread pool hides the latency of network filesystems
+if "fsThreads" in config:
+  FS_THREADS=config["fsThreads"]
+elif IsNetworkFS(permanent) or IsNetworkFS(transient):
+  FS_THREADS=16
+else:
+  FS_THREADS=1
+
 #Dictionary
 if "dic" in config:
   DIC=config["dic"]
 else:
   DIC=None
 
+#Memory (in MB) for the translation tables when a dictionary is built with symmetrise_dic; larger tables are partitioned in TMPDIR
+if "symmetriseMemory" in config:
+  SYMMETRISE_MEMORY=config["symmetriseMemory"]
+else:
+  SYMMETRISE_MEMORY=4096
+
 #Option to remove Boilerpipe html: if the option is enabled, boilerpipe is not used
 if "boilerpipeCleaning" in config and config["boilerpipeCleaning"]==True:
   boilerpipeCleaning = '--boilerpipe'
@@ -407,6 +538,12 @@ else:
     BLEU_THRESHOLD = 0.2
 #print("DOC_THRESHOLD", DOC_THRESHOLD, "BLEU_THRESHOLD", BLEU_THRESHOLD)
 
+#Number of threads reading the per-document bleualign outputs when they are aggregated (default: 8)
+if "bleualignAggregateThreads" in config:
+    BLEUALIGN_AGGREGATE_THREADS = config["bleualignAggregateThreads"]
+else:
+    BLEUALIGN_AGGREGATE_THREADS = 8
+
 ############ FILTERING AND POST-PROCESSING OPTIONS ############
 
 if "bicleaner" in config:
@@ -449,6 +586,16 @@ if "restorative" in config and config["restorative"]:
 else:
   RESTORATIVE="segclean"
 
+#Number of processes parsing the langstat file (default: all cores)
+if "langstatProcesses" in config:
+  LANGSTAT_PROCESSES=config["langstatProcesses"]
+else:
+  LANGSTAT_PROCESSES=None
+
+#Number of hosts kept in the memoized host-to-domain cache
+if "domainCacheSize" in config:
+  SetDomainCacheSize(config["domainCacheSize"])
+
 #========================= MAPPING URLS AND OUTPUT FILES =========================#
 
 def CreateDomainKey2HostMap(hosts):
@@ -458,7 +605,7 @@ def CreateDomainKey2HostMap(hosts):
         if host.find(".blogspot.") >= 0 or host.find(".wordpress.") >= 0:
            key = host
         else:
-           key = tldextract.extract(host).domain
+           key = DomainOf(host)
 
         if key not in ret:
             ret[key]=[]
@@ -477,12 +624,33 @@ def FilterTLD(tlds):
     else:
         return tlds
 
-def InitConcatLogicLink(domains):
-    for tld,hosts in domains.items():
-        if len(hosts) == 1 and  os.path.isfile("{permanent}/warc/{host}/{crawler}.warc.xz".format(permanent=permanent, host=hosts[0], crawler=CRAWLTARGET)) and not os.path.isfile("{transient}/{tld}/concat.warc.xz".format(tld=tld,transient=transient)):
-            cmd="mkdir -p {transient}/{tld}; ln -sfn {permanent}/warc/{host}/{crawler}.warc.xz {transient}/{tld}/concat.warc.xz".format(permanent=permanent, host=hosts[0], crawler=CRAWLTARGET, transient=transient,
- tld=tld)
-            shell(cmd)
+def InitConcatLogicLink(domains, done=frozenset()):
+    """Link concat.warc.xz of single-host domains; returns the domains whose link now exists.
+
+    Domains in done were linked by a previous run; the transient directory may have been wiped
+    since, so their link is checked again (cheaply, without following it) and recreated if missing.
+    """
+    candidates = [(tld, hosts[0]) for tld, hosts in domains.items() if len(hosts) == 1]
+
+    def check(candidate):
+        tld, host = candidate
+        link = "{transient}/{tld}/concat.warc.xz".format(tld=tld,transient=transient)
+        if os.path.lexists(link) if tld in done else os.path.isfile(link):
+            return "exists"
+        if os.path.isfile("{permanent}/warc/{host}/{crawler}.warc.xz".format(permanent=permanent, host=host, crawler=CRAWLTARGET)):
+            return "link"
+        return None
+
+    linked = set()
+    links = []
+    for (tld, host), state in zip(candidates, FsMap(check, candidates, FS_THREADS)):
+        if state == "link":
+            links.append(("{permanent}/warc/{host}/{crawler}.warc.xz".format(permanent=permanent, host=host, crawler=CRAWLTARGET),
+                "{transient}/{tld}/concat.warc.xz".format(transient=transient, tld=tld)))
+        if state is not None:
+            linked.add(tld)
+    ApplyLinks(links, FS_THREADS)
+    return linked
 
 def LoadDomains(file_path):
     domains = set()
@@ -497,7 +665,7 @@ def LoadDomains(file_path):
 def GetDomainKeys(hosts):
     keys = set()
     for host in hosts:
-        domain = tldextract.extract(host).domain
+        domain = DomainOf(host)
         keys.add(domain)
     return keys
 
@@ -508,74 +676,34 @@ def ExcludeHosts(hosts, excludeHosts):
     print("BEFORE hosts", len(hosts), len(hostsCopy))
 
     for host in hostsCopy:
-        key = tldextract.extract(host).domain
+        key = DomainOf(host)
         if key in excludeKeys:
             hosts.remove(host)
     print("AFTER hosts", len(hosts), len(hostsCopy))
 
 def GetHostsFromLangstat(langstat_path, lang1, lang2, threshold, exclude_path):
     print("langstat_path", langstat_path, file=sys.stderr)
-    l12 = [lang1.lower(), lang2.lower()]
 
     excluded_set = set()
     if exclude_path:
         excluded_set = LoadDomains(Path(exclude_path))
 
-    hostsToCrawl = set()
-
     #sys.stderr.write(
-    #    "Gathering domain information for {0} and {1}...\n".format(*l12))
-    with tqdm(total=None) as pbar:
-        with open_gzip_or_plain(langstat_path) as f:
-
-            prevHost = ""
-            langContent = {}
-
-            for line in f:
-                split_line = line.strip().split()
-                if len(split_line) != 3:
-                    continue
-
-                host, lang, byte_len = split_line
-                name = tldextract.extract(host).domain
-                #print("processing ", host, lang.lower(), byte_len, name)
-
-                if host != prevHost:
-                    # start of new host. Process previous entries
-                    if len(langContent) == 2:
-                        lang1_bytes = langContent[l12[0]]
-                        lang2_bytes = langContent[l12[1]]
-                        if lang1_bytes >= threshold and lang2_bytes >= threshold:
-                            hostsToCrawl.add(prevHost)
-
-                    prevHost = host
-                    langContent = {}
-
-                if lang.lower() in l12 and name not in excluded_set:
-                    langContent[lang.lower()] = int(byte_len)
-
-                pbar.update(1)
-
-            # last host
-            if len(langContent) == 2:
-                lang1_bytes = langContent[l12[0]]
-                lang2_bytes = langContent[l12[1]]
-                if lang1_bytes >= threshold and lang2_bytes >= threshold:
-                    hostsToCrawl.add(prevHost)
-
-    return hostsToCrawl
+    #    "Gathering domain information for {0} and {1}...\n".format(lang1, lang2))
+    return HostsFromLangstat(langstat_path, lang1, lang2, threshold, excluded_set, processes=LANGSTAT_PROCESSES)
 
 def LinkedHosts(permanent, dir, hosts, linkedHostsAction):
+    """Apply linkedHostsAction to the hosts also listed in dir; returns the (target, link) symlinks the "link" action needs"""
     #print("dir", dir)
-    cmd = "mkdir -p " + permanent + "/warc"
-    shell(cmd)
+    os.makedirs(permanent + "/warc", exist_ok=True)
 
-    with gzip.open(dir + "/hosts.gz", 'rt') as f:
+    with OpenCompressed(dir + "/hosts.gz", 'rt') as f:
         otherHosts = f.read().splitlines()
 
     otherHosts = set(otherHosts)
     #print("otherHosts", otherHosts)
 
+    links = []
     # make a copy in case we have to delete thing
     copyHosts = set(hosts)
     for host in copyHosts:
@@ -584,14 +712,11 @@ def LinkedHosts(permanent, dir, hosts, linkedHostsAction):
                 hosts.remove(host)
             elif linkedHostsAction == "link":
                 dest = "{permanent}/warc/{host}".format(permanent=permanent, host=host)
-
-                if not (os.path.exists(dest) or os.path.islink(dest)):
-                    cmd = "ln -sfn {dir}/warc/{host} {dest}".format(dir=dir, host=host, dest=dest)
-                    #print(cmd)
-                    shell(cmd)
+                links.append(("{dir}/warc/{host}".format(dir=dir, host=host), dest))
             else:
                 sys.stderr.write("Unknown linkedHostsAction:" + linkedHostsAction + "\n")
                 exit()
+    return links
 
 def PostCrawlExclude(hosts, postCrawlPath):
     with open(postCrawlPath, "rt") as f:
@@ -602,110 +727,137 @@ def PostCrawlExclude(hosts, postCrawlPath):
             hosts.remove(exclude)
 
 ###############################################################################################
-if os.path.isfile(permanent + "/hosts.gz"):
-    with gzip.open(permanent + "/hosts.gz", 'rt') as f:
-        hosts = f.read().splitlines()
-    hosts = set(hosts)
-    #sys.stderr.write("read hosts from file=" + str(len(hosts)) + "\n")
-
+#The computed host and domain maps are cached in the permanent directory, keyed on the files and options they are built from
+hostMapCachePath = permanent + "/hostmap.cache"
+hostMapInputs = [permanent + "/hosts.gz", permanent + "/post-crawl-exclude", permanent + "/domains.gz"]
+if "linkedHosts" in config:
+    for dir in config["linkedHosts"]:
+        hostMapInputs.append(dir + "/hosts.gz")
+        hostMapInputs.append(dir + "/permanent/post-crawl-exclude")
+hostMapSettings = {"transient": transient, "crawler": CRAWLTARGET,
+    "linkedHosts": config.get("linkedHosts"), "linkedHostsAction": config.get("linkedHostsAction")}
+
+hostMap = None
+if os.path.isfile(permanent + "/hosts.gz") and config.get("linkedHostsAction") != "postCrawlExclude":
+    hostMap = LoadHostMapCache(hostMapCachePath, hostMapInputs, hostMapSettings)
+
+if hostMap is not None:
+    hosts = hostMap["hosts"]
+    domainKey2Hosts = hostMap["domainKey2Hosts"]
+    linkedDomains = hostMap["linked"]
+    sys.stderr.write("#hosts to crawl/process=" + str(len(hosts)) + " (cached)\n")
 else:
-    hosts = set()
-
-    if "hosts" in config:
-        newHosts = config["hosts"]
-        hosts = hosts.union(newHosts)
-        #sys.stderr.write("#hosts given=" + str(len(newHosts)) + "\n")
-
-    if "langstat" in config:
-        langstat_path = config["langstat"]
-        lang1 = config["lang1"]
-        lang2 = config["lang2"]
-        threshold = int(config["langstatThreshold"])
-        exclude_path = config["langstatExcludeStrings"]
-
-        newHosts = GetHostsFromLangstat(langstat_path, lang1, lang2, threshold, exclude_path)
-        hosts = hosts.union(newHosts)
-        #sys.stderr.write("#hosts found in langstat=" + str(len(newHosts)) + "\n")
-
-    if "hostPath" in config:
-        path = config["hostPath"]
-        with gzip.open(path, 'rt') as f:
-            newHosts = f.read().splitlines()
-            #sys.stderr.write("#hostPath=" + str(len(newHosts)) + "\n")
-
-        hosts = hosts.union(newHosts)
-
-    if "excludeHosts" in config:
-        excludeHosts = config["excludeHosts"]
-        ExcludeHosts(hosts, excludeHosts)
-
-    if "excludeHostsFile" in config:
-        with open(config["excludeHostsFile"], "rt") as f:
-            excludeHosts = f.read().splitlines()
-            print("excludeHosts", len(excludeHosts))
-        ExcludeHosts(hosts, excludeHosts)
-
-    if (len(hosts) == 0):
-        print("No hosts found. Need at least one of hosts, langstat, hostPath")
-        exit()
-
-    with gzip.open(permanent + "/hosts.gz", 'wt') as f:
-        for host in hosts:
-            f.write("%s\n" % host)
+    if os.path.isfile(permanent + "/hosts.gz"):
+        with OpenCompressed(permanent + "/hosts.gz", 'rt') as f:
+            hosts = f.read().splitlines()
+        hosts = set(hosts)
+        #sys.stderr.write("read hosts from file=" + str(len(hosts)) + "\n")
 
-sys.stderr.write("#hosts=" + str(len(hosts)) + "\n")
+    else:
+        hosts = set()
+
+        if "hosts" in config:
+            newHosts = config["hosts"]
+            hosts = hosts.union(newHosts)
+            #sys.stderr.write("#hosts given=" + str(len(newHosts)) + "\n")
+
+        if "langstat" in config:
+            langstat_path = config["langstat"]
+            lang1 = config["lang1"]
+            lang2 = config["lang2"]
+            threshold = int(config["langstatThreshold"])
+            exclude_path = config["langstatExcludeStrings"]
+
+            newHosts = GetHostsFromLangstat(langstat_path, lang1, lang2, threshold, exclude_path)
+            hosts = hosts.union(newHosts)
+            #sys.stderr.write("#hosts found in langstat=" + str(len(newHosts)) + "\n")
+
+        if "hostPath" in config:
+            path = config["hostPath"]
+            with OpenCompressed(path, 'rt') as f:
+                newHosts = f.read().splitlines()
+                #sys.stderr.write("#hostPath=" + str(len(newHosts)) + "\n")
+
+            hosts = hosts.union(newHosts)
+
+        if "excludeHosts" in config:
+            excludeHosts = config["excludeHosts"]
+            ExcludeHosts(hosts, excludeHosts)
+
+        if "excludeHostsFile" in config:
+            with open(config["excludeHostsFile"], "rt") as f:
+                excludeHosts = f.read().splitlines()
+                print("excludeHosts", len(excludeHosts))
+            ExcludeHosts(hosts, excludeHosts)
+
+        if (len(hosts) == 0):
+            print("No hosts found. Need at least one of hosts, langstat, hostPath")
+            exit()
+
+        with OpenCompressed(permanent + "/hosts.gz", 'wt') as f:
+            for host in hosts:
+                f.write("%s\n" % host)
+
+    sys.stderr.write("#hosts=" + str(len(hosts)) + "\n")
+
+    # exclude dead domains
+    postCrawlPath = "{permanent}/post-crawl-exclude".format(permanent=permanent)
+    #print("postCrawlPath", postCrawlPath)
+    if os.path.isfile(postCrawlPath):
+        PostCrawlExclude(hosts, postCrawlPath)
 
-# exclude dead domains
-postCrawlPath = "{permanent}/post-crawl-exclude".format(permanent=permanent)
-#print("postCrawlPath", postCrawlPath)
-if os.path.isfile(postCrawlPath):
-    PostCrawlExclude(hosts, postCrawlPath)
+    if "linkedHosts" in config:
+        linkedHostsAction = config["linkedHostsAction"]
 
-if "linkedHosts" in config:
-    linkedHostsAction = config["linkedHostsAction"]
+        if linkedHostsAction != "postCrawlExclude":
+            # exclude dead domains in other language pairs
+            for dir in config["linkedHosts"]:
+                postCrawlPath = "{dir}/permanent/post-crawl-exclude".format(dir=dir)
+                #print("postCrawlPath", postCrawlPath)
+                if os.path.isfile(postCrawlPath):
+                    PostCrawlExclude(hosts, postCrawlPath)
 
-    if linkedHostsAction != "postCrawlExclude":
-        # exclude dead domains in other language pairs
+        linkedHostLinks = []
         for dir in config["linkedHosts"]:
-            postCrawlPath = "{dir}/permanent/post-crawl-exclude".format(dir=dir)
-            #print("postCrawlPath", postCrawlPath)
-            if os.path.isfile(postCrawlPath):
-                PostCrawlExclude(hosts, postCrawlPath)
+            linkedHostLinks += LinkedHosts(permanent, dir, hosts, linkedHostsAction)
+        # existing paths are kept, as before
+        ApplyLinks(linkedHostLinks, FS_THREADS, replace=False)
+
+        if linkedHostsAction == "postCrawlExclude":
+            # create list of dead domains in post-crawl-exclude file, only for this language pair
+            print("Calc post-crawl exclude")
+            #hostsPath = permanent + "/hosts.gz"
+            #with gzip.open(hostsPath, 'rt') as f:
+            #    hosts = f.read().splitlines()
+            #hosts = set(hosts)
+    	#print("hosts", hosts)
+
+            warcPath = permanent + "/warc"
+            domainDirs = os.listdir(warcPath)
+            for domainDir in domainDirs:
+                #print(domainDir)
+                warcFilePath = "{warcPath}/{domainDir}/httrack.warc.xz".format(warcPath=warcPath, domainDir=domainDir)
+                if os.path.isfile(warcFilePath):
+                   hosts.remove(domainDir)
+            #print("hosts", hosts)
+
+            postCrawlPath = permanent + "/post-crawl-exclude"
+            with open(postCrawlPath, 'wt') as f:
+                f.write("\n".join(hosts))
+            exit()
+
+    sys.stderr.write("#hosts to crawl/process=" + str(len(hosts)) + "\n")
+    #exit(-1)
+
+    domainKey2Hosts = CreateDomainKey2HostMap(hosts)
+    #If file domains.gz exists in the permanent directory, the dictionary domainKey2Hosts is filtered to contain only those TLD in this file
+    domainKey2Hosts = FilterTLD(domainKey2Hosts)
+    linkedDomains = set()
 
-    for dir in config["linkedHosts"]:
-        LinkedHosts(permanent, dir, hosts, linkedHostsAction)
-
-    if linkedHostsAction == "postCrawlExclude":
-        # create list of dead domains in post-crawl-exclude file, only for this language pair
-        print("Calc post-crawl exclude")
-        #hostsPath = permanent + "/hosts.gz"
-        #with gzip.open(hostsPath, 'rt') as f:
-        #    hosts = f.read().splitlines()
-        #hosts = set(hosts)
-	#print("hosts", hosts)
-
-        warcPath = permanent + "/warc"
-        domainDirs = os.listdir(warcPath)
-        for domainDir in domainDirs:
-            #print(domainDir)
-            warcFilePath = "{warcPath}/{domainDir}/httrack.warc.xz".format(warcPath=warcPath, domainDir=domainDir)
-            if os.path.isfile(warcFilePath):
-               hosts.remove(domainDir)
-        #print("hosts", hosts)
-
-        postCrawlPath = permanent + "/post-crawl-exclude"
-        with open(postCrawlPath, 'wt') as f:
-            f.write("\n".join(hosts))
-        exit()
-
-sys.stderr.write("#hosts to crawl/process=" + str(len(hosts)) + "\n")
-#exit(-1)
-
-domainKey2Hosts = CreateDomainKey2HostMap(hosts)
-#If file domains.gz exists in the permanent directory, the dictionary domainKey2Hosts is filtered to contain only those TLD in this file
-domainKey2Hosts = FilterTLD(domainKey2Hosts)
 #Function that checks if a domain has only one WARC and, if so, it creates a symbolic link
-InitConcatLogicLink(domainKey2Hosts)
+newLinkedDomains = InitConcatLogicLink(domainKey2Hosts, linkedDomains)
+if hostMap is None or newLinkedDomains != linkedDomains:
+    SaveHostMapCache(hostMapCachePath, hostMapInputs, hostMapSettings, hosts, domainKey2Hosts, newLinkedDomains, hostMap)
 #print("domainKey2Hosts", domainKey2Hosts)
 
 # every shell command will run sync
@@ -1017,10 +1169,11 @@ rule concat_subdomains:
     run:
         assert(len(input))
         if len(input) == 1:
-            cmd = "ln -sfn {input} {output}; "
+            shell("ln -sfn {input} {output}; ")
         else:
-            cmd = 'xzcat -T 0 {input} -f | xz -c -T 0 > {output}; '
-        shell(cmd)
+            # concatenated xz streams are valid xz: copy the files instead of recompressing them
+            recompressed = ConcatXz(input, output[0])
+            sys.stderr.write("concat_subdomains: {0} inputs, {1} recompressed\n".format(len(input), recompressed))
 
 rule warc2preprocess:
     input:
@@ -1301,20 +1454,7 @@ rule alignsegments_bleualign:
     output:
         alignments='{dir}/bleualign.segalign.xz'
     run:
-        with lzma.open(output.alignments, "wt") as algFile:
-            with open_gzip_or_plain(input.aligned_urls) as urlsFile:
-                for urlAlg in urlsFile:
-                    #print("urlAlg", urlAlg)
-                    urlAlg = urlAlg.strip()
-                    if len(urlAlg) == 0:
-                        continue
-                    id=urlAlg.split("\t")[0]
-                    urls="\t".join(urlAlg.strip().split("\t")[1:])
-                    filename=wildcards.dir+"/bleualign/aligned."+str(id)+".gz"
-                    with open_gzip_or_plain(filename) as sentFile:
-                        for line in sentFile:
-                            algFile.write(urls+"\t"+line)
-        os.sync()
+        AggregateBleualign(input.aligned_urls, wildcards.dir, output.alignments, BLEUALIGN_AGGREGATE_THREADS)
 
 rule deferred_documents:
     input:
@@ -1395,8 +1535,7 @@ rule raw:
         #Original command ("xzcat -T 0 {input} | xz -T 0 > {output}") replaced to be able to deal with any number of inputs
         with open(output[0],'wb') as wfd:
             for f in input:
-                with open(f,'rb') as fd:
-                    shutil.copyfileobj(fd, wfd, 1024*1024*10)
+                AppendFile(f, wfd)
 
 rule sents:
     input:
@@ -1407,8 +1546,7 @@ rule sents:
         #Original command ("xzcat -T 0 {input} | xz -T 0 > {output}") replaced to be able to deal with any number of inputs
         with open(output[0],'wb') as wfd:
             for f in input:
-                with open(f,'rb') as fd:
-                    shutil.copyfileobj(fd, wfd, 1024*1024*10)
+                AppendFile(f, wfd)
 
 rule tmx:
     input:
@@ -1474,51 +1612,8 @@ rule symmetrise_dic:
     output:
         "{file}".format(file=DIC)
     run:
-        svocabulary={}
-        tvocabulary={}
-        svcb=open(input.vcb1,"r")
-        tvcb=open(input.vcb2,"r")
-        for line in svcb:
-            item=line.strip().split(" ")
-            svocabulary[item[0]]=item[1]
-
-        for line in tvcb:
-            item=line.strip().split(" ")
-            tvocabulary[item[0]]=item[1]
-
-        t3dic={}
-        t3s=open(input.t3_1,"r")
-        t3t=open(input.t3_2,"r")
-        for line in t3t:
-            item=line.strip().split(" ")
-            if item[1] in t3dic:
-                t3dic[item[1]][item[0]]=item[2]
-            else:
-                t3dic[item[1]]={}
-                t3dic[item[1]][item[0]]=item[2]
-
-        dic=open(output[0], "wt")
-        dic.write(LANG1+"\t"+LANG2+"\n")
-        for line in t3s:
-            item=line.strip().split(" ")
-            if item[0] in t3dic:
-                if item[1] in t3dic[item[0]]:
-                    value1=float(t3dic[item[0]][item[1]])
-                    value2=float(item[2])
-                    hmean=2/((1/value1)+(1/value2))
-
-                    if hmean > 0.1:
-                        if item[1] in svocabulary and item[0] in tvocabulary:
-                            word1=svocabulary[item[1]]
-                            word2=tvocabulary[item[0]]
-                            if word1.isalpha() or word2.isalpha():
-                                dic.write("{0}\t{1}\n".format(word1, word2))
-        svcb.close()
-        tvcb.close()
-        t3s.close()
-        t3t.close()
-        dic.close()
-        os.sync()
+        SymmetriseDic(input.vcb1, input.vcb2, input.t3_1, input.t3_2, output[0], LANG1, LANG2, SYMMETRISE_MEMORY, TMPDIR)
+        FsyncFile(output[0])
 rule filter_dics:
     input:
         "{prefix}.vcb"
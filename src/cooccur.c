@@ -62,6 +62,7 @@ int window_size = 15; // default context window size
 int symmetric = 1; // 0: asymmetric, 1: symmetric
 real memory_limit = 3; // soft limit, in gigabytes, used to estimate optimal array sizes
 int distance_weighting = 1; // Flag to control the distance weighting of cooccurrence counts
+int merge = 1; // 0: leave the sorted temporary files on disk, to be merged by src/python/merge_overflow.py
 char *vocab_file, *file_head;
 
 /* Efficient string comparison */
@@ -445,6 +446,10 @@ int get_cooccurrence() {
     free(lookup);
     free(bigram_table);
     free(vocab_hash);
+    if (!merge) {
+        fprintf(stderr, "Left %d files %s_0000.bin to %s_%04d.bin unmerged.\n", fidcounter + 1, file_head, file_head, fidcounter);
+        return 0;
+    }
     return merge_files(fidcounter + 1); // Merge the sorted temporary files
 }
 
@@ -488,6 +493,8 @@ int main(int argc, char **argv) {
         printf("\t\tLimit to length <int> the sparse overflow array, which buffers cooccurrence data that does not fit in the dense array, before writing to disk. \n\t\tThis value overrides that which is automatically produced by '-memory'. Typically only needs adjustment for use with very large corpora.\n");
         printf("\t-overflow-file <file>\n");
         printf("\t\tFilename, excluding extension, for temporary files; default overflow\n");
+        printf("\t-merge <int>\n");
+        printf("\t\tIf <int> = 0, do not merge the temporary files but leave them for 'python src/python/merge_overflow.py'; default 1\n");
         printf("\t-distance-weighting <int>\n");
         printf("\t\tIf <int> = 0, do not weight cooccurrence count by distance between words; if <int> = 1 (default), weight the cooccurrence count by inverse of distance between words\n");
 
@@ -505,6 +512,7 @@ int main(int argc, char **argv) {
     else strcpy(file_head, (char *)"overflow");
     if ((i = find_arg((char *)"-memory", argc, argv)) > 0) memory_limit = atof(argv[i + 1]);
     if ((i = find_arg((char *)"-distance-weighting", argc, argv)) > 0)  distance_weighting = atoi(argv[i + 1]);
+    if ((i = find_arg((char *)"-merge", argc, argv)) > 0) merge = atoi(argv[i + 1]);
     
     /* The memory_limit determines a limit on the number of elements in bigram_table and the overflow buffer */
     /* Estimate the maximum value that max_product can take so that this limit is still satisfied */
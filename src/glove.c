@@ -29,6 +29,9 @@
 #include <math.h>
 #include <pthread.h>
 #include <time.h>
+#include <limits.h>
+#include <spawn.h>
+#include <sys/wait.h>
 
 #define _FILE_OFFSET_BITS 64
 #define MAX_STRING_LENGTH 1000
@@ -51,6 +54,14 @@ int save_gradsq = 0; // By default don't save squared gradient values
 int use_binary = 0; // 0: save as text files; 1: save as binary; 2: both. For binary, save both word and context word vectors.
 int model = 2; // For text file output only. 0: concatenate word and context vectors (and biases) i.e. save everything; 1: Just save word vectors (no bias); 2: Save (word + context word) vectors (no biases)
 int checkpoint_every = 0; // checkpoint the model for every checkpoint_every iterations. Do nothing if checkpoint_every <= 0
+char *checkpoint_command = NULL; // shell command started, without waiting for it, on every checkpoint and on the final model
+int running_commands = 0;
+extern char **environ;
+char *holdout_file = NULL; // records held out by 'shuffle -holdout-file'; their loss is computed after every iteration
+int early_stop_patience = 3; // with a holdout file, stop after this many iterations without improvement; 0: never stop
+real early_stop_delta = 1e-3; // relative decrease of the holdout loss that counts as an improvement
+char *metrics_file = NULL; // per-iteration costs and times, appended as tab-separated lines
+int final_iter = 0; // iteration of the parameters saved last
 real eta = 0.05; // Initial learning rate
 real alpha = 0.75, x_max = 100.0; // Weighting function parameters, not extremely sensitive to corpus, though may need adjustment for very small or very large corpora
 real *W, *gradsq, *cost;
@@ -289,6 +300,70 @@ int save_params(int nb_iter) {
     return 0;
 }
 
+/* Start checkpoint_command on a saved model in the background; training goes on while it runs */
+void run_checkpoint_command(int nb_iter) {
+    char checkpoint_file[MAX_STRING_LENGTH], iter[16], path[PATH_MAX];
+    char *argv[] = {"sh", "-c", checkpoint_command, NULL};
+    pid_t pid;
+
+    if (nb_iter <= 0) sprintf(checkpoint_file, use_binary > 0 ? "%s.bin" : "%s.txt", save_W_file);
+    else sprintf(checkpoint_file, use_binary > 0 ? "%s.%03d.bin" : "%s.%03d.txt", save_W_file, nb_iter);
+    sprintf(iter, "%d", nb_iter > 0 ? nb_iter : final_iter);
+    while (running_commands > 0 && waitpid(-1, NULL, WNOHANG) > 0) running_commands--; // reap the finished ones
+    // the command finds the checkpoint in its environment; no training thread is running here
+    // absolute paths, so that the command may change directory
+    setenv("GLOVE_CHECKPOINT", realpath(checkpoint_file, path) != NULL ? path : checkpoint_file, 1);
+    setenv("GLOVE_ITER", iter, 1);
+    setenv("GLOVE_VOCAB_FILE", realpath(vocab_file, path) != NULL ? path : vocab_file, 1);
+    // posix_spawn does not copy the page tables of the parameters like fork would
+    if (posix_spawn(&pid, "/bin/sh", NULL, NULL, argv, environ) != 0) {
+        fprintf(stderr, "Unable to start checkpoint command for iter %03d.\n", nb_iter);
+        return;
+    }
+    running_commands++;
+}
+
+/* Read the held-out records into memory */
+CREC *read_holdout(long long *num_holdout) {
+    FILE *fin = fopen(holdout_file, "rb");
+    CREC *holdout;
+    if (fin == NULL) {fprintf(stderr, "Unable to open holdout file %s.\n", holdout_file); return NULL;}
+    fseeko(fin, 0, SEEK_END);
+    *num_holdout = ftello(fin) / sizeof(CREC);
+    fseeko(fin, 0, SEEK_SET);
+    holdout = (CREC *)malloc(sizeof(CREC) * (*num_holdout + 1));
+    if (holdout == NULL || (long long)fread(holdout, sizeof(CREC), *num_holdout, fin) != *num_holdout) {
+        fprintf(stderr, "Unable to read holdout file %s.\n", holdout_file);
+        fclose(fin);
+        return NULL;
+    }
+    fclose(fin);
+    return holdout;
+}
+
+/* Weighted squared error of the held-out records, per record, as the training cost */
+real holdout_loss(CREC *holdout, long long num_holdout) {
+    long long a, b, l1, l2, n = 0;
+    real diff, loss = 0;
+    for (a = 0; a < num_holdout; a++) {
+        if (holdout[a].word1 < 1 || holdout[a].word2 < 1 || holdout[a].word1 > vocab_size || holdout[a].word2 > vocab_size) continue;
+        l1 = (holdout[a].word1 - 1LL) * (vector_size + 1);
+        l2 = ((holdout[a].word2 - 1LL) + vocab_size) * (vector_size + 1);
+        diff = 0;
+        for (b = 0; b < vector_size; b++) diff += W[b + l1] * W[b + l2];
+        diff += W[vector_size + l1] + W[vector_size + l2] - log(holdout[a].val);
+        loss += 0.5 * ((holdout[a].val > x_max) ? 1 : pow(holdout[a].val / x_max, alpha)) * diff * diff;
+        n++;
+    }
+    return n > 0 ? loss / n : 0;
+}
+
+double seconds_since(struct timespec *start) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (now.tv_sec - start->tv_sec) + (now.tv_nsec - start->tv_nsec) / 1e9;
+}
+
 /* Train model */
 int train_glove() {
     long long a, file_size;
@@ -319,6 +394,30 @@ int train_glove() {
     time_t rawtime;
     struct tm *info;
     char time_buffer[80];
+    CREC *holdout = NULL;
+    long long num_holdout = 0, num_params = 2 * vocab_size * (vector_size + 1);
+    real loss = 0, best_loss = 0, reference_loss = 0, *W_best = NULL;
+    int best_iter = 0, stale_iters = 0;
+    double elapsed = 0, iter_start = 0;
+    struct timespec start;
+    FILE *fmetrics = NULL;
+
+    if (holdout_file != NULL) {
+        holdout = read_holdout(&num_holdout);
+        if (holdout == NULL) return 1;
+        if (verbose > 0) fprintf(stderr, "holdout: %lld lines, patience %d, min improvement %lf\n", num_holdout, early_stop_patience, early_stop_delta);
+        if (early_stop_patience > 0) {
+            W_best = (real *)malloc(num_params * sizeof(real));
+            if (W_best == NULL) {fprintf(stderr, "Error allocating memory for the best parameters\n"); return 1;}
+        }
+    }
+    if (metrics_file != NULL) {
+        fmetrics = fopen(metrics_file, "a");
+        if (fmetrics == NULL) {fprintf(stderr, "Unable to open metrics file %s.\n", metrics_file); return 1;}
+        fprintf(fmetrics, "iter\tseconds\titer_seconds\tcost\tholdout_loss\tbest_iter\n");
+    }
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    final_iter = num_iter;
     // Lock-free asynchronous SGD
     for (b = 0; b < num_iter; b++) {
         total_cost = 0;
@@ -334,7 +433,27 @@ int train_glove() {
         time(&rawtime);
         info = localtime(&rawtime);
         strftime(time_buffer,80,"%x - %I:%M.%S%p", info);
-        fprintf(stderr, "%s, iter: %03d, cost: %lf\n", time_buffer,  b+1, total_cost/num_lines);
+        if (holdout == NULL) fprintf(stderr, "%s, iter: %03d, cost: %lf\n", time_buffer,  b+1, total_cost/num_lines);
+        else {
+            loss = holdout_loss(holdout, num_holdout);
+            fprintf(stderr, "%s, iter: %03d, cost: %lf, holdout loss: %lf\n", time_buffer,  b+1, total_cost/num_lines, loss);
+            if (best_iter == 0 || loss < best_loss) {
+                best_loss = loss;
+                best_iter = b + 1;
+                if (W_best != NULL) memcpy(W_best, W, num_params * sizeof(real));
+            }
+            if (b == 0 || loss < reference_loss * (1 - early_stop_delta)) {
+                reference_loss = loss;
+                stale_iters = 0;
+            }
+            else stale_iters++;
+        }
+        elapsed = seconds_since(&start);
+        if (fmetrics != NULL) {
+            fprintf(fmetrics, "%d\t%.3f\t%.3f\t%lf\t%lf\t%d\n", b+1, elapsed, elapsed - iter_start, total_cost/num_lines, loss, best_iter);
+            fflush(fmetrics);
+        }
+        iter_start = elapsed;
 
         if (checkpoint_every > 0 && (b + 1) % checkpoint_every == 0) {
             fprintf(stderr,"    saving itermediate parameters for iter %03d...", b+1);
@@ -342,12 +461,36 @@ int train_glove() {
             if (save_params_return_code != 0)
                 return save_params_return_code;
             fprintf(stderr,"done.\n");
+            if (checkpoint_command != NULL) run_checkpoint_command(b+1);
         }
 
+        if (W_best != NULL && stale_iters >= early_stop_patience) {
+            b++;
+            break;
+        }
+    }
+    if (W_best != NULL) {
+        // b iterations were run; the remaining ones are the time saved, at the average iteration time
+        fprintf(stderr, "Best holdout loss %lf at iter %03d; ran %d of %d iterations, saving about %.0f s.\n",
+            best_loss, best_iter, b, num_iter, b > 0 ? (num_iter - b) * elapsed / b : 0);
+        if (fmetrics != NULL) fprintf(fmetrics, "# best_iter %d, holdout_loss %lf, iters_run %d of %d, seconds %.3f, seconds_saved %.3f\n",
+            best_iter, best_loss, b, num_iter, elapsed, b > 0 ? (num_iter - b) * elapsed / b : 0);
+        if (best_iter != b) memcpy(W, W_best, num_params * sizeof(real)); // the final model is the best one
+        final_iter = best_iter;
+        free(W_best);
     }
+    if (fmetrics != NULL) fclose(fmetrics);
+    free(holdout);
     free(pt);
     free(lines_per_thread);
-    return save_params(0);
+    save_params_return_code = save_params(0);
+    if (checkpoint_command != NULL) {
+        if (save_params_return_code == 0 && (checkpoint_every <= 0 || final_iter != b || b % checkpoint_every != 0)) run_checkpoint_command(0);
+        if (verbose > 0 && running_commands > 0) fprintf(stderr, "Waiting for checkpoint commands...");
+        while (wait(NULL) > 0);
+        if (verbose > 0 && running_commands > 0) fprintf(stderr, "done.\n");
+    }
+    return save_params_return_code;
 }
 
 int find_arg(char *str, int argc, char **argv) {
@@ -412,6 +555,16 @@ int main(int argc, char **argv) {
         printf("\t\tSave accumulated squared gradients; default 0 (off); ignored if gradsq-file is specified\n");
         printf("\t-checkpoint-every <int>\n");
         printf("\t\tCheckpoint a  model every <int> iterations; default 0 (off)\n");
+        printf("\t-holdout-file <file>\n");
+        printf("\t\tCooccurrence records held out by 'shuffle -holdout-file'; their weighted loss is reported after every iteration\n");
+        printf("\t-early-stop <int>\n");
+        printf("\t\tWith -holdout-file, stop after <int> iterations without improvement of the holdout loss and save the parameters with the lowest loss; 0: never stop; default 3. The lowest-loss parameters are kept in a second copy in memory, which doubles the memory of the parameters\n");
+        printf("\t-early-stop-delta <float>\n");
+        printf("\t\tRelative decrease of the holdout loss that counts as an improvement; default 0.001\n");
+        printf("\t-metrics-file <file>\n");
+        printf("\t\tAppend the time, cost and holdout loss of every iteration to <file>, and the iterations and time saved by early stopping\n");
+        printf("\t-checkpoint-command <command>\n");
+        printf("\t\tShell command started in the background after every checkpoint and after the final model is saved, with GLOVE_CHECKPOINT, GLOVE_ITER and GLOVE_VOCAB_FILE set; e.g. 'python eval/python/online_eval.py --curve curve.tsv'\n");
         printf("\nExample usage:\n");
         printf("./glove -input-file cooccurrence.shuf.bin -vocab-file vocab.txt -save-file vectors -gradsq-file gradsq -verbose 2 -vector-size 100 -threads 16 -alpha 0.75 -x-max 100.0 -eta 0.05 -binary 2 -model 2\n\n");
         result = 0;
@@ -441,6 +594,11 @@ int main(int argc, char **argv) {
         if ((i = find_arg((char *)"-input-file", argc, argv)) > 0) strcpy(input_file, argv[i + 1]);
         else strcpy(input_file, (char *)"cooccurrence.shuf.bin");
         if ((i = find_arg((char *)"-checkpoint-every", argc, argv)) > 0) checkpoint_every = atoi(argv[i + 1]);
+        if ((i = find_arg((char *)"-checkpoint-command", argc, argv)) > 0) checkpoint_command = argv[i + 1];
+        if ((i = find_arg((char *)"-holdout-file", argc, argv)) > 0) holdout_file = argv[i + 1];
+        if ((i = find_arg((char *)"-early-stop", argc, argv)) > 0) early_stop_patience = atoi(argv[i + 1]);
+        if ((i = find_arg((char *)"-early-stop-delta", argc, argv)) > 0) early_stop_delta = atof(argv[i + 1]);
+        if ((i = find_arg((char *)"-metrics-file", argc, argv)) > 0) metrics_file = argv[i + 1];
         
         vocab_size = 0;
         fid = fopen(vocab_file, "r");
@@ -0,0 +1,192 @@
+"""Count word-word cooccurrences from a corpus encoded by corpus.py.
+
+This is the counting of cooccur.c on the memory-mapped ID stream: the
+cooccurrences of every word with the window_size previous words of its
+document (and, if symmetric, the reverse pairs) are generated one offset at
+a time as NumPy arrays.  As in cooccur.c, pairs whose product of ranks is
+below max_product are summed in a dense table and the others are sorted,
+summed and spilled to <overflow_file>_%04d.bin when more than
+overflow_length of them are buffered; the files are then merged by
+merge_overflow.py.  The output is the usual binary file of CREC records
+sorted by (word1, word2).
+
+    python src/python/cooccur.py --corpus corpus.ids --window_size 8 --memory 50 --output cooccurrence.8.bin
+"""
+import argparse
+import math
+import sys
+import time
+import numpy as np
+
+from corpus import BOUNDARY, OOV, load_corpus
+from crec import CREC, sum_sorted, to_crec
+from merge_overflow import tree_merge
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', required=True, type=str, help='ID stream written by corpus.py')
+    parser.add_argument('--vocab_file', default=None, type=str,
+        help='if given, checked against the vocabulary the corpus was encoded with')
+    parser.add_argument('--output', default='-', type=str, help="CREC output file; '-' for stdout")
+    parser.add_argument('--window_size', default=15, type=int)
+    parser.add_argument('--symmetric', default=1, type=int)
+    parser.add_argument('--distance_weighting', default=1, type=int)
+    parser.add_argument('--memory', default=4.0, type=float,
+        help='soft memory limit in GB, turned into max_product/overflow_length as by cooccur')
+    parser.add_argument('--max_product', default=None, type=int)
+    parser.add_argument('--overflow_length', default=None, type=int)
+    parser.add_argument('--overflow_file', default='overflow', type=str)
+    parser.add_argument('--block_tokens', default=1 << 20, type=int,
+        help='tokens whose cooccurrences are generated at once')
+    parser.add_argument('--fan_in', default=16, type=int, help='overflow files merged together')
+    parser.add_argument('--processes', default=None, type=int,
+        help='processes merging the overflow files (default: all cores)')
+    args = parser.parse_args()
+
+    max_product, overflow_length = memory_plan(args.memory)
+    if args.max_product is not None:
+        max_product = args.max_product
+    if args.overflow_length is not None:
+        overflow_length = args.overflow_length
+
+    ids, meta = load_corpus(args.corpus, args.vocab_file)
+    if args.output == '-':
+        count_cooccurrences(ids, meta['vocab_size'], sys.stdout.buffer, args.window_size,
+            args.symmetric, args.distance_weighting, max_product, overflow_length,
+            args.overflow_file, args.block_tokens, args.fan_in, args.processes)
+    else:
+        with open(args.output, 'wb') as fout:
+            count_cooccurrences(ids, meta['vocab_size'], fout, args.window_size,
+                args.symmetric, args.distance_weighting, max_product, overflow_length,
+                args.overflow_file, args.block_tokens, args.fan_in, args.processes)
+
+
+def memory_plan(memory):
+    """(max_product, overflow_length) that cooccur derives from -memory (GB)."""
+    rlimit = 0.85 * memory * 1073741824 / CREC.itemsize
+    n = 1e5
+    while abs(rlimit - n * (math.log(n) + 0.1544313298)) > 1e-3:
+        n = rlimit / (math.log(n) + 0.1544313298)
+    return int(n), int(rlimit) // 6
+
+
+def dense_lookup(vocab_size, max_product):
+    """cooccur's lookup table: row w of the dense table starts at lookup[w - 1] - 1."""
+    ranks = np.arange(1, vocab_size + 1, dtype=np.int64)
+    lookup = np.empty(vocab_size + 1, dtype=np.int64)
+    lookup[0] = 1
+    lookup[1:] = 1 + np.cumsum(np.minimum(max_product // ranks, vocab_size))
+    return lookup
+
+
+def window_pairs(tokens, first, window_size, distance_weighting):
+    """Yield (context, target, weight) arrays for the targets tokens[first:].
+
+    tokens holds in-vocabulary IDs and BOUNDARY markers; pairs never cross a
+    boundary.  Each yielded batch is one distance between the two words.
+    """
+    doc = np.cumsum(tokens == BOUNDARY)
+    n = len(tokens)
+    for d in range(1, window_size + 1):
+        start = max(first, d)
+        if start >= n:
+            break
+        target = tokens[start:]
+        context = tokens[start - d:n - d]
+        same = (doc[start:] == doc[start - d:n - d]) & (context != BOUNDARY)
+        yield context[same], target[same], 1.0 / d if distance_weighting else 1.0
+
+
+def count_cooccurrences(ids, vocab_size, fout, window_size=15, symmetric=1,
+        distance_weighting=1, max_product=None, overflow_length=None,
+        overflow_file='overflow', block_tokens=1 << 20, fan_in=16, processes=None, verbose=True):
+    """Write the sorted CREC records of the encoded corpus ids to fout.
+
+    The overflow files are merged by merge_overflow.tree_merge with fan_in
+    and processes.  Returns the number of overflow files that were written
+    (and removed by the merge).
+    """
+    if max_product is None or overflow_length is None:
+        plan = memory_plan(4.0)
+        max_product = plan[0] if max_product is None else max_product
+        overflow_length = plan[1] if overflow_length is None else overflow_length
+    start_time = time.time()
+    stride = vocab_size + 1
+    lookup = dense_lookup(vocab_size, max_product)
+    table = np.zeros(lookup[-1], dtype=np.float64)
+    if verbose:
+        sys.stderr.write("window size: %d\ncontext: %s\nmax product: %d\noverflow length: %d\n"
+            "table contains %d elements.\n" % (window_size,
+            'symmetric' if symmetric else 'asymmetric', max_product, overflow_length, lookup[-1]))
+
+    sparse = []
+    buffered = 0
+    runs = []
+
+    def spill():
+        keys, vals = sum_sorted(np.concatenate([s[0] for s in sparse]),
+            np.concatenate([s[1] for s in sparse]))
+        filename = '%s_%04d.bin' % (overflow_file, len(runs) + 1)
+        to_crec(keys, vals, stride).tofile(filename)
+        runs.append(filename)
+        sparse.clear()
+
+    # in-vocabulary tail of the tokens so far, the context of the next targets
+    carry = np.empty(0, dtype=ids.dtype)
+    num_tokens = 0
+    for block_start in range(0, len(ids), block_tokens):
+        block = np.asarray(ids[block_start:block_start + block_tokens])
+        block = block[block != OOV]
+        num_tokens += int(np.count_nonzero(block != BOUNDARY))
+        tokens = np.concatenate([carry, block]).astype(np.int64)
+        keys = []
+        vals = []
+        for context, target, weight in window_pairs(tokens, len(carry), window_size, distance_weighting):
+            pairs = [(context, target), (target, context)] if symmetric else [(context, target)]
+            # the dense/sparse choice is made on (context, target) for both orientations, as in cooccur
+            dense = context < max_product // target
+            for w1, w2 in pairs:
+                np.add.at(table, lookup[w1[dense] - 1] + w2[dense] - 2, weight)
+                keys.append(w1[~dense] * stride + w2[~dense])
+                vals.append(np.full(len(keys[-1]), weight))
+        if keys:
+            sparse.append(sum_sorted(np.concatenate(keys), np.concatenate(vals)))
+            buffered += len(sparse[-1][0])
+            if buffered >= overflow_length:
+                spill()
+                buffered = 0
+        carry = tokens[-window_size:]
+        if verbose:
+            sys.stderr.write("\033[0GProcessed %d tokens." % num_tokens)
+    if sparse:
+        spill()
+
+    # the dense table is written first, as overflow_0000.bin by cooccur, a range of rows at a time
+    dense_file = '%s_%04d.bin' % (overflow_file, 0)
+    chunk = max(overflow_length, 1)
+    with open(dense_file, 'wb') as f:
+        w = 1
+        while w <= vocab_size:
+            # rows w..end-1 hold at most chunk elements (or the single row w)
+            end = max(w + 1, int(np.searchsorted(lookup, lookup[w - 1] + chunk, side='right')))
+            first = lookup[w - 1] - 1
+            nonzero = np.flatnonzero(table[first:lookup[end - 1] - 1]) + first
+            word1 = np.searchsorted(lookup, nonzero + 2)
+            to_crec(word1 * stride + (nonzero + 2 - lookup[word1 - 1]), table[nonzero], stride).tofile(f)
+            w = end
+    del table
+    if verbose:
+        sys.stderr.write("\n%d files in total.\n" % (len(runs) + 1))
+
+    written = tree_merge([dense_file] + runs, fout, overflow_file, fan_in, processes,
+        max(overflow_length, 1 << 20), verbose=verbose)
+    if verbose:
+        elapsed = max(time.time() - start_time, 1e-9)
+        sys.stderr.write("Wrote %d cooccurrences in %.1f s (%.0f tokens/sec).\n" %
+            (written, elapsed, num_tokens / elapsed))
+    return len(runs)
+
+
+if __name__ == "__main__":
+    main()
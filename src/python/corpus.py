@@ -0,0 +1,175 @@
+"""Encode a text corpus once into a memory-mappable stream of word IDs.
+
+Words are tokenized exactly as get_word() in vocab_count.c and cooccur.c
+does and replaced by their frequency rank in the vocab file (1 for the most
+frequent word), the ID cooccur uses.  Words missing from the vocabulary
+become OOV and every non-empty line (document) is followed by BOUNDARY.  The
+IDs are written as little-endian uint32 to <output>, with a small JSON
+description in <output>.json, so cooccurrences for any window size can be
+counted from the binary corpus without parsing the text again.
+
+    python src/python/corpus.py --vocab_file vocab.txt --corpus corpus.txt --output corpus.ids
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+FORMAT_VERSION = 1
+ID_DTYPE = np.dtype('<u4')
+BOUNDARY = 0
+OOV = 0xffffffff
+MAX_STRING_LENGTH = 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--vocab_file', default='vocab.txt', type=str)
+    parser.add_argument('--corpus', required=True, type=str)
+    parser.add_argument('--output', required=True, type=str)
+    parser.add_argument('--processes', default=None, type=int,
+        help='worker processes (default: all cores)')
+    parser.add_argument('--chunk_mb', default=16, type=int,
+        help='MB of text handed to a worker at a time')
+    args = parser.parse_args()
+
+    encode_corpus(args.corpus, args.vocab_file, args.output, args.processes,
+        args.chunk_mb << 20)
+
+
+def read_vocab(vocab_file):
+    """Words of the vocab file in rank order, as bytes, read like cooccur does."""
+    words = []
+    with open(vocab_file, 'rb') as f:
+        for line in f:
+            fields = line.split()
+            if fields:
+                words.append(fields[0][:MAX_STRING_LENGTH])
+    return words
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def truncate(word):
+    """Shorten word as get_word does, without splitting a UTF-8 character."""
+    i = MAX_STRING_LENGTH - 1
+    word = word[:i]
+    if word[i - 1] & 0x80 == 0x80:
+        if word[i - 1] & 0xC0 == 0xC0:
+            word = word[:i - 1]
+        elif word[i - 2] & 0xE0 == 0xE0:
+            word = word[:i - 2]
+        elif word[i - 3] & 0xF8 == 0xF0:
+            word = word[:i - 3]
+    return word
+
+
+# per-worker vocabulary, set once by _init_worker
+_worker = {}
+
+def _init_worker(vocab_file):
+    _worker['vocab'] = {w: i + 1 for i, w in enumerate(read_vocab(vocab_file))}
+
+
+def encode_lines(data, vocab):
+    """uint32 IDs of a block of whole lines, each line followed by BOUNDARY."""
+    ids = []
+    for line in data.replace(b'\r', b'').replace(b'\t', b' ').split(b'\n'):
+        words = [w for w in line.split(b' ') if w]
+        if not words:
+            continue
+        ids.extend(vocab.get(w if len(w) < MAX_STRING_LENGTH else truncate(w), OOV) for w in words)
+        ids.append(BOUNDARY)
+    return np.array(ids, dtype=ID_DTYPE)
+
+
+def _encode_chunk(data):
+    return encode_lines(data, _worker['vocab'])
+
+
+def _read_chunks(corpus_file, chunk_bytes):
+    with open(corpus_file, 'rb') as f:
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if not lines:
+                break
+            yield b''.join(lines)
+
+
+def encode_corpus(corpus_file, vocab_file, output, processes=None, chunk_bytes=16 << 20):
+    """Write the ID stream of corpus_file and its description; returns the description."""
+    processes = processes or os.cpu_count()
+    start = time.time()
+    num_tokens = num_oov = num_documents = 0
+    tmp_output = output + '.tmp'
+    with open(tmp_output, 'wb') as fout, ProcessPoolExecutor(processes,
+            initializer=_init_worker, initargs=(vocab_file,)) as pool:
+        pending = deque()
+
+        def write_next():
+            nonlocal num_tokens, num_oov, num_documents
+            ids = pending.popleft().result()
+            ids.tofile(fout)
+            num_documents += int(np.count_nonzero(ids == BOUNDARY))
+            num_oov += int(np.count_nonzero(ids == OOV))
+            num_tokens += len(ids)
+
+        for data in _read_chunks(corpus_file, chunk_bytes):
+            pending.append(pool.submit(_encode_chunk, data))
+            if len(pending) >= 2 * processes:
+                write_next()
+        while pending:
+            write_next()
+
+    meta = {
+        'format': FORMAT_VERSION,
+        'corpus': os.path.abspath(corpus_file),
+        'vocab_file': os.path.abspath(vocab_file),
+        'vocab_sha1': file_sha1(vocab_file),
+        'vocab_size': len(read_vocab(vocab_file)),
+        'boundary': BOUNDARY,
+        'oov': OOV,
+        'words': num_tokens - num_documents,
+        'oov_words': num_oov,
+        'documents': num_documents,
+    }
+    with open(output + '.json', 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp_output, output)
+
+    elapsed = max(time.time() - start, 1e-9)
+    sys.stderr.write("Encoded %d words (%d OOV) in %d documents in %.1f s (%.0f words/sec)\n" %
+        (meta['words'], num_oov, num_documents, elapsed, meta['words'] / elapsed))
+    return meta
+
+
+def load_corpus(path, vocab_file=None):
+    """Memory-map an encoded corpus; returns (ids, description).
+
+    When vocab_file is given it must be the vocabulary the corpus was
+    encoded with, since the IDs are its ranks.
+    """
+    with open(path + '.json', 'r') as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT_VERSION:
+        raise ValueError("%s: unsupported encoded corpus format %r" % (path, meta.get('format')))
+    if vocab_file is not None and file_sha1(vocab_file) != meta['vocab_sha1']:
+        raise ValueError("%s was encoded with a different vocabulary than %s" % (path, vocab_file))
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=ID_DTYPE), meta
+    return np.memmap(path, dtype=ID_DTYPE, mode='r'), meta
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""The binary cooccurrence records written by cooccur and read by shuffle and glove.
+
+A CREC file holds (word1, word2, val) records; cooccur writes them sorted by
+(word1, word2) with the values of duplicate pairs summed.  Pairs are handled
+here as int64 keys word1 * stride + word2, with a stride above every word2.
+"""
+import bisect
+import numpy as np
+
+CREC = np.dtype([('word1', '<i4'), ('word2', '<i4'), ('val', '<f8')])
+
+
+def sum_sorted(keys, vals):
+    """Sorted unique keys and the sum of the vals of each."""
+    keys, inverse = np.unique(keys, return_inverse=True)
+    return keys, np.bincount(inverse, weights=vals, minlength=len(keys))
+
+
+def to_crec(keys, vals, stride):
+    records = np.empty(len(keys), dtype=CREC)
+    records['word1'] = keys // stride
+    records['word2'] = keys % stride
+    records['val'] = vals
+    return records
+
+
+def word1_bound(records, word1, lo):
+    """Index of the first record at or after lo with a word1 >= word1.
+
+    Bisects element by element so that memory-mapped records are not read
+    in full.
+    """
+    return bisect.bisect_left(records['word1'], word1, lo)
+
+
+def merge_sorted(sources, fout, vocab_size, max_records=1 << 24):
+    """Write the sum of CREC arrays sorted by (word1, word2) to fout, in order.
+
+    The sources are merged a word1 range at a time, each range holding at
+    most max_records records (or a single word1), so memory-mapped sources
+    of any size can be merged.  Returns the number of records written.
+    """
+    stride = vocab_size + 1
+    starts = [0] * len(sources)
+    written = 0
+    while True:
+        heads = [int(s['word1'][i]) for s, i in zip(sources, starts) if i < len(s)]
+        if not heads:
+            break
+        # gallop to the largest range that fits in max_records
+        hi = min(heads) + 1
+        step = 1
+        while hi + step <= stride:
+            ends = [word1_bound(s, hi + step, i) for s, i in zip(sources, starts)]
+            if sum(e - i for e, i in zip(ends, starts)) > max_records:
+                break
+            hi += step
+            step *= 2
+        ends = [word1_bound(s, hi, i) for s, i in zip(sources, starts)]
+        pieces = [np.asarray(s[i:e]) for s, i, e in zip(sources, starts, ends) if e > i]
+        keys = np.concatenate([p['word1'].astype(np.int64) * stride + p['word2'] for p in pieces])
+        keys, vals = sum_sorted(keys, np.concatenate([p['val'] for p in pieces]))
+        fout.write(to_crec(keys, vals, stride).tobytes())
+        written += len(keys)
+        starts = ends
+    return written
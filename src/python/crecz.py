@@ -0,0 +1,454 @@
+"""Compact, block-compressed storage for CREC cooccurrence files.
+
+A CREC record takes 16 bytes (two int32 word IDs and a float64 count).  A
+CRCZ file stores the same records in blocks of block_records records:
+
+    header   magic 'CRCZ', version, codec, flags, block_records
+    block    records, stored bytes, raw bytes, first word1, last word1, payload
+    ...
+    index    offset, records, first word1, last word1 of every block
+    trailer  index offset, blocks, records, magic 'CRZI'
+
+The raw payload of a block is the varint stream of word1, the varint stream
+of word2 and the values as float32 (float64 with --exact_values).  In files
+marked sorted (the output of cooccur), word1 is stored as the difference
+from the previous record and word2 as the difference from the previous
+record of the same word1; shuffled files store the IDs themselves.  The raw
+payload is then compressed with zlib, bz2, lzma or, when their modules are
+installed, zstd (zstandard) or lz4 (lz4.frame).  The index allows reading
+any block, or the blocks of a word1 range of a sorted file, directly; a
+file whose index was never written is read by walking the block headers.
+
+    python src/python/cooccur.py ... | python src/python/crecz.py encode --sorted - cooccurrence.8.crz
+    python src/python/crecz.py decode cooccurrence.8.crz | ./build/shuffle ... > shuf.cooccurrence.8.bin
+    python src/python/crecz.py bench cooccurrence.8.bin
+"""
+import argparse
+import bz2
+import lzma
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+import numpy as np
+
+from crec import CREC
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+FORMAT_VERSION = 1
+MAGIC = b'CRCZ'
+INDEX_MAGIC = b'CRZI'
+FLAG_SORTED = 1
+FLAG_FLOAT64 = 2
+HEADER = struct.Struct('<4sBBBBII')
+BLOCK_HEADER = struct.Struct('<IIIii')
+TRAILER = struct.Struct('<QQQ4s')
+INDEX_ENTRY = np.dtype([('offset', '<u8'), ('records', '<u4'), ('first_word1', '<i4'),
+    ('last_word1', '<i4')])
+STREAM_LENGTHS = struct.Struct('<II')
+VARINT_BYTES = 5
+
+
+def _codecs():
+    """codec name -> (id, compress(data, level), decompress(data))."""
+    codecs = {
+        'none': (0, lambda data, level: data, lambda data: data),
+        'zlib': (1, lambda data, level: zlib.compress(data, 6 if level is None else level),
+            zlib.decompress),
+        'bz2': (2, lambda data, level: bz2.compress(data, 9 if level is None else level),
+            bz2.decompress),
+        'lzma': (3, lambda data, level: lzma.compress(data, preset=1 if level is None else level),
+            lzma.decompress),
+    }
+    if zstandard is not None:
+        codecs['zstd'] = (4,
+            lambda data, level: zstandard.ZstdCompressor(level=3 if level is None else level).compress(data),
+            lambda data: zstandard.ZstdDecompressor().decompress(data))
+    if lz4 is not None:
+        codecs['lz4'] = (5,
+            lambda data, level: lz4.frame.compress(data, compression_level=0 if level is None else level),
+            lz4.frame.decompress)
+    return codecs
+
+CODECS = _codecs()
+CODEC_NAMES = {codec[0]: name for name, codec in CODECS.items()}
+KNOWN_CODECS = {0: 'none', 1: 'zlib', 2: 'bz2', 3: 'lzma', 4: 'zstd', 5: 'lz4'}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    encode = commands.add_parser('encode', help='CREC file to CRCZ')
+    encode.add_argument('input', help="CREC file; '-' for stdin")
+    encode.add_argument('output')
+    encode.add_argument('--codec', default='zlib', choices=sorted(CODECS))
+    encode.add_argument('--level', default=None, type=int, help='compression level of the codec')
+    encode.add_argument('--sorted', action='store_true',
+        help='records are sorted by (word1, word2), as written by cooccur')
+    encode.add_argument('--exact_values', action='store_true', help='keep the values as float64')
+    encode.add_argument('--block_records', default=1 << 20, type=int)
+    decode = commands.add_parser('decode', help='CRCZ file to CREC')
+    decode.add_argument('input')
+    decode.add_argument('output', nargs='?', default='-', help="CREC file; '-' for stdout")
+    decode.add_argument('--word1', default=None, type=int, nargs=2, metavar=('LO', 'HI'),
+        help='only the records with LO <= word1 < HI (sorted files)')
+    bench = commands.add_parser('bench', help='compare codecs against raw reads of a CREC file')
+    bench.add_argument('input', help='CREC file')
+    bench.add_argument('--codecs', default=None, nargs='+', help='default: all available')
+    bench.add_argument('--sorted', default=None, type=int,
+        help='1 if the file is sorted by (word1, word2); default: checked on the first block')
+    bench.add_argument('--block_records', default=1 << 20, type=int)
+    bench.add_argument('--max_records', default=None, type=int, help='benchmark a prefix of the file')
+    bench.add_argument('--tmpdir', default=None, type=str,
+        help='where the encoded files go; default: next to the input, on the same disk')
+    args = parser.parse_args()
+
+    if args.command == 'encode':
+        fin = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+        with CrecWriter(args.output, args.codec, args.sorted, args.exact_values,
+                args.block_records, args.level) as writer:
+            for records in read_crec(fin, args.block_records):
+                writer.write(records)
+        if fin is not sys.stdin.buffer:
+            fin.close()
+        sys.stderr.write("Wrote %d records in %d blocks, %.2f bytes/record.\n" % (writer.records,
+            len(writer.index), os.path.getsize(args.output) / float(max(writer.records, 1))))
+    elif args.command == 'decode':
+        fout = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        with CrecReader(args.input) as reader:
+            blocks = reader.iter_range(*args.word1) if args.word1 else reader.iter_blocks()
+            for records in blocks:
+                fout.write(records.tobytes())
+        if fout is sys.stdout.buffer:
+            fout.flush()
+        else:
+            fout.close()
+    else:
+        benchmark(args.input, args.codecs or sorted(CODECS), args.sorted, args.block_records,
+            args.max_records, args.tmpdir or os.path.dirname(os.path.abspath(args.input)))
+    return 0
+
+
+def read_crec(fin, block_records):
+    """Yield the CREC records of a binary stream, block_records at a time."""
+    block_bytes = block_records * CREC.itemsize
+    while True:
+        data = fin.read(block_bytes)
+        while data and len(data) % CREC.itemsize:
+            more = fin.read(block_bytes - len(data))
+            if not more:
+                raise ValueError("truncated CREC input: %d trailing bytes" % (len(data) % CREC.itemsize))
+            data += more
+        if not data:
+            break
+        yield np.frombuffer(data, dtype=CREC)
+
+
+###########################################################
+# VARINTS
+
+def encode_varints(values):
+    """LEB128 bytes of an array of non-negative integers below 2**35."""
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for k in range(1, VARINT_BYTES):
+        lengths += values >= (1 << (7 * k))
+    if len(values) and values.max() >= (1 << (7 * VARINT_BYTES)):
+        raise ValueError("varint value out of range")
+    ends = np.cumsum(lengths)
+    out = np.empty(int(ends[-1]) if len(values) else 0, dtype=np.uint8)
+    starts = ends - lengths
+    for k in range(VARINT_BYTES):
+        have = lengths > k
+        if not have.any():
+            break
+        byte = (values[have] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        byte |= np.where(lengths[have] > k + 1, 0x80, 0).astype(np.uint64)
+        out[starts[have] + k] = byte
+    return out.tobytes()
+
+
+def decode_varints(data, count):
+    """The count integers of the LEB128 bytes data, as int64."""
+    data = np.frombuffer(data, dtype=np.uint8)
+    last = (data & 0x80) == 0
+    ends = np.flatnonzero(last)
+    if len(ends) != count or (len(data) and not last[-1]):
+        raise ValueError("corrupt varint stream: %d values, expected %d" % (len(ends), count))
+    if not count:
+        return np.empty(0, dtype=np.int64)
+    starts = np.concatenate([[0], ends[:-1] + 1])
+    position = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7f).astype(np.int64) << (7 * position)
+    return np.add.reduceat(parts, starts)
+
+
+###########################################################
+# BLOCKS
+
+def encode_block(records, sorted_ids, float64):
+    """Raw payload of a block of CREC records."""
+    word1 = records['word1'].astype(np.int64)
+    word2 = records['word2'].astype(np.int64)
+    if sorted_ids:
+        new_word1 = np.ones(len(word1), dtype=bool)
+        new_word1[1:] = word1[1:] != word1[:-1]
+        word2 = word2 - np.where(new_word1, 0, np.concatenate([[0], word2[:-1]]))
+        word1 = np.diff(word1, prepend=0)
+        if len(word1) and (word1.min() < 0 or word2.min() < 0):
+            raise ValueError("records are not sorted by (word1, word2)")
+    ids1 = encode_varints(word1)
+    ids2 = encode_varints(word2)
+    vals = records['val'].astype('<f8' if float64 else '<f4')
+    return STREAM_LENGTHS.pack(len(ids1), len(ids2)) + ids1 + ids2 + vals.tobytes()
+
+
+def decode_block(payload, count, sorted_ids, float64):
+    """CREC records of a raw block payload."""
+    len1, len2 = STREAM_LENGTHS.unpack_from(payload)
+    pos = STREAM_LENGTHS.size
+    word1 = decode_varints(payload[pos:pos + len1], count)
+    word2 = decode_varints(payload[pos + len1:pos + len1 + len2], count)
+    if sorted_ids and count:
+        word1 = np.cumsum(word1)
+        new_word1 = np.ones(count, dtype=bool)
+        new_word1[1:] = word1[1:] != word1[:-1]
+        run_starts = np.flatnonzero(new_word1)
+        totals = np.cumsum(word2)
+        base = totals[run_starts] - word2[run_starts]
+        word2 = totals - np.repeat(base, np.diff(np.append(run_starts, count)))
+    records = np.empty(count, dtype=CREC)
+    records['word1'] = word1
+    records['word2'] = word2
+    records['val'] = np.frombuffer(payload, dtype='<f8' if float64 else '<f4',
+        count=count, offset=pos + len1 + len2)
+    return records
+
+
+class CrecWriter(object):
+    """Write CREC records to a CRCZ file; records are buffered into blocks."""
+
+    def __init__(self, path, codec='zlib', sorted_ids=False, float64=False,
+            block_records=1 << 20, level=None):
+        if codec not in CODECS:
+            raise ValueError("codec %r is not available (have: %s)" % (codec, ', '.join(sorted(CODECS))))
+        self.codec_id, self._compress, _ = CODECS[codec]
+        self.sorted_ids = sorted_ids
+        self.float64 = float64
+        self.block_records = block_records
+        self.level = level
+        self.index = []
+        self.records = 0
+        self._pending = []
+        self._pending_records = 0
+        self._last = None
+        self._f = open(path, 'wb')
+        flags = (FLAG_SORTED if sorted_ids else 0) | (FLAG_FLOAT64 if float64 else 0)
+        self._f.write(HEADER.pack(MAGIC, FORMAT_VERSION, self.codec_id, flags, 0, block_records, 0))
+
+    def write(self, records):
+        while len(records):
+            take = min(len(records), self.block_records - self._pending_records)
+            self._pending.append(records[:take])
+            self._pending_records += take
+            records = records[take:]
+            if self._pending_records == self.block_records:
+                self._flush_block()
+
+    def _flush_block(self):
+        records = np.concatenate(self._pending) if len(self._pending) > 1 else self._pending[0]
+        self._pending = []
+        self._pending_records = 0
+        if self.sorted_ids and self._last is not None and \
+                (int(records['word1'][0]), int(records['word2'][0])) < self._last:
+            raise ValueError("records are not sorted by (word1, word2)")
+        raw = encode_block(records, self.sorted_ids, self.float64)
+        stored = self._compress(raw, self.level)
+        first, last = int(records['word1'][0]), int(records['word1'][-1])
+        self.index.append((self._f.tell(), len(records), first, last))
+        self._f.write(BLOCK_HEADER.pack(len(records), len(stored), len(raw), first, last))
+        self._f.write(stored)
+        self.records += len(records)
+        self._last = (last, int(records['word2'][-1]))
+
+    def close(self):
+        if self._f is None:
+            return
+        if self._pending_records:
+            self._flush_block()
+        index_offset = self._f.tell()
+        self._f.write(np.array(self.index, dtype=INDEX_ENTRY).tobytes())
+        self._f.write(TRAILER.pack(index_offset, len(self.index), self.records, INDEX_MAGIC))
+        self._f.close()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CrecReader(object):
+    """Sequential and random access to the blocks of a CRCZ file."""
+
+    def __init__(self, path):
+        self._f = open(path, 'rb')
+        magic, version, codec_id, flags, _, self.block_records, _ = HEADER.unpack(self._f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s is not a CRCZ file" % path)
+        if version != FORMAT_VERSION:
+            raise ValueError("%s: unsupported CRCZ version %d" % (path, version))
+        if codec_id not in CODEC_NAMES:
+            raise ValueError("%s needs the %s codec, which is not installed" %
+                (path, KNOWN_CODECS.get(codec_id, 'unknown %d' % codec_id)))
+        self.codec = CODEC_NAMES[codec_id]
+        self._decompress = CODECS[self.codec][2]
+        self.sorted_ids = bool(flags & FLAG_SORTED)
+        self.float64 = bool(flags & FLAG_FLOAT64)
+        self.index = self._read_index()
+        self.records = int(self.index['records'].sum())
+
+    def _read_index(self):
+        size = os.fstat(self._f.fileno()).st_size
+        if size >= HEADER.size + TRAILER.size:
+            self._f.seek(size - TRAILER.size)
+            index_offset, blocks, _, magic = TRAILER.unpack(self._f.read(TRAILER.size))
+            if magic == INDEX_MAGIC and index_offset + blocks * INDEX_ENTRY.itemsize + TRAILER.size == size:
+                self._f.seek(index_offset)
+                return np.frombuffer(self._f.read(blocks * INDEX_ENTRY.itemsize), dtype=INDEX_ENTRY)
+        # no index (the writer did not finish): walk the block headers
+        entries = []
+        offset = HEADER.size
+        while offset + BLOCK_HEADER.size <= size:
+            self._f.seek(offset)
+            count, stored, _, first, last = BLOCK_HEADER.unpack(self._f.read(BLOCK_HEADER.size))
+            if offset + BLOCK_HEADER.size + stored > size:
+                break
+            entries.append((offset, count, first, last))
+            offset += BLOCK_HEADER.size + stored
+        return np.array(entries, dtype=INDEX_ENTRY)
+
+    def read_block(self, i):
+        """The CREC records of block i."""
+        self._f.seek(int(self.index['offset'][i]))
+        count, stored, raw_bytes, _, _ = BLOCK_HEADER.unpack(self._f.read(BLOCK_HEADER.size))
+        raw = self._decompress(self._f.read(stored))
+        if len(raw) != raw_bytes:
+            raise ValueError("block %d: %d bytes decompressed, expected %d" % (i, len(raw), raw_bytes))
+        return decode_block(raw, count, self.sorted_ids, self.float64)
+
+    def iter_blocks(self, first=0, last=None):
+        for i in range(first, len(self.index) if last is None else last):
+            yield self.read_block(i)
+
+    def iter_range(self, lo, hi):
+        """Yield the records with lo <= word1 < hi of a sorted file."""
+        if not self.sorted_ids:
+            raise ValueError("word1 ranges need a sorted CRCZ file")
+        first = int(np.searchsorted(self.index['last_word1'], lo, side='left'))
+        last = int(np.searchsorted(self.index['first_word1'], hi, side='left'))
+        for records in self.iter_blocks(first, last):
+            records = records[(records['word1'] >= lo) & (records['word1'] < hi)]
+            if len(records):
+                yield records
+
+    def close(self):
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+###########################################################
+# BENCHMARK
+
+def _raw_read_rate(path, block_records, max_records):
+    start = time.time()
+    records = 0
+    with open(path, 'rb') as f:
+        for block in read_crec(f, block_records):
+            records += len(block)
+            if max_records is not None and records >= max_records:
+                break
+    return records / max(time.time() - start, 1e-9)
+
+
+def _check_decoded(path, encoded, block_records):
+    """Largest relative error of the decoded values; the IDs must be exact."""
+    error = 0.0
+    with open(path, 'rb') as f, CrecReader(encoded) as reader:
+        for decoded, block in zip(reader.iter_blocks(), read_crec(f, block_records)):
+            block = block[:len(decoded)]
+            if not (np.array_equal(decoded['word1'], block['word1']) and
+                    np.array_equal(decoded['word2'], block['word2'])):
+                raise ValueError("%s: decoded IDs differ from the input" % encoded)
+            error = max(error, float(np.max(np.abs(decoded['val'] - block['val']) /
+                np.maximum(np.abs(block['val']), 1e-300), initial=0.0)))
+    return error
+
+
+def benchmark(path, codecs, sorted_ids, block_records, max_records, tmpdir):
+    """Print bytes/record and encode/decode throughput of each codec for a CREC file.
+
+    The encoded files are written to tmpdir, on the disk of the input by
+    default, so that the raw read rate and the decode rate are comparable.
+    Reads are from the page cache when the files fit in it.
+    """
+    if sorted_ids is None:
+        with open(path, 'rb') as f:
+            head = next(read_crec(f, block_records), np.empty(0, dtype=CREC))
+        keys = head['word1'].astype(np.int64) * (1 << 32) + head['word2']
+        sorted_ids = bool(np.all(keys[1:] > keys[:-1]))
+    print('%s: %s records, %s' % (path, os.path.getsize(path) // CREC.itemsize,
+        'sorted' if sorted_ids else 'unsorted'))
+    print('%-12s %12s %10s %14s %14s %10s' % ('codec', 'bytes/rec', 'ratio', 'encode MB/s',
+        'decode rec/s', 'max error'))
+    raw_rate = _raw_read_rate(path, block_records, max_records)
+    print('%-12s %12.2f %10.2f %14s %14.0f %10s' % ('raw', CREC.itemsize, 1.0, '-', raw_rate, '-'))
+    for codec in codecs:
+        for float64 in (False, True):
+            fd, encoded = tempfile.mkstemp(suffix='.crz', dir=tmpdir)
+            os.close(fd)
+            try:
+                start = time.time()
+                records = 0
+                with open(path, 'rb') as f, CrecWriter(encoded, codec, sorted_ids, float64,
+                        block_records) as writer:
+                    for block in read_crec(f, block_records):
+                        if max_records is not None:
+                            block = block[:max_records - records]
+                        writer.write(block)
+                        records += len(block)
+                        if max_records is not None and records >= max_records:
+                            break
+                encode_time = max(time.time() - start, 1e-9)
+                size = os.path.getsize(encoded)
+
+                start = time.time()
+                with CrecReader(encoded) as reader:
+                    decoded_records = sum(len(block) for block in reader.iter_blocks())
+                decode_time = max(time.time() - start, 1e-9)
+                error = _check_decoded(path, encoded, block_records)
+            finally:
+                os.remove(encoded)
+            print('%-12s %12.2f %10.2f %14.1f %14.0f %10.1e' % (codec + ('/f8' if float64 else '/f4'),
+                size / float(max(records, 1)), records * CREC.itemsize / float(max(size, 1)),
+                records * CREC.itemsize / 2.0 ** 20 / encode_time, decoded_records / decode_time, error))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
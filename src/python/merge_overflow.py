@@ -0,0 +1,150 @@
+"""Merge cooccur's sorted overflow files with a parallel multi-level tree.
+
+merge_files() in cooccur.c opens every overflow file at once and pops one
+record at a time from a single binary heap.  Here groups of fan_in files are
+merged in parallel by worker processes into the files of the next level,
+whose inputs are removed as soon as their group is merged.  The last level
+is merged in parallel too, each worker summing one range of word1 into a
+part that is appended to the output in order.  Files are read through
+memory maps a word1 range at a time and written in blocks.
+
+Duplicate (word1, word2) records are summed, so the output is the same
+sorted CREC file cooccur writes, up to the order in which floating point
+values of the same pair are added.
+
+    ./build/cooccur -merge 0 -overflow-file overflow ... < corpus.txt
+    python src/python/merge_overflow.py --overflow_file overflow --output cooccurrence.bin
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+
+from crec import CREC, merge_sorted, word1_bound
+
+# word IDs are int32, so this stride keeps (word1, word2) keys unique in int64
+MAX_STRIDE = 1 << 31
+WRITE_BUFFER = 16 << 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('inputs', nargs='*', help='sorted CREC files to merge')
+    parser.add_argument('--overflow_file', default=None, type=str,
+        help="merge every <overflow_file>_NNNN.bin left by 'cooccur -merge 0'")
+    parser.add_argument('--output', default='-', type=str, help="'-' for stdout")
+    parser.add_argument('--fan_in', default=16, type=int, help='files merged together at each level')
+    parser.add_argument('--processes', default=None, type=int, help='default: all cores')
+    parser.add_argument('--memory', default=4.0, type=float,
+        help='GB shared by the workers for their merge ranges')
+    parser.add_argument('--keep', action='store_true', help='do not remove the input files')
+    args = parser.parse_args()
+
+    inputs = list(args.inputs)
+    if args.overflow_file is not None:
+        inputs += overflow_files(args.overflow_file)
+    if not inputs:
+        sys.stderr.write("No files to merge.\n")
+        return 1
+    processes = args.processes or os.cpu_count()
+    max_records = max(1 << 16, int(args.memory * 2 ** 30 / processes / (4 * CREC.itemsize)))
+    head = args.overflow_file or os.path.splitext(inputs[0])[0]
+    if args.output == '-':
+        tree_merge(inputs, sys.stdout.buffer, head, args.fan_in, processes, max_records, not args.keep)
+    else:
+        with open(args.output, 'wb') as fout:
+            tree_merge(inputs, fout, head, args.fan_in, processes, max_records, not args.keep)
+    return 0
+
+
+def overflow_files(file_head):
+    return sorted(glob.glob(glob.escape(file_head) + '_[0-9][0-9][0-9][0-9].bin'))
+
+
+def _open_sources(files):
+    return [np.memmap(f, dtype=CREC, mode='r') for f in files if os.path.getsize(f) > 0]
+
+
+def merge_group(files, output, max_records, word1_range=None):
+    """Merge sorted CREC files into output; returns the number of records.
+
+    With word1_range = (lo, hi), only the records with lo <= word1 < hi are
+    merged.
+    """
+    sources = _open_sources(files)
+    if word1_range is not None:
+        lo, hi = word1_range
+        sources = [s[word1_bound(s, lo, 0):word1_bound(s, hi, 0)] for s in sources]
+        sources = [s for s in sources if len(s)]
+    with open(output, 'wb', buffering=WRITE_BUFFER) as fout:
+        return merge_sorted(sources, fout, MAX_STRIDE - 1, max_records)
+
+
+def word1_splits(files, parts):
+    """word1 boundaries that split the records of files into about equal parts."""
+    samples = [s['word1'][::max(1, len(s) // 4096)] for s in _open_sources(files)]
+    if not samples or parts < 2:
+        return [0, MAX_STRIDE]
+    sample = np.sort(np.concatenate(samples))
+    cuts = np.unique(sample[np.linspace(0, len(sample), parts + 1)[1:-1].astype(np.int64)])
+    return [0] + [int(c) for c in cuts] + [MAX_STRIDE]
+
+
+def tree_merge(inputs, fout, file_head, fan_in=16, processes=None, max_records=1 << 22,
+        remove_inputs=True, verbose=True):
+    """Merge the sorted CREC files inputs into the binary file object fout.
+
+    Intermediate files are named <file_head>.L<level>_NNNN.bin.  Returns the
+    number of records written.
+    """
+    processes = processes or os.cpu_count()
+    fan_in = max(fan_in, 2)
+    start = time.time()
+    files = list(inputs)
+    level = 0
+    with ProcessPoolExecutor(processes) as pool:
+        while len(files) > fan_in:
+            level += 1
+            groups = [files[i:i + fan_in] for i in range(0, len(files), fan_in)]
+            outputs = ['%s.L%d_%04d.bin' % (file_head, level, g) for g in range(len(groups))]
+            pending = {pool.submit(merge_group, group, output, max_records): group
+                for group, output in zip(groups, outputs)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    group = pending.pop(future)
+                    future.result()
+                    if remove_inputs or level > 1:
+                        for f in group:
+                            os.remove(f)
+            if verbose:
+                sys.stderr.write("Merge level %d: %d files into %d (%.1f s)\n" %
+                    (level, len(files), len(outputs), time.time() - start))
+            files = outputs
+
+        # last level: one word1 range per worker, appended in order
+        splits = word1_splits(files, processes)
+        parts = ['%s.L%d_part%04d.bin' % (file_head, level + 1, p) for p in range(len(splits) - 1)]
+        futures = [pool.submit(merge_group, files, part, max_records, (splits[p], splits[p + 1]))
+            for p, part in enumerate(parts)]
+        written = sum(f.result() for f in futures)
+    fout.flush()
+    for part in parts:
+        with open(part, 'rb') as f:
+            shutil.copyfileobj(f, fout, WRITE_BUFFER)
+        os.remove(part)
+    if remove_inputs or level > 0:
+        for f in files:
+            os.remove(f)
+    if verbose:
+        sys.stderr.write("Merged %d files in %d levels into %d records in %.1f s.\n" %
+            (len(inputs), level + 1, written, time.time() - start))
+    return written
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""Choose cooccur's -max-product and -overflow-length from a corpus sample.
+
+cooccur sums the cooccurrences of words whose product of frequency ranks is
+below max_product in a dense table and buffers the others, writing a sorted
+overflow file every time overflow_length records are buffered.  The default
+-memory heuristic ignores the corpus, so large corpora can spill hundreds of
+overflow files that then have to be heap-merged.
+
+This tool counts the window pairs of random samples of the corpus (the text
+file or the ID stream of corpus.py), models for a range of max_product
+values the dense table size, the overflow buffer that fits next to it in the
+memory budget and the resulting number of overflow files, and recommends the
+setting with the fewest files.  With --run it also runs cooccur with the
+recommended settings and reports the predicted against the actual count.
+
+    python src/python/plan_cooccur.py --corpus corpus.txt --vocab_file vocab.txt --memory 50 --window_size 8
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import numpy as np
+
+from corpus import BOUNDARY, OOV, read_vocab, encode_lines, load_corpus
+from cooccur import memory_plan, window_pairs
+from crec import CREC
+
+# cooccur.c: hash table slots, and HASHREC plus malloc overhead per word
+TSIZE = 1048576
+HASHREC_BYTES = 40
+SAMPLE_SPAN = 1 << 16
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', required=True, type=str,
+        help='text corpus, or an ID stream written by corpus.py')
+    parser.add_argument('--vocab_file', default='vocab.txt', type=str)
+    parser.add_argument('--memory', default=4.0, type=float, help='memory budget in GB')
+    parser.add_argument('--window_size', default=15, type=int)
+    parser.add_argument('--symmetric', default=1, type=int)
+    parser.add_argument('--sample_tokens', default=10000000, type=int)
+    parser.add_argument('--candidates', default=24, type=int,
+        help='number of max_product values evaluated')
+    parser.add_argument('--run', action='store_true',
+        help='run cooccur with the recommended settings and report the actual file count')
+    parser.add_argument('--cooccur', default='build/cooccur', type=str)
+    parser.add_argument('--output', default='cooccurrence.bin', type=str, help='output of --run')
+    parser.add_argument('--overflow_file', default='overflow', type=str)
+    args = parser.parse_args()
+
+    words = read_vocab(args.vocab_file)
+    text_corpus, sample, total_tokens = sample_corpus(args.corpus, words, args.sample_tokens)
+    q = pair_products(sample, args.window_size)
+    sampled = np.count_nonzero(sample != BOUNDARY)
+    # with symmetric, each pair is buffered as two records
+    pairs_per_token = (2 if args.symmetric else 1) * len(q) / float(max(sampled, 1))
+    print('Sampled %d tokens of about %d; %.2f records per token' % (sampled, total_tokens, pairs_per_token))
+
+    budget = args.memory * 1073741824
+    default = memory_plan(args.memory)
+    plans = [evaluate_plan(m, None, q, pairs_per_token, total_tokens, len(words), budget, args.window_size)
+        for m in candidate_products(len(words), budget, args.candidates)]
+    plans = [p for p in plans if p is not None]
+    heuristic = evaluate_plan(default[0], default[1], q, pairs_per_token, total_tokens, len(words),
+        budget, args.window_size)
+    if not plans:
+        sys.stderr.write("No max_product leaves room for an overflow buffer in %.1f GB.\n" % args.memory)
+        return 1
+    best = min(plans, key=lambda p: (p['files'], p['sparse_records']))
+
+    print('%14s %10s %16s %10s %16s %8s' % ('max_product', 'dense MB', 'overflow_length', 'total MB',
+        'sparse records', 'files'))
+    for plan in sorted(plans + [heuristic], key=lambda p: p['max_product']):
+        mark = ' <- recommended' if plan is best else ' <- -memory heuristic' if plan is heuristic else ''
+        print('%14d %10.0f %16d %10.0f %16d %8d%s' % (plan['max_product'], plan['dense_bytes'] / 2.0 ** 20,
+            plan['overflow_length'], plan['memory_bytes'] / 2.0 ** 20, plan['sparse_records'],
+            plan['files'], mark))
+    print('Recommended: -max-product %d -overflow-length %d (%d files predicted, %d with -memory %g)' %
+        (best['max_product'], best['overflow_length'], best['files'], heuristic['files'], args.memory))
+
+    if args.run:
+        if text_corpus is None:
+            sys.stderr.write("--run needs the text corpus.\n")
+            return 1
+        actual = run_cooccur(args, text_corpus, best)
+        print('Predicted files: %d  actual: %d' % (best['files'], actual))
+    return 0
+
+
+def sample_corpus(path, words, sample_tokens):
+    """(text corpus path or None, sampled IDs, estimated corpus tokens).
+
+    Spans are drawn at random offsets; text spans start at a line start so
+    that documents are not cut.
+    """
+    rng = np.random.default_rng(1)
+    if os.path.isfile(path + '.json'):
+        ids, meta = load_corpus(path)
+        num_spans = max(1, min(len(ids) // SAMPLE_SPAN, sample_tokens // SAMPLE_SPAN))
+        starts = np.sort(rng.choice(max(len(ids) - SAMPLE_SPAN, 1), num_spans, replace=False))
+        sample = np.concatenate([[BOUNDARY]] + [np.append(ids[s:s + SAMPLE_SPAN], BOUNDARY) for s in starts])
+        sample = sample[sample != OOV]
+        text_corpus = meta['corpus'] if os.path.isfile(meta['corpus']) else None
+        return text_corpus, sample.astype(np.int64), meta['words'] - meta['oov_words']
+
+    vocab = {w: i + 1 for i, w in enumerate(words)}
+    size = os.path.getsize(path)
+    span_bytes = 1 << 20
+    pieces = []
+    sampled = sampled_bytes = 0
+    with open(path, 'rb') as f:
+        for offset in rng.permutation(max(size // span_bytes, 1)):
+            f.seek(int(offset) * span_bytes)
+            data = f.read(span_bytes)
+            if offset > 0:
+                data = data[data.find(b'\n') + 1:]
+            data = data[:data.rfind(b'\n') + 1]
+            ids = encode_lines(data, vocab)
+            ids = ids[ids != OOV]
+            pieces.append(ids)
+            sampled += len(ids)
+            sampled_bytes += len(data)
+            if sampled >= sample_tokens:
+                break
+    sample = np.concatenate([[BOUNDARY]] + pieces).astype(np.int64)
+    words_sampled = np.count_nonzero(sample != BOUNDARY)
+    return path, sample, int(words_sampled * size / float(max(sampled_bytes, 1)))
+
+
+def pair_products(sample, window_size):
+    """Sorted (context + 1) * target of every (context, target) pair of the sample.
+
+    A record goes to the dense table iff this product is at most max_product
+    (the test is 'context < max_product / target' in integer arithmetic);
+    with symmetric, the reverse record of a pair follows the same choice, so
+    the fractions over the pairs hold for the records too.
+    """
+    q = [(context + 1) * target for context, target, _ in window_pairs(sample, 0, window_size, False)]
+    return np.sort(np.concatenate(q)) if q else np.empty(0, dtype=np.int64)
+
+
+def dense_elements(vocab_size, max_product):
+    ranks = np.arange(1, vocab_size + 1, dtype=np.int64)
+    return 1 + int(np.minimum(max_product // ranks, vocab_size).sum())
+
+
+def fixed_bytes(vocab_size, words_bytes=8):
+    """Memory cooccur needs besides the dense table and the overflow buffer."""
+    return TSIZE * 8 + vocab_size * (HASHREC_BYTES + words_bytes) + (vocab_size + 1) * 8
+
+
+def candidate_products(vocab_size, budget, count):
+    """max_product values spaced geometrically up to a dense table filling the budget."""
+    hi = 1
+    while hi < vocab_size ** 2 and dense_elements(vocab_size, hi * 2) * 8 < budget:
+        hi *= 2
+    return sorted(set(int(v) for v in np.geomspace(max(vocab_size, 2), max(hi, vocab_size + 1), count)))
+
+
+def evaluate_plan(max_product, overflow_length, q, pairs_per_token, total_tokens,
+        vocab_size, budget, window_size):
+    """Predicted dense size, overflow buffer and overflow files for max_product.
+
+    Without an overflow_length, the largest buffer that fits in the budget
+    next to the dense table is used.
+    """
+    dense_bytes = dense_elements(vocab_size, max_product) * 8
+    if overflow_length is None:
+        overflow_length = int((budget - dense_bytes - fixed_bytes(vocab_size)) // CREC.itemsize) - 1
+        if overflow_length <= 4 * window_size:
+            return None
+    sparse_fraction = 1 - np.searchsorted(q, max_product, side='right') / float(max(len(q), 1))
+    sparse_records = int(sparse_fraction * pairs_per_token * total_tokens)
+    # a file is written each time the buffer holds overflow_length - window_size records, plus the last one and the dense table
+    files = sparse_records // max(overflow_length - window_size, 1) + 2
+    return {
+        'max_product': max_product,
+        'overflow_length': overflow_length,
+        'dense_bytes': dense_bytes,
+        'memory_bytes': dense_bytes + (overflow_length + 1) * CREC.itemsize + fixed_bytes(vocab_size),
+        'sparse_records': sparse_records,
+        'files': files,
+    }
+
+
+def run_cooccur(args, text_corpus, plan):
+    """Run cooccur with plan and return the number of files it reports."""
+    command = [args.cooccur, '-verbose', '2', '-symmetric', str(args.symmetric),
+        '-window-size', str(args.window_size), '-vocab-file', args.vocab_file,
+        '-max-product', str(plan['max_product']), '-overflow-length', str(plan['overflow_length']),
+        '-overflow-file', args.overflow_file]
+    print('$ %s < %s > %s' % (' '.join(command), text_corpus, args.output))
+    with open(text_corpus, 'rb') as fin, open(args.output, 'wb') as fout:
+        proc = subprocess.run(command, stdin=fin, stdout=fout, stderr=subprocess.PIPE, check=True)
+    found = re.findall(rb'(\d+) files in total', proc.stderr)
+    return int(found[-1]) if found else -1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""Tests of cooccur.count_cooccurrences; run with python -m pytest src/python."""
+import io
+import numpy as np
+
+from corpus import BOUNDARY, OOV
+from cooccur import count_cooccurrences
+from crec import CREC
+
+
+def make_ids(num_tokens=2000, vocab_size=50, seed=0):
+    """A random ID stream with documents and runs of OOV words longer than the window."""
+    rng = np.random.default_rng(seed)
+    ids = np.minimum(rng.zipf(1.3, num_tokens), vocab_size).astype(np.uint32)
+    ids[rng.random(num_tokens) < 0.05] = BOUNDARY
+    for start in rng.choice(num_tokens - 20, 20, replace=False):
+        ids[start:start + rng.integers(1, 20)] = OOV
+    return ids
+
+
+def cooccur_bytes(tmp_path, ids, vocab_size, **kwargs):
+    fout = io.BytesIO()
+    kwargs.setdefault('max_product', 40)
+    kwargs.setdefault('overflow_length', 1000)
+    count_cooccurrences(ids, vocab_size, fout, window_size=5, overflow_file=str(tmp_path / 'overflow'),
+        processes=1, verbose=False, **kwargs)
+    return fout.getvalue()
+
+
+def test_tiny_blocks_match_single_block(tmp_path):
+    ids = make_ids()
+    # unweighted counts are sums of 1.0, exact in any order
+    single = cooccur_bytes(tmp_path, ids, 50, block_tokens=len(ids), distance_weighting=0)
+    assert len(single) > 0
+    assert cooccur_bytes(tmp_path, ids, 50, block_tokens=4, distance_weighting=0) == single
+
+    # weighted counts are summed per block, so they may differ in the last bits
+    single = np.frombuffer(cooccur_bytes(tmp_path, ids, 50, block_tokens=len(ids)), dtype=CREC)
+    tiny = np.frombuffer(cooccur_bytes(tmp_path, ids, 50, block_tokens=4), dtype=CREC)
+    assert np.array_equal(tiny[['word1', 'word2']], single[['word1', 'word2']])
+    assert np.allclose(tiny['val'], single['val'], rtol=1e-12, atol=0)
+
+
+def test_dense_table_chunks_match(tmp_path):
+    # a small overflow_length also writes the dense table a few rows at a time
+    ids = make_ids(seed=1)
+    whole = cooccur_bytes(tmp_path, ids, 50, overflow_length=1 << 20)
+    assert cooccur_bytes(tmp_path, ids, 50, overflow_length=7) == whole
@@ -40,6 +40,8 @@ int verbose = 2; // 0, 1, or 2
 long long array_size = 2000000; // size of chunks to shuffle individually
 char *file_head; // temporary file string
 real memory_limit = 2.0; // soft limit, in gigabytes
+real holdout_fraction = 0; // fraction of the records written to holdout_file instead of the shuffled output
+char *holdout_file;
 
 /* Efficient string comparison */
 int scmp( char *s1, char *s2 ) {
@@ -125,17 +127,37 @@ int shuffle_merge(int num) {
     return 0;
 }
 
+/* Whether the records of the pair {word1, word2} are held out. The choice is a hash of the
+   unordered pair, so the (i,j) and (j,i) records of a symmetric file fall on the same side. */
+static int holdout_pair(CREC *cr) {
+    unsigned long long lo = (unsigned int)(cr->word1 < cr->word2 ? cr->word1 : cr->word2);
+    unsigned long long hi = (unsigned int)(cr->word1 < cr->word2 ? cr->word2 : cr->word1);
+    unsigned long long h = (lo << 32 | hi) + 0x9E3779B97F4A7C15ULL; // splitmix64 finalizer
+    h = (h ^ (h >> 30)) * 0xBF58476D1CE4E5B9ULL;
+    h = (h ^ (h >> 27)) * 0x94D049BB133111EBULL;
+    h ^= h >> 31;
+    return (h >> 11) * (1.0 / 9007199254740992.0) < holdout_fraction;
+}
+
 /* Shuffle large input stream by splitting into chunks */
 int shuffle_by_chunks() {
     long i = 0, l = 0;
     int fidcounter = 0;
     char filename[MAX_STRING_LENGTH];
+    long held_out = 0;
     CREC *array;
-    FILE *fin = stdin, *fid;
+    FILE *fin = stdin, *fid, *fhold = NULL;
     array = malloc(sizeof(CREC) * array_size);
     
     fprintf(stderr,"SHUFFLING COOCCURRENCES\n");
     if (verbose > 0) fprintf(stderr,"array size: %lld\n", array_size);
+    if (holdout_fraction > 0) {
+        fhold = fopen(holdout_file, "wb");
+        if (fhold == NULL) {
+            fprintf(stderr, "Unable to open file %s.\n",holdout_file);
+            return 1;
+        }
+    }
     sprintf(filename,"%s_%04d.bin",file_head, fidcounter);
     fid = fopen(filename,"w");
     if (fid == NULL) {
@@ -162,12 +184,21 @@ int shuffle_by_chunks() {
         }
         fread(&array[i], sizeof(CREC), 1, fin);
         if (feof(fin)) break;
+        if (fhold != NULL && holdout_pair(&array[i])) { // held-out records are never trained on
+            fwrite(&array[i], sizeof(CREC), 1, fhold);
+            held_out++;
+            continue;
+        }
         i++;
     }
     shuffle(array, i-2); //Last chunk may be smaller than array_size
     write_chunk(array,i,fid);
     l += i;
     if (verbose > 1) fprintf(stderr, "\033[22Gprocessed %ld lines.\n", l);
+    if (fhold != NULL) {
+        fclose(fhold);
+        if (verbose > 0) fprintf(stderr, "Held out %ld lines in %s.\n", held_out, holdout_file);
+    }
     if (verbose > 1) fprintf(stderr, "Wrote %d temporary file(s).\n", fidcounter + 1);
     fclose(fid);
     free(array);
@@ -191,6 +222,8 @@ int find_arg(char *str, int argc, char **argv) {
 int main(int argc, char **argv) {
     int i;
     file_head = malloc(sizeof(char) * MAX_STRING_LENGTH);
+    holdout_file = malloc(sizeof(char) * MAX_STRING_LENGTH);
+    holdout_file[0] = '\0';
     
     if (argc == 1) {
         printf("Tool to shuffle entries of word-word cooccurrence files\n");
@@ -204,6 +237,10 @@ int main(int argc, char **argv) {
         printf("\t\tLimit to length <int> the buffer which stores chunks of data to shuffle before writing to disk. \n\t\tThis value overrides that which is automatically produced by '-memory'.\n");
         printf("\t-temp-file <file>\n");
         printf("\t\tFilename, excluding extension, for temporary files; default temp_shuffle\n");
+        printf("\t-holdout-file <file>\n");
+        printf("\t\tWrite the records of a sample of the word pairs to <file> instead of the output, for 'glove -holdout-file'; both orders of a pair are held out together\n");
+        printf("\t-holdout-fraction <float>\n");
+        printf("\t\tFraction of the word pairs held out; default 0.001 with -holdout-file, 0 otherwise\n");
         
         printf("\nExample usage: (assuming 'cooccurrence.bin' has been produced by 'coccur')\n");
         printf("./shuffle -verbose 2 -memory 8.0 < cooccurrence.bin > cooccurrence.shuf.bin\n");
@@ -216,6 +253,15 @@ int main(int argc, char **argv) {
     if ((i = find_arg((char *)"-memory", argc, argv)) > 0) memory_limit = atof(argv[i + 1]);
     array_size = (long long) (0.95 * (real)memory_limit * 1073741824/(sizeof(CREC)));
     if ((i = find_arg((char *)"-array-size", argc, argv)) > 0) array_size = atoll(argv[i + 1]);
+    if ((i = find_arg((char *)"-holdout-file", argc, argv)) > 0) {
+        strcpy(holdout_file, argv[i + 1]);
+        holdout_fraction = 0.001;
+    }
+    if ((i = find_arg((char *)"-holdout-fraction", argc, argv)) > 0) holdout_fraction = atof(argv[i + 1]);
+    if (holdout_fraction > 0 && holdout_file[0] == '\0') {
+        fprintf(stderr, "-holdout-fraction needs -holdout-file.\n");
+        return 1;
+    }
     return shuffle_by_chunks();
 }
 
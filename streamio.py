@@ -0,0 +1,371 @@
+"""Compressed stream helpers for snake_glove.py."""
+import collections
+import io
+import lzma
+import os
+import queue
+import shlex
+import shutil
+import struct
+import subprocess
+import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+XZ_HEADER_MAGIC = b'\xfd7zXZ\x00'
+XZ_FOOTER_MAGIC = b'YZ'
+XZ_HEADER_SIZE = 12
+XZ_FOOTER_SIZE = 12
+
+
+###########################################################
+# XZ CONCATENATION
+
+def _ReadVarint(buf, pos):
+    """Decode an xz multibyte integer at buf[pos]; returns (value, new pos)."""
+    value = 0
+    for i in range(9):
+        byte = buf[pos + i]
+        value |= (byte & 0x7f) << (7 * i)
+        if not byte & 0x80:
+            return value, pos + i + 1
+    raise ValueError("invalid xz multibyte integer")
+
+
+def _CheckXzStream(f, end):
+    """Check the xz stream ending at offset end; returns its start offset.
+
+    Verifies the stream footer (magic, CRC32), the index it points to
+    (indicator, CRC32) and the stream header found by skipping back over the
+    blocks listed in the index, without decompressing anything.
+    """
+    if end < XZ_HEADER_SIZE + XZ_FOOTER_SIZE:
+        raise ValueError("too short for an xz stream")
+    f.seek(end - XZ_FOOTER_SIZE)
+    footer = f.read(XZ_FOOTER_SIZE)
+    if footer[10:12] != XZ_FOOTER_MAGIC:
+        raise ValueError("missing stream footer")
+    crc, backward_size = struct.unpack('<II', footer[:8])
+    if zlib.crc32(footer[4:10]) != crc:
+        raise ValueError("stream footer CRC mismatch")
+    flags = footer[8:10]
+
+    index_size = (backward_size + 1) * 4
+    index_start = end - XZ_FOOTER_SIZE - index_size
+    if index_start < XZ_HEADER_SIZE:
+        raise ValueError("index does not fit in the file")
+    f.seek(index_start)
+    index = f.read(index_size)
+    if index[0] != 0 or zlib.crc32(index[:-4]) != struct.unpack('<I', index[-4:])[0]:
+        raise ValueError("corrupt stream index")
+
+    num_records, pos = _ReadVarint(index, 1)
+    blocks_size = 0
+    for _ in range(num_records):
+        unpadded, pos = _ReadVarint(index, pos)
+        _, pos = _ReadVarint(index, pos)
+        blocks_size += (unpadded + 3) & ~3
+
+    start = index_start - blocks_size - XZ_HEADER_SIZE
+    if start < 0:
+        raise ValueError("blocks do not fit in the file")
+    f.seek(start)
+    header = f.read(XZ_HEADER_SIZE)
+    if header[:6] != XZ_HEADER_MAGIC or header[6:8] != flags:
+        raise ValueError("missing or mismatched stream header")
+    if zlib.crc32(header[6:8]) != struct.unpack('<I', header[8:12])[0]:
+        raise ValueError("stream header CRC mismatch")
+    return start
+
+
+def CheckXzFile(path):
+    """Raise ValueError unless path is a sequence of well-formed xz streams.
+
+    Streams are walked from the end of the file, skipping the null stream
+    padding allowed between them.
+    """
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            raise ValueError("empty file")
+        while end > 0:
+            # stream padding: null bytes in multiples of four
+            while end >= 4:
+                f.seek(end - 4)
+                if f.read(4) != b'\x00\x00\x00\x00':
+                    break
+                end -= 4
+            if end == 0:
+                raise ValueError("file is only padding")
+            end = _CheckXzStream(f, end)
+
+
+def _CopyFile(src, dst_fd):
+    """Append src to dst_fd in the kernel where possible."""
+    with open(src, 'rb') as fin:
+        fd = fin.fileno()
+        size = os.fstat(fd).st_size
+        copied = 0
+        try:
+            if hasattr(os, 'copy_file_range'):
+                while copied < size:
+                    n = os.copy_file_range(fd, dst_fd, size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            else:
+                while copied < size:
+                    n = os.sendfile(dst_fd, fd, None, size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+        except OSError:
+            # e.g. EXDEV on old kernels or filesystems without support
+            pass
+        if copied < size:
+            fin.seek(copied)
+            with os.fdopen(os.dup(dst_fd), 'wb', closefd=True) as fout:
+                shutil.copyfileobj(fin, fout, 1024*1024*10)
+        return size
+
+
+def ConcatXz(inputs, output):
+    """Concatenate xz files into output without recompressing them.
+
+    A concatenation of xz streams is itself a valid xz file, so inputs whose
+    streams check out are copied byte for byte.  Any other input (corrupt,
+    truncated or not xz at all) is recompressed with 'xzcat -f | xz', as the
+    former shell rule did for every input.  Returns the number of inputs
+    that had to be recompressed.
+    """
+    recompressed = 0
+    # unbuffered, so that the copies and the xz subprocess share one file offset
+    with open(output, 'wb', buffering=0) as fout:
+        for path in inputs:
+            try:
+                CheckXzFile(path)
+            except (OSError, ValueError) as ex:
+                sys.stderr.write("Recompressing {0}: {1}\n".format(path, ex))
+                subprocess.check_call("set -o pipefail; xzcat -T 0 -f {0} | xz -c -T 0".format(shlex.quote(path)),
+                    shell=True, executable="/bin/bash", stdout=fout)
+                recompressed += 1
+                continue
+            _CopyFile(path, fout.fileno())
+    return recompressed
+
+
+###########################################################
+# STREAMING COMPRESSED I/O
+
+# compressed bytes read by the read-ahead thread at a time
+READ_CHUNK = 1024 * 1024
+# uncompressed size of an independently compressed xz/gzip block; xz -T0
+# uses three times the dictionary size, i.e. 24 MiB at the default preset
+BLOCK_SIZE = 24 * 1024 * 1024
+TEXT_BUFFER = 1024 * 1024
+
+
+def _Decompressor(kind):
+    if kind == 'xz':
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+    return zlib.decompressobj(wbits=31)
+
+
+def _Decompress(path, kind):
+    """Yield the decompressed bytes of every stream (or member) of path."""
+    with open(path, 'rb') as f:
+        d = _Decompressor(kind)
+        started = False
+        while True:
+            data = f.read(READ_CHUNK)
+            if not data:
+                break
+            while data:
+                if not started:
+                    if kind == 'xz':
+                        # stream padding between concatenated streams
+                        data = data.lstrip(b'\x00')
+                        if not data:
+                            break
+                    started = True
+                out = d.decompress(data)
+                if out:
+                    yield out
+                if d.eof:
+                    data = d.unused_data
+                    d = _Decompressor(kind)
+                    started = False
+                else:
+                    data = b''
+        if started:
+            raise EOFError("{0}: compressed file ended before the end-of-stream marker".format(path))
+
+
+class ReadAheadReader(io.RawIOBase):
+    """Raw reader over a compressed file, decompressed on a background thread.
+
+    The thread keeps up to depth chunks of decompressed data queued, so
+    decompression (which releases the GIL) overlaps with the consumer.
+    """
+
+    def __init__(self, path, kind, depth=4):
+        self._queue = queue.Queue(depth)
+        self._buffer = b''
+        self._eof = False
+        self._closing = threading.Event()
+        self._thread = threading.Thread(target=self._Run, args=(path, kind), daemon=True)
+        self._thread.start()
+
+    def _Run(self, path, kind):
+        try:
+            for chunk in _Decompress(path, kind):
+                while not self._closing.is_set():
+                    try:
+                        self._queue.put(chunk, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if self._closing.is_set():
+                    return
+            self._queue.put(None)
+        except BaseException as ex:
+            self._queue.put(ex)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer and not self._eof:
+            item = self._queue.get()
+            if item is None:
+                self._eof = True
+            elif isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            else:
+                self._buffer = memoryview(item)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._closing.set()
+            # unblock the thread if it is waiting on a full queue
+            while self._thread.is_alive():
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    self._thread.join(0.1)
+        super().close()
+
+
+class ParallelCompressWriter(io.RawIOBase):
+    """Raw writer that compresses block_size pieces independently in threads.
+
+    Each block becomes a complete xz stream (or gzip member); their
+    concatenation is a valid multi-block file, as written by 'xz -T0' or
+    pigz.  Blocks are written in order and at most 2 * threads are in flight.
+    """
+
+    def __init__(self, path, kind, threads=None, block_size=BLOCK_SIZE, preset=6):
+        self._file = open(path, 'wb')
+        self._kind = kind
+        self._preset = preset
+        self._block_size = block_size
+        self._threads = threads or os.cpu_count()
+        self._pool = ThreadPoolExecutor(self._threads)
+        self._pending = collections.deque()
+        self._parts = []
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def _Compress(self, data):
+        if self._kind == 'xz':
+            return lzma.compress(data, format=lzma.FORMAT_XZ, preset=self._preset)
+        c = zlib.compressobj(self._preset, zlib.DEFLATED, 31)
+        return c.compress(data) + c.flush()
+
+    def _Submit(self, data):
+        self._pending.append(self._pool.submit(self._Compress, data))
+        while len(self._pending) >= 2 * self._threads:
+            self._file.write(self._pending.popleft().result())
+
+    def write(self, b):
+        n = len(b)
+        self._parts.append(bytes(b))
+        self._size += n
+        if self._size >= self._block_size:
+            data = b''.join(self._parts)
+            for start in range(0, len(data) - self._block_size + 1, self._block_size):
+                self._Submit(data[start:start + self._block_size])
+            rest = data[len(data) - len(data) % self._block_size:]
+            self._parts = [rest] if rest else []
+            self._size = len(rest)
+        return n
+
+    def close(self):
+        if not self.closed:
+            try:
+                if self._size or not self._pending and self._file.tell() == 0:
+                    # a final (possibly empty) block keeps empty outputs valid
+                    self._Submit(b''.join(self._parts))
+                while self._pending:
+                    self._file.write(self._pending.popleft().result())
+            finally:
+                self._pool.shutdown()
+                self._file.close()
+        super().close()
+
+
+def _Kind(path):
+    if path.endswith(".gz"):
+        return 'gz'
+    if path.endswith(".xz"):
+        return 'xz'
+    return None
+
+
+def OpenCompressed(path, mode='rt', threads=None, preset=6, encoding='utf-8'):
+    """Open a plain, .gz or .xz file, chosen by extension, for streaming.
+
+    Reading decompresses on a read-ahead thread; writing compresses blocks
+    in parallel.  Text modes use large buffers and decode UTF-8; compressed
+    text is split into lines at '\n' only.
+    """
+    kind = _Kind(path)
+    text = 't' in mode or 'b' not in mode
+    if kind is None:
+        if text:
+            return open(path, mode.replace('t', ''), buffering=TEXT_BUFFER, encoding=encoding)
+        return open(path, mode, buffering=TEXT_BUFFER)
+
+    if mode[0] == 'r':
+        f = io.BufferedReader(ReadAheadReader(path, kind), TEXT_BUFFER)
+    elif mode[0] == 'w':
+        f = io.BufferedWriter(ParallelCompressWriter(path, kind, threads, preset=preset), TEXT_BUFFER)
+    else:
+        raise ValueError("unsupported mode for compressed files: " + mode)
+    if text:
+        # lines end at '\n' only, as when splitting the binary stream
+        return io.TextIOWrapper(f, encoding=encoding, newline='\n')
+    return f
+
+
+def AppendFile(src, dst):
+    """Append the file src to the open binary file object dst."""
+    dst.flush()
+    return _CopyFile(src, dst.fileno())
+
+
+def FsyncFile(path):
+    """Flush the data of path to disk, instead of a system-wide os.sync()."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)